@@ -29,79 +29,45 @@
 
 # %%
 # visualization
-import colorcet # colormaps
 import plotnine as gg # a great ggplot clone
 
 # %matplotlib inline
 
 # %%
-# General
-import pandas as pd
-import numpy as np
-import glob
+import helpers.cases as cases
+import helpers.figures as figures
+import helpers.geometry as geometry
+
+# %% [markdown]
+# The metadata related variables (`V`) are shared with the batch scripts.
 
 # %%
-import helpers.library as lib
+from helpers.cases import V
 
+# %%
+
+# %% [markdown]
+# Load data, parse the metadata into the right classes and interpolate the data to get daily values.
+#
+# The results are cached on disk, keyed by the content of the source files, so this only runs when the data changes.
 
 # %%
-class C:
-    """
-    Helper class to keep input configuration.
-    """
-    glob_cases = "data/covid/covid_19/COVID19_Fallzahlen_CH_total_v2.csv"
-    
-    
-class V:
-    """
-    Helper class to keep metadata related variables.
-    """
-    # User columns
-    COL_VARIABLES = 'variables'
-    COL_VALUE = 'value'
-    
-    # Data columns: from the data description from https://github.com/openZH/covid_19
-    COL_DATE = 'date'
-    COL_CANTON = 'abbreviation_canton_and_fl'
-    
-    COL_CUM_CONFIRMED = 'ncumul_conf'
-    COL_CUM_DECEASED = 'ncumul_deceased' # number of deaths
-    COL_CUM_TESTED = 'ncumul_tested'
-    
-    COL_CUR_HOSP = 'current_hosp'
-    COL_CUR_ICU = 'current_icu'
-    COL_CUR_VENT = 'current_vent'
-    
-    COL_CUM_RELEASED = 'ncumul_released'
-    COL_CUM_CURED = 'TotalCured'
-    
-    
-    vars_labels = {COL_CUM_CONFIRMED: 'Total confirmed cases',
-                  COL_CUR_HOSP: 'Current hospitalized cases',
-                  COL_CUM_DECEASED: 'Total deceased cases',
-                  COL_CUR_ICU: 'Current intensive care cases',
-                  COL_CUR_VENT: 'Current ventilator cases',
-                  COL_CUM_RELEASED: 'Total released from hospital',
-                  #COL_CUM_CURED: 'Total cured cases',
-                  COL_CUM_TESTED: 'Total tested cases'
-        
-    }
-    vars_all = vars_labels.keys()
-    
-    # My main variables of interest
-    vars_main = [COL_CUM_CONFIRMED,
-                     COL_CUM_DECEASED,
-                     COL_CUR_HOSP]
+dats = cases.load_cases_cached()
+dat_total, dat_daily = dats['dat_total'], dats['dat_daily']
 
+# %% [markdown]
+# Share the daily data with other processes (e.g. the batch renderer) through a memory mapped store.
+# Slices only read the selected cantons and variables.
 
 # %%
+store = cases.store_daily(dat_daily)
+store.frame(cantons=['ZH', 'BE'], variables=V.vars_main).tail()
 
 # %% [markdown]
-# Load data
+# Melt the daily data only once, the plots below take (cached) views of it.
 
 # %%
-tdats = map(pd.read_csv, glob.glob(C.glob_cases))
-dat_total = pd.concat(tdats)
+dats['dat_long'] = dat_long = cases.long_view(dat_daily)
 
 # %%
 dat_total.columns
@@ -110,54 +76,38 @@ dat_total.columns
 dat_total.tail()
 
 # %% [markdown]
-# ## Start Visualizations
-#
-#
+# 7 day averages of the daily values, centered on the day
+
+# %%
+dat_daily_7d = cases.rolling_mean(dat_daily, 7, center=True)
+dat_daily_7d.tail()
 
 # %% [markdown]
-# Parsing of metadata into the right classes
+# New cases per day, in the last 7 days, growth rates and doubling times of the cumulative variables.
+# Corrections (decreasing cumulative counts) are applied to the earlier days, so new counts are never negative.
 
 # %%
-dat_total[V.COL_DATE] = pd.to_datetime(dat_total[V.COL_DATE], dayfirst=True)
-dat_total[V.COL_CANTON] = pd.Categorical(dat_total[V.COL_CANTON])
+dat_derived = cases.derived_metrics(dat_daily)
+dat_derived.tail()
 
 # %% [markdown]
-# Interpolate data to get daily values
+# All variables per 100'000 inhabitants of the canton, with the population of the BFS scenario for the year of the date.
 
 # %%
-dat_daily = lib.transform_daily_per_canton(dat_total, V.vars_all, col_canton=V.COL_CANTON, col_date=V.COL_DATE)
+population = cases.load_population()
+dat_daily_100k = cases.per_100k(dat_daily, population)
+dat_daily_100k.tail()
+
+# %% [markdown]
+# ## Start Visualizations
+#
+#
 
 # %% [markdown]
 # Plot the most interesting values over time
 
 # %%
-cur_vars = V.vars_main
-
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-    
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}', y=V.COL_VALUE, fill=V.COL_CANTON))
-     + gg.facet_grid(f'{V.COL_VARIABLES}~.', scales='free_y')
-     + gg.geom_bar(stat='identity')
-     + gg.scale_fill_manual(colorcet.glasbey, name='Cantons')
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Covid-19 in Switzerland')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(3,10)
-               )
- 
- 
-)
+g = figures.cases_stacked(dats, V.vars_main)
 g
 
 # %% [markdown]
@@ -166,118 +116,28 @@ g
 #
 
 # %%
-cord = (dat_daily
-    .groupby(V.COL_CANTON)
-    [V.COL_CUM_DECEASED].mean()
-    .sort_values(ascending=False)
-    .index
-)
-cat_cantons_deceased= pd.CategoricalDtype(cord.astype(str), ordered=True)
+cat_cantons_deceased = cases.order_cantons(dat_daily, V.COL_CUM_DECEASED)
 
 # %% [markdown]
 # Sorted cantons
 
 # %%
-cur_vars = V.vars_main
-
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=True)})
-    
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}', y=V.COL_VALUE, fill=V.COL_CANTON))
-     + gg.facet_grid(f'{V.COL_VARIABLES}~.', scales='free_y')
-     + gg.geom_bar(stat='identity')
-     + gg.scale_fill_manual(colorcet.glasbey, name='Cantons',
-                            guide = gg.guide_legend(reverse = True))
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Covid-19 in Switzerland')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(3,10)
-               )
- 
- 
-)
+g = figures.cases_stacked(dats, V.vars_main, cat_cantons_deceased, rev=True)
 g
 
 # %% [markdown]
 # Also plot all the variables - this might be informative but also wil be quite messy
 
 # %%
-cur_vars = V.vars_all
-
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=True)})
-    
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}', y=V.COL_VALUE, fill=V.COL_CANTON))
-     + gg.facet_wrap(f'{V.COL_VARIABLES}', scales='free_y')
-     + gg.geom_bar(stat='identity')
-     + gg.scale_fill_manual(colorcet.glasbey, name='Cantons',
-                            guide = gg.guide_legend(reverse = True))
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Covid-19 in Switzerland')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(10,10),
-                subplots_adjust={'wspace': 0.4})
- 
- 
-)
+g = figures.cases_stacked(dats, V.vars_all, cat_cantons_deceased, rev=True,
+                          facet='wrap', figure_size=(10, 10))
 g
 
 # %% [markdown]
 # While this gives quite a good overview, it might be interesting to visualize these per canton, so per canton trends are better visible:
 
 # %%
-cur_vars = V.vars_main
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)})
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}',
-                      y=V.COL_VALUE,
-                      color=V.COL_VARIABLES))
-     + gg.facet_wrap(f'{V.COL_CANTON}')
-     + gg.geom_line(stat='identity')
-     + gg.scale_color_manual(colorcet.glasbey)
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.scale_y_log10()
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Cases per canton')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(10,10))
- 
-)
+g = figures.cases_per_canton(dats, V.vars_main, cat_cantons_deceased, scale='log10')
 g
 
 # %%
@@ -286,172 +146,73 @@ g + gg.scale_y_continuous()
 
 # %%
 # linear scale but with individual scaling
-
-cur_vars = V.vars_main
-
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)})
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}',
-                      y=V.COL_VALUE,
-                      color=V.COL_VARIABLES))
-     + gg.facet_wrap(f'{V.COL_CANTON}', scales='free_y')
-     + gg.geom_line(stat='identity')
-     + gg.scale_color_manual(colorcet.glasbey)
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Cases per canton')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(10,10),
-                subplots_adjust={'wspace': 0.4})
- 
-)
+g = figures.cases_per_canton(dats, V.vars_main, cat_cantons_deceased, scale='free_y')
 g
 
 # %% [markdown]
 # Plot each variable individually + overlay original data points
 
 # %%
-g = (dat_daily
-    .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)})
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}'))
-     + gg.facet_wrap(f'{V.COL_CANTON}')
-     + gg.scale_fill_manual(colorcet.glasbey)
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.scale_y_log10()
-     + gg.xlab('Date')
-     + gg.theme_minimal()
-     +gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1))
- 
-)
-    
-dt = (dat_total.assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)}))
 for var in V.vars_main:
-    (g + gg.geom_line(gg.aes(y=var), color='grey')
-     + gg.geom_point(gg.aes(y=var), data=dt, color='black')
-     + gg.ylab(V.vars_labels[var])
-        + gg.ggtitle(V.vars_labels[var])).draw() 
+    figures.variable_per_canton(dats, var, cat_cantons_deceased).draw()
 
 # %% [markdown]
 # Also once for all parameters:
 
 # %%
-cur_vars = V.vars_all
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)})
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}',
-                      y=V.COL_VALUE,
-                      color=V.COL_VARIABLES))
-     + gg.facet_wrap(f'{V.COL_CANTON}')
-     + gg.geom_line(stat='identity')
-     + gg.scale_color_manual(colorcet.glasbey)
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.scale_y_log10()
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Cases per canton')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(10,10))
- 
-)
+g = figures.cases_per_canton(dats, V.vars_all, cat_cantons_deceased, scale='log10')
 g
 
 # %%
 # linear scale but with individual scaling
-
-cur_vars = V.vars_all
-
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)})
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}',
-                      y=V.COL_VALUE,
-                      color=V.COL_VARIABLES))
-     + gg.facet_wrap(f'{V.COL_CANTON}', scales='free_y')
-     + gg.geom_line(stat='identity')
-     + gg.scale_color_manual(colorcet.glasbey)
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Cases per canton')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(10,10),
-                subplots_adjust={'wspace': 0.4})
- 
-)
+g = figures.cases_per_canton(dats, V.vars_all, cat_cantons_deceased, scale='free_y')
 g
 
 # %%
 # linear scale but with individual scaling, without  Total confirmed/tested
 
-cur_vars = V.vars_all
-
-g = (dat_daily
-     .melt(id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=cur_vars,
-           var_name=V.COL_VARIABLES,
-          value_name=V.COL_VALUE)
-     .query(f'{V.COL_VARIABLES} not in {[V.COL_CUM_CONFIRMED, V.COL_CUM_TESTED, V.COL_CUM_RELEASED]}')
-     .assign(**{V.COL_VARIABLES:
-                lambda x: pd.Categorical(x[V.COL_VARIABLES],
-                                         categories=cur_vars)
-                          .rename_categories(V.vars_labels)})
-         .assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON],cat_cantons_deceased,
-                                                 rev=False)})
-     >>
-     gg.ggplot(gg.aes(x=f'{V.COL_DATE}',
-                      y=V.COL_VALUE,
-                      color=V.COL_VARIABLES))
-     + gg.facet_wrap(f'{V.COL_CANTON}', scales='free_y')
-     + gg.geom_line(stat='identity')
-     + gg.scale_color_manual(colorcet.glasbey)
-     + gg.scale_x_datetime(date_breaks='1 week')
-     + gg.xlab('Date')
-     + gg.ylab('Cases')
-     + gg.ggtitle('Cases per canton')
-     + gg.theme_minimal()
-     + gg.theme(axis_text_x = gg.element_text(angle = 90, hjust = 1),
-               figure_size=(10,10),
-                subplots_adjust={'wspace': 0.4})
- 
-)
+cur_vars = [v for v in V.vars_all
+            if v not in [V.COL_CUM_CONFIRMED, V.COL_CUM_TESTED, V.COL_CUM_RELEASED]]
+# all variables stay categories, so the colors match the plots above
+g = figures.cases_per_canton(dats, cur_vars, cat_cantons_deceased, scale='free_y',
+                             categories=V.vars_all)
 g
 
+# %% [markdown]
+# For the nightly report, all figures (every variable, canton ordering and scale) can be rendered headless in parallel.
+# This is what `render_report.py` does:
+
+# %%
+# import helpers.render as render
+# specs = figures.report_specs({'alphabetical': None, 'deceased': cat_cantons_deceased})
+# render.render_figures(specs, dats, 'figures', formats=('png', 'svg'))
+
+# %% [markdown]
+# The same stages as cached pipeline: loading and parsing -> interpolation -> canton ordering -> long view -> figures.
+# Outputs are stored on disk keyed by their inputs (data files, parameters and the code of the stage),
+# so only stages whose inputs changed are recomputed, figures are rendered in parallel.
+
+# %%
+report = figures.report_pipeline()
+out = report.run(['fig_stacked_main_deceased', 'fig_per_canton_main_log10_deceased'])
+
+# %%
+from IPython import display
+display.Image(out['fig_stacked_main_deceased'])
+
+# %% [markdown]
+# Confirmed cases per 100'000 inhabitants on the last day on the map of Switzerland.
+# The canton borders are parsed and simplified once and cached, drawing another day only changes the colors
+# (`collection.set_facecolor(geometry.face_colors(geom, values))`).
+
+# %%
+geom = geometry.Geometry.load()
+fig, canton_collection = figures.canton_map(dat_daily_100k, V.COL_CUM_CONFIRMED,
+                                            dat_daily_100k[V.COL_DATE].max(), geom=geom, tolerance=0.002)
+
 # %% [markdown]
 # Where to go from here:
-# - Correlating data with canton population size
-# - Mapping on Swiss map
+# - Mapping on Swiss map: animation over the days
 # - Spatio-temporal analysis with R-inla?
 # - Idea: Sankey plot with 'hospitalized cases', cantons sorted by nr => Could also be done per country
 
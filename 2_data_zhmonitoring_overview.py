@@ -30,92 +30,38 @@
 # import calendar
 # import pathlib
 
-# %%
-# visualization
-import colorcet  # colormaps
-import numpy as np
 # %%
 # General
-import calendar
+import numpy as np
 import pandas as pd
-import plotnine as gg  # a great ggplot clone
-
-import pathlib
 # %matplotlib inline
 
 # %%
+import helpers.figcache as figcache
+import helpers.figures as figures
+import helpers.monitoring as mon
+import helpers.pipeline as pipeline
+import helpers.render as render
+import helpers.trace as trace
+import helpers.zhmonitoring as zhm
 
+# %% [markdown]
+# The configuration (`C`), the metadata related variables (`V`) and the data preparation are shared with
+# batch jobs (`helpers/zhmonitoring.py`). The plotting stack is only imported by the plotting cells.
 
 # %%
-class C:
-    """
-    Helper class to keep input configuration.
-    """
-    fol_zhmonitor = pathlib.Path('./data/monitoring/covid19monitoring/')
-    fn_zhmonitor_data = fol_zhmonitor / 'covid19socialmonitoring.csv'
-    fn_zhmonitor_meta = fol_zhmonitor / 'Metadata.csv'
-
-    day_start = pd.to_datetime('2020-01-06')
-    day_intervention_v1 = pd.to_datetime('2020-02-28')  # First ban of large events
-    day_intervention_v2 = pd.to_datetime('2020-03-13')  # School closures
-    day_intervention_v3 = pd.to_datetime('2020-03-16')  # Lock down
-
-    days_intervention = [day_intervention_v1, day_intervention_v2, day_intervention_v3]
-
-    cm_discrete = colorcet.glasbey
-
-
-class V:
-    """
-    Helper class to keep metadata related variables.
-    """
-    # Data columns:
-    COL_VARIABLES = 'variable_short'
-    COL_VALUE = 'value'
-    COL_DATE = 'date'
-    COL_LOCATION = 'location'
-
-    # Main data columns
-    cols_data = [COL_VARIABLES, COL_VALUE, COL_DATE, COL_LOCATION]
-
-    # User data columns
-    COL_MONTH = 'month'
-    COL_YEAR = 'year'
-    COL_WEEK = 'week'
-    COL_ISWEEKDAY = 'is_weekday'
-    COL_DAYOFWEEK = 'dayofweek'
-    COL_HASFULLWEEK = 'fullweek'  # is the measurement available for all days of that week
-    COL_HASCLOSEFULLWEEK = 'almostfullweek'
-
-    COL_VALUE_LOG10 = 'value_log'
-    COL_VALUE_NORM = 'value_norm'
-    # Meta columns:
-    COL_TOPIC = 'topic'
-    COL_VAR_DESC = 'variable_long'
-    COL_LOCATION = 'location'
-    COL_UNIT = 'unit'
-    COL_SOURCE = 'source'
-    COL_UPDATE = 'update'
-    COL_PUBLIC = 'public'
-    COL_DESC_LINK = 'description'
-    COL_MODIFIED = 'last_modified'
-
-    # Categorical columns
-    cols_cat = [COL_VARIABLES, COL_VAR_DESC, COL_LOCATION,
-                COL_UNIT, COL_SOURCE, COL_UPDATE, COL_DESC_LINK]
-
-    cols_date = [COL_MODIFIED,
-                 COL_DATE]
+from helpers.zhmonitoring import C, V
 
-    COL_CANTON = 'abbreviation_canton_and_fl'
 
+# %%
+if C.fn_trace is not None:
+    trace.enable()
 
 # %% [markdown]
 # ## Load and structure data
 
 # %%
-dat_zhmonitor = pd.read_csv(C.fn_zhmonitor_data)
-dat_zhmonitor_m = pd.read_csv(C.fn_zhmonitor_meta)
+dat_zhmonitor, dat_zhmonitor_m = zhm.read_monitoring()
 
 # %%
 dat_zhmonitor.head()
@@ -126,61 +72,32 @@ dat_zhmonitor.head()
 dat_zhmonitor_m.head()
 
 # %%
-# Delete redundant variables in data
-dat_zhmonitor = dat_zhmonitor[V.cols_data]
-
-
-# %%
-# Convert date
-def apply_to_cols(df, cols, fkt, inplace=True):
-    if not inplace:
-        df = df.copy()
-    for c in set(cols).intersection(df.columns):
-        df.loc[:, c] = fkt(df.loc[:, c])
-    return df
-
-
-# %%
-# Convert variables to datetime and categorical
-for d in [dat_zhmonitor, dat_zhmonitor_m]:
-    apply_to_cols(d, V.cols_date, pd.to_datetime)
-    apply_to_cols(d, V.cols_cat, pd.Categorical)
+# Index the metadata by indicator, to attach it to the observations without merging
+meta_index = zhm.meta_index(dat_zhmonitor_m)
 
 # %%
 dat_zhmonitor
 
 # %%
-# Convert date into week, year and weekday
-
-dat_zhmonitor[V.COL_DAYOFWEEK] = pd.Categorical.from_codes(dat_zhmonitor[V.COL_DATE].dt.dayofweek,
-                                                           categories=list(calendar.day_abbr), ordered=True)
-
-# %%
-dat_zhmonitor[V.COL_MONTH] = pd.Categorical.from_codes(dat_zhmonitor[V.COL_DATE].dt.month,
-                                                       categories=list(calendar.month_abbr))
-
-# %%
-dat_zhmonitor[V.COL_WEEK] = pd.Categorical.from_codes(dat_zhmonitor[V.COL_DATE].dt.week,
-                                                      categories=[str(i) for i in range(53)])
-
-# %%
-dat_zhmonitor[V.COL_YEAR] = pd.Categorical(dat_zhmonitor[V.COL_DATE].dt.year.astype(str))
-
-# %%
-# Convert date into week, year and weekday
-
-dat_zhmonitor[V.COL_ISWEEKDAY] = dat_zhmonitor[V.COL_DATE].dt.dayofweek < 5
+# Convert date into a day number, all calendar features are small integer codes derived from it.
+# The days with measurements are counted once per week, all full week flags are derived from this count.
+dat_zhmonitor = zhm.add_calendar_features(dat_zhmonitor)
 
-# %%
+# %% [markdown]
+# Compact storage, e.g. for long histories with many locations: the calendar features and flags are
+# derived on demand from the int32 day number and the values are stored as float32.
 
 # %%
-dat_zhmonitor[V.COL_HASFULLWEEK] = dat_zhmonitor.groupby([V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES, V.COL_LOCATION])[
-    V.COL_VALUE].transform(lambda x: np.sum(np.isfinite(x)) == 7)
+dat_zhmonitor_compact = mon.compact(dat_zhmonitor, value_cols=[V.COL_VALUE],
+                                    drop_cols=[V.COL_DATE, V.COL_DAYOFWEEK, V.COL_MONTH, V.COL_WEEK, V.COL_YEAR,
+                                               V.COL_ISWEEKDAY, V.COL_HASFULLWEEK, V.COL_HASCLOSEFULLWEEK])
+print('Maximal relative error of the float32 values:',
+      np.nanmax(np.abs(dat_zhmonitor_compact[V.COL_VALUE] / dat_zhmonitor[V.COL_VALUE] - 1)))
+mon.memory_report({'full': dat_zhmonitor, 'compact': dat_zhmonitor_compact}) / 1024 ** 2  # MB
 
 # %%
-dat_zhmonitor[V.COL_HASCLOSEFULLWEEK] = \
-dat_zhmonitor.groupby([V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES, V.COL_LOCATION])[V.COL_VALUE].transform(
-    lambda x: np.sum(np.isfinite(x)) >= 5)
+# Calendar features are derived when needed
+mon.add_calendar(dat_zhmonitor_compact, V.COL_DAY, {V.COL_YEAR: 'isoyear', V.COL_WEEK: 'week'}).head()
 
 # %%
 dat_zhmonitor[V.COL_DAYOFWEEK].tail()
@@ -195,11 +112,11 @@ dat_zhmonitor[V.COL_ISWEEKDAY].tail()
 dat_zhmonitor.query(f'{V.COL_VARIABLES} == "tages_distanz_median"')
 
 # %%
+import plotnine as gg  # a great ggplot clone
+
 p = (dat_zhmonitor
-     .merge(dat_zhmonitor_m[[V.COL_VARIABLES, V.COL_VAR_DESC, V.COL_UNIT, V.COL_LOCATION]])
-     .assign(**{'label': lambda x: x.apply(
-    lambda r: f'{r[V.COL_VARIABLES]}\n{r[V.COL_VAR_DESC]}\n{r[V.COL_LOCATION]}\nin {r[V.COL_UNIT]}',
-    axis=1)})
+     .pipe(meta_index.attach, [V.COL_VAR_DESC, V.COL_UNIT])
+     .assign(**{V.COL_LABEL: lambda x: meta_index.labels(x, zhm.format_label)})
      >>
      gg.ggplot(gg.aes(x=V.COL_DATE, y=V.COL_VALUE, color=V.COL_DAYOFWEEK, shape=V.COL_ISWEEKDAY))
      + gg.facet_grid(f'label~.', scales='free'
@@ -222,21 +139,22 @@ p = (dat_zhmonitor
      + gg.ggtitle('Overview of all indicators')
 
      )
-(p
- + gg.scale_x_date(limits=[dat_zhmonitor[V.COL_DATE].min(), dat_zhmonitor[V.COL_DATE].max()],
-                   breaks=pd.date_range(dat_zhmonitor[V.COL_DATE].min(),
-                                        dat_zhmonitor[V.COL_DATE].max(), freq='W-MON'))
- )
+# The figure is huge and slow to draw: it is cached and only redrawn if the data changes.
+# Change the key when changing the plot.
+figcache.show(p
+              + gg.scale_x_date(limits=[dat_zhmonitor[V.COL_DATE].min(), dat_zhmonitor[V.COL_DATE].max()],
+                                breaks=pd.date_range(dat_zhmonitor[V.COL_DATE].min(),
+                                                     dat_zhmonitor[V.COL_DATE].max(), freq='W-MON')),
+              key='overview_all_indicators')
 
 # %%
 # It seems that it would be better to only focus on the data since 03.01 - start after XMAS break
 
-(p
- + gg.scale_x_date(limits=[C.day_start, dat_zhmonitor[V.COL_DATE].max()],
-                   breaks=pd.date_range(dat_zhmonitor[V.COL_DATE].min(),
-                                        dat_zhmonitor[V.COL_DATE].max(), freq='W-MON'))
-
- )
+figcache.show(p
+              + gg.scale_x_date(limits=[C.day_start, dat_zhmonitor[V.COL_DATE].max()],
+                                breaks=pd.date_range(dat_zhmonitor[V.COL_DATE].min(),
+                                                     dat_zhmonitor[V.COL_DATE].max(), freq='W-MON')),
+              key='overview_all_indicators_since_start')
 
 # %%
 
@@ -259,20 +177,19 @@ p = (dat_zhmonitor
 # - Normalize by average levels of weekdays - weekends seem often more variable/outliers
 #     -> TODO: Check if really true
 
+# %% [markdown]
+# Aggregate the observations once into a cube of sufficient statistics (count, sum, sum of squares, min, max)
+# per (year, week, weekday, indicator, location, topic).
+# All the statistics below are roll-ups of this cube, new days can be added with `agg_cube.add`.
+
 # %%
-# Quickly check variability of weekdays vs weekends over weeks
-tdat = (dat_zhmonitor
-        .merge(dat_zhmonitor_m[[V.COL_VARIABLES, V.COL_TOPIC, V.COL_LOCATION]])
-        # .query(f'{V.COL_DATE} < {C.days_intervention[0]}') # doesnt work with dates yet
-        .query(f'{V.COL_HASFULLWEEK} == True')
-        .pipe(lambda d: d.loc[d[V.COL_DATE] < C.days_intervention[0], :])  # only before intervention
-        .groupby([V.COL_DAYOFWEEK, V.COL_VARIABLES, V.COL_TOPIC, V.COL_LOCATION], observed=True)[V.COL_VALUE].describe()
-        .reset_index()
-        .assign(**{'cv': lambda x: x['std'] / np.abs(x['mean'])})
-        .assign(**{'cv_norm': lambda d: d.groupby([V.COL_VARIABLES, V.COL_LOCATION])['cv']
-                .transform(lambda x: x / x.mean())})
+agg_cube = zhm.aggregate(dat_zhmonitor, meta_index)
 
-        )
+# %%
+# Quickly check variability of weekdays vs weekends over full weeks before the intervention
+import colorcet  # colormaps
+
+tdat = zhm.weekday_variability(agg_cube)
 
 (tdat >>
  gg.ggplot(gg.aes(x=V.COL_DAYOFWEEK, y='cv', color=V.COL_VARIABLES))
@@ -314,7 +231,7 @@ tdat = (dat_zhmonitor
  + gg.facet_grid(f'{V.COL_DAYOFWEEK}~{V.COL_TOPIC}')
  + gg.geom_histogram()
  + gg.geom_vline(gg.aes(xintercept='cv_norm', color=V.COL_VARIABLES))
- + gg.scale_color_manual(C.cm_discrete)
+ + gg.scale_color_manual(colorcet.glasbey)
  + gg.geom_vline(gg.aes(xintercept='cv_norm'),
                  data=(tdat
                        .groupby([V.COL_TOPIC], observed=True)['cv_norm']
@@ -336,39 +253,14 @@ tdat = (dat_zhmonitor
 # -> **I normalize over the whole week now.**
 
 # %%
-dat_zhmonitor = (dat_zhmonitor
-                 .assign(**{
-    V.COL_VALUE_LOG10: lambda x: np.log10(x[V.COL_VALUE])})
-                 .assign(**{
-    # V.COL_VALUE_NORM:
-    # lambda d: (d.groupby([V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES],group_keys=False))
-    #           .apply(lambda x:
-    #                      x[V.COL_VALUE_LOG10]-x.loc[x[V.COL_ISWEEKDAY] == True, V.COL_VALUE_LOG10].mean())
-
-    V.COL_VALUE_NORM:
-        lambda d: (d.groupby([V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES], group_keys=False)
-                   .apply(lambda x:
-                          x[V.COL_VALUE] / x[V.COL_VALUE].mean())
-                   )
-
-})
-                 )
+# Normalized by the calendar week average, see zhm.normalize for normalizing by the weekday average only
+dat_zhmonitor = zhm.normalize(dat_zhmonitor)
 
 # %% [markdown]
 # How do the previous plot look per week?
 
 # %%
-pdat = (dat_zhmonitor
-        .query(f'{V.COL_HASCLOSEFULLWEEK} == True')
-
-        .pipe(lambda d: d.loc[d[V.COL_DATE] >= C.day_start, :])  # only before intervention
-        .pipe(lambda d: d.loc[np.isfinite(d[V.COL_VALUE_NORM]), :])  # only finite
-        .merge(dat_zhmonitor_m[[V.COL_VARIABLES, V.COL_VAR_DESC, V.COL_UNIT,
-                                V.COL_LOCATION, V.COL_TOPIC]])
-        .assign(**{'label': lambda x: x.apply(
-    lambda r: f'{r[V.COL_VARIABLES]}\n{r[V.COL_VAR_DESC]}\n{r[V.COL_LOCATION]}\nin {r[V.COL_UNIT]}',
-    axis=1)})
-        )
+pdat = zhm.plot_data(dat_zhmonitor, meta_index)
 p = (pdat >>
      gg.ggplot(gg.aes(x=V.COL_DATE, y=V.COL_VALUE_NORM, color=V.COL_DAYOFWEEK, shape=V.COL_ISWEEKDAY))
      + gg.facet_grid(f'label~.', scales='free'
@@ -394,12 +286,20 @@ p = (pdat >>
      + gg.scale_y_log10()
      + gg.ggtitle('Overview of all indicators normalized by week average')
      )
-p
+figcache.show(p, key='overview_all_indicators_normalized')
 
 # %% [markdown]
 # - I have to think if using the rolling average of the last 7 days wouldn't be more meaningful.
 # - Given more data it would be definitely good to take the mean over the previous and next days
 
+# %% [markdown]
+# Rolling baselines per indicator and location: the mean of the previous 7 days,
+# the mean over the previous and next days and the mean of the same weekday over the previous weeks.
+# Missing days are ignored, the windows are in days (not rows).
+
+# %%
+dat_zhmonitor = zhm.rolling_baselines(dat_zhmonitor)
+
 # %% [markdown]
 # ### Observations
 # - The main day for shopping stationaries has shifted from Saturday to Friday
@@ -518,6 +418,50 @@ p = (pdat
      )
 p
 
+# %% [markdown]
+# The same overview for every topic. The figures are nodes of a cached pipeline:
+# they are rendered in parallel and only redrawn if the data or the plot function changed.
+
+# %%
+topic_figures = pipeline.Pipeline(fol_cache='.cache/zhmonitoring')
+topic_figures.add_value('pdat', pdat.assign(label=lambda d: d['label'].astype(str)))
+topics = sorted(pdat[V.COL_TOPIC].dropna().unique())
+for topic in topics:
+    topic_figures.add(f'fig_{topic}', render.figure_image, deps=['pdat'],
+                      params=dict(fkt=figures.topic_plot, kwargs={'topic': topic}), code=[figures])
+out = topic_figures.run()
+
+# %%
+from IPython.display import Image, display
+Image(out[f'fig_{topics[0]}'])
+
+# %% [markdown]
+# ## Do changes of the indicators lead changes of the cases?
+# Lagged correlations of every indicator (log values) with the growth rates of the cumulative case numbers
+# of Zurich (openZH). A positive lag means that the indicator leads the cases by that many days.
+
+# %%
+import helpers.cases as cases
+import helpers.crosscorr as crosscorr
+
+dat_cases = cases.derived_metrics(cases.load_cases_cached()['dat_daily'])
+cases_zh = (dat_cases.loc[dat_cases[V.COL_CANTON] == 'ZH', :]
+            .set_index(cases.V.COL_DATE)
+            [[f'{c}_growth' for c in cases.V.vars_cumulative]])
+indicators = crosscorr.daily_matrix(dat_zhmonitor, V.COL_VALUE_LOG10, V.COL_DATE,
+                                    [V.COL_VARIABLES, V.COL_LOCATION])
+dat_lagcorr = crosscorr.lagged_correlation(indicators, cases_zh, lags=range(-14, 29))
+crosscorr.best_lags(dat_lagcorr).head(20)
+
+# %% [markdown]
+# Timings and memory of the stages, if tracing is enabled (`C.fn_trace`)
+
+# %%
+if trace.is_enabled():
+    tracer = trace.disable()
+    tracer.save(C.fn_trace)
+    display(tracer.summary())
+
 # %% [markdown]
 # My conda environment
 
@@ -0,0 +1,71 @@
+"""
+Compares helpers.crosscorr.lagged_correlation to pandas' corr of shifted
+series, and checks that both give the same correlations, also for series
+shorter than the lags.
+
+Run from the repository root:
+    python -m benchmarks.bench_crosscorr
+"""
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import helpers.crosscorr as crosscorr
+from benchmarks.bench_transform_daily import best_of
+from benchmarks.synthetic import make_monitoring
+
+COL_DATE = 'date'
+COL_VALUE = 'value'
+COL_VARIABLE = 'variable_short'
+COL_LOCATION = 'location'
+
+
+def corr_shifted(x, y, lags, min_periods):
+    """
+    Reference of lagged_correlation: pandas' corr per pair of series and lag.
+    """
+    x = x.where(np.isfinite(x))
+    y = y.where(np.isfinite(y))
+    rows = []
+    for cx in x.columns:
+        for cy in y.columns:
+            for lag in lags:
+                pair = pd.DataFrame({'x': x[cx], 'y': y[cy].shift(-lag)}).dropna()
+                rows.append((str(cx), str(cy), lag, pair['x'].corr(pair['y'], min_periods=max(min_periods, 2)),
+                             len(pair)))
+    return pd.DataFrame(rows, columns=[crosscorr.COL_X, crosscorr.COL_Y, crosscorr.COL_LAG,
+                                       crosscorr.COL_CORR, crosscorr.COL_N])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--days', type=int, nargs='+', default=[5, 20, 365])
+    parser.add_argument('--indicators', type=int, default=6)
+    parser.add_argument('--locations', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    lags = range(-14, 29)
+    min_periods = 3
+
+    print(f'{"days":>6} {"pairs":>7} {"pandas [s]":>11} {"numpy [s]":>10} {"speedup":>8}')
+    for n_days in args.days:
+        df, _ = make_monitoring(n_variables=args.indicators, n_locations=args.locations, n_days=n_days,
+                                col_date=COL_DATE, col_value=COL_VALUE,
+                                col_variable=COL_VARIABLE, col_location=COL_LOCATION)
+        x = crosscorr.daily_matrix(df, COL_VALUE, COL_DATE, [COL_VARIABLE, COL_LOCATION])
+        y = x.iloc[:, :2]
+        with warnings.catch_warnings():
+            # numpy must not warn on all missing lags
+            warnings.simplefilter('error', RuntimeWarning)
+            t_np, res_np = best_of(lambda: crosscorr.lagged_correlation(x, y, lags=lags, min_periods=min_periods),
+                                   args.repeat)
+        t_pd, res_pd = best_of(lambda: corr_shifted(x, y, lags, min_periods), args.repeat)
+        res_np = res_np.assign(**{c: res_np[c].astype(str) for c in (crosscorr.COL_X, crosscorr.COL_Y)})
+        pd.testing.assert_frame_equal(res_np, res_pd, check_dtype=False)
+        print(f'{n_days:>6} {x.shape[1] * y.shape[1]:>7} {t_pd:>11.3f} {t_np:>10.3f} {t_pd / t_np:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Times helpers.jhu.load_reports without cache, with an unchanged cache and after
+new reports were added, and checks that all loads give the same rows.
+
+Run from the repository root:
+    python -m benchmarks.bench_jhu
+"""
+import argparse
+import pathlib
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+import helpers.jhu as jhu
+from benchmarks.synthetic import write_reports
+
+
+def timed(fkt):
+    t0 = time.perf_counter()
+    res = fkt()
+    return time.perf_counter() - t0, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--provinces', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--added', type=int, default=7)
+    args = parser.parse_args()
+
+    fol = pathlib.Path(tempfile.mkdtemp())
+    try:
+        fol_reports, fol_cache = fol / 'reports', fol / 'cache'
+        files = write_reports(fol_reports, n_countries=args.countries, n_provinces=args.provinces,
+                              n_days=args.days + args.added)
+        # Hold back the last reports, they are added before the incremental load
+        for f in files[args.days:]:
+            f.rename(fol / f.name)
+        kwargs = dict(fol_reports=fol_reports, fol_cache=fol_cache, verbose=False)
+        t_cold, rows_cold = timed(lambda: jhu.load_reports(**kwargs))
+        t_warm, rows_warm = timed(lambda: jhu.load_reports(**kwargs))
+        for f in files[args.days:]:
+            (fol / f.name).rename(f)
+        t_added, rows_added = timed(lambda: jhu.load_reports(**kwargs))
+        shutil.rmtree(fol_cache)
+        rows_full = jhu.load_reports(**kwargs)
+
+        pd.testing.assert_frame_equal(rows_warm, rows_cold, check_exact=True)
+        pd.testing.assert_frame_equal(rows_added, rows_full, check_exact=True)
+        pd.testing.assert_frame_equal(jhu.load_reports(**kwargs), rows_full, check_exact=True)
+        print(f'{len(rows_full):,} rows')
+        print(f'{"load":<24} {"reports":>8} {"time [s]":>9}')
+        print(f'{"no cache":<24} {args.days:>8} {t_cold:>9.3f}')
+        print(f'{"unchanged":<24} {args.days:>8} {t_warm:>9.3f}')
+        print(f'{f"{args.added} reports added":<24} {len(files):>8} {t_added:>9.3f}')
+    finally:
+        shutil.rmtree(fol)
+
+
+if __name__ == '__main__':
+    main()
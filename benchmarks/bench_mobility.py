@@ -0,0 +1,63 @@
+"""
+Compares slicing helpers.mobility.MobilityStore to boolean filtering
+of the whole reports, and checks that both give the same rows.
+
+Run from the repository root:
+    python -m benchmarks.bench_mobility
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import helpers.mobility as mob
+from benchmarks.bench_transform_daily import best_of
+from benchmarks.synthetic import make_mobility
+
+
+def filter_reports(df, countries=None, regions=None, categories=None, start=None, end=None):
+    """
+    Reference of MobilityStore.sel: boolean masks over all rows, then sorting.
+    """
+    is_sel = np.ones(len(df), dtype=bool)
+    for c, labels in zip(mob.COLS_SERIES, (countries, regions, categories)):
+        if labels is not None:
+            is_sel &= df[c].isin([labels] if isinstance(labels, str) else labels).to_numpy()
+    if start is not None:
+        is_sel &= (df[mob.COL_DATE] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        is_sel &= (df[mob.COL_DATE] <= pd.Timestamp(end)).to_numpy()
+    return df.loc[is_sel, :].sort_values(mob.COLS_INDEX, kind='stable').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--countries', type=int, default=150)
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    raw = make_mobility(n_countries=args.countries, n_regions=args.regions, n_days=args.days)
+    store = mob.MobilityStore.from_reports(raw)
+    df = store.rows
+    queries = {'country': dict(countries='C001'),
+               'region, dated': dict(countries='C002', regions='R003',
+                                     start='2020-03-01', end='2020-04-30'),
+               'countries, total, dated': dict(countries=['C003', 'C004'], regions=mob.REGION_TOTAL,
+                                               start='2020-03-01', end='2020-03-10'),
+               'category, from start': dict(categories='cat_1', end='2020-02-20'),
+               'after the end': dict(countries='C005', start='2030-01-01'),
+               'all, dated': dict(start='2020-06-01')}
+
+    print(f'{len(df):,} rows')
+    print(f'{"query":<24} {"rows":>9} {"filter [s]":>11} {"store [s]":>10} {"speedup":>8}')
+    for name, query in queries.items():
+        t_ref, res_ref = best_of(lambda: filter_reports(df, **query), args.repeat)
+        t_store, res_store = best_of(lambda: store.sel(**query), args.repeat)
+        pd.testing.assert_frame_equal(res_store, res_ref, check_exact=True)
+        print(f'{name:<24} {len(res_store):>9} {t_ref:>11.4f} {t_store:>10.4f} {t_ref / t_store:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
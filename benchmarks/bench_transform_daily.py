@@ -0,0 +1,55 @@
+"""
+Compares the engines of helpers.library.transform_daily_per_canton.
+
+Run from the repository root:
+    python -m benchmarks.bench_transform_daily
+"""
+import argparse
+import time
+
+import pandas as pd
+
+import helpers.library as lib
+from benchmarks.synthetic import make_cases
+
+
+def best_of(fkt, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fkt()
+        times.append(time.perf_counter() - t0)
+    return min(times), res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--regions', type=int, nargs='+', default=[26, 260, 2600])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--vars', type=int, default=12)
+    parser.add_argument('--gaps', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"regions":>8} {"rows":>9} {"interp":>7} {"pandas [s]":>11} {"numpy [s]":>10} {"speedup":>8}')
+    for n_regions in args.regions:
+        df = make_cases(n_regions=n_regions, n_days=args.days,
+                        n_vars=args.vars, gap_density=args.gaps)
+        value_cols = [c for c in df.columns if c.startswith('ncumul_')]
+        for interpolation in ['linear', None]:
+            kwargs = dict(value_cols=value_cols, col_date='date',
+                          col_canton='abbreviation_canton_and_fl',
+                          interpolation=interpolation)
+            t_pd, res_pd = best_of(
+                lambda: lib.transform_daily_per_canton(df, engine='pandas', **kwargs),
+                args.repeat)
+            t_np, res_np = best_of(
+                lambda: lib.transform_daily_per_canton(df, engine='numpy', **kwargs),
+                args.repeat)
+            pd.testing.assert_frame_equal(res_pd, res_np, check_exact=True)
+            print(f'{n_regions:>8} {len(df):>9} {str(interpolation):>7} '
+                  f'{t_pd:>11.3f} {t_np:>10.3f} {t_pd / t_np:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
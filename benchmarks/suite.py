@@ -0,0 +1,203 @@
+"""
+Benchmark suite of the helpers and the notebook pipelines on synthetic data.
+
+Every benchmark reports the best time of several runs, the throughput in
+input rows per second and the peak memory allocated during one run.
+The results are written as json, so runs can be compared over time.
+
+Run from the repository root:
+    python -m benchmarks.suite --out bench.json
+    python -m benchmarks.suite --out bench_new.json --compare bench.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import helpers.crosscorr as crosscorr
+import helpers.library as lib
+import helpers.monitoring as mon
+from benchmarks.synthetic import make_cases, make_monitoring
+
+COL_DATE = 'date'
+COL_CANTON = 'abbreviation_canton_and_fl'
+COL_VARIABLE = 'variable_short'
+COL_LOCATION = 'location'
+COL_VALUE = 'value'
+
+INTERPOLATIONS = ['linear', 'time', 'index', None]
+
+
+def measure(fkt, repeat):
+    """
+    Times a function and measures the peak memory it allocates.
+    Returns:
+        dict with the best and mean time and the peak memory
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        fkt()
+        times.append(time.perf_counter() - t0)
+    # Separate run, tracing slows down the allocations
+    gc.collect()
+    tracemalloc.start()
+    fkt()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_s': min(times), 'mean_s': float(np.mean(times)), 'peak_bytes': peak}
+
+
+def case_benchmarks(args):
+    """
+    Benchmarks of the Swiss case pipeline.
+    Returns:
+        (number of input rows, dict name -> function)
+    """
+    df = make_cases(n_regions=args.regions, n_days=args.days, n_vars=args.vars,
+                    gap_density=args.gaps, col_date=COL_DATE, col_canton=COL_CANTON)
+    value_cols = [c for c in df.columns if c.startswith('ncumul_')]
+    kwargs = dict(value_cols=value_cols, col_date=COL_DATE, col_canton=COL_CANTON)
+    benchmarks = {}
+    for interpolation in INTERPOLATIONS:
+        for engine in ['pandas', 'numpy']:
+            benchmarks[f'transform_daily[{engine},{interpolation}]'] = (
+                lambda engine=engine, interpolation=interpolation:
+                lib.transform_daily_per_canton(df, interpolation=interpolation, engine=engine, **kwargs))
+
+    dat_daily = lib.transform_daily_per_canton(df, engine='numpy', **kwargs)
+    ct = pd.CategoricalDtype(dat_daily.groupby(COL_CANTON)[value_cols[0]].mean()
+                             .sort_values(ascending=False).index.astype(str), ordered=True)
+    dat_long = dat_daily.melt(id_vars=[COL_DATE, COL_CANTON], var_name='variables')
+    benchmarks['order_cat'] = lambda: lib.order_cat(dat_long[COL_CANTON], ct, rev=True)
+    # The plot preparation of the case notebook: before and after melting only once
+    benchmarks['plot_prep[melt]'] = lambda: (
+        dat_daily
+        .melt(id_vars=[COL_DATE, COL_CANTON], value_vars=value_cols[:3], var_name='variables')
+        .assign(**{COL_CANTON: lambda x: lib.order_cat(x[COL_CANTON], ct, rev=True)}))
+    benchmarks['plot_prep[long_view]'] = lambda: (
+        lib.LongView(dat_daily, id_vars=[COL_DATE, COL_CANTON], value_vars=value_cols)
+        .view(value_cols[:3], COL_CANTON, ct, rev=True))
+    benchmarks['derive_cumulative[backfill]'] = lambda: lib.derive_cumulative(
+        dat_daily, value_cols, COL_DATE, COL_CANTON, window=7, negative='backfill')
+    benchmarks['rolling_daily[7,center]'] = lambda: lib.rolling_daily_per_canton(
+        dat_daily, value_cols, COL_DATE, COL_CANTON, 7, center=True)
+    return len(df), benchmarks
+
+
+def monitoring_benchmarks(args):
+    """
+    Benchmarks of the monitoring pipeline.
+    Returns:
+        (number of input rows, dict name -> function)
+    """
+    df, meta = make_monitoring(n_variables=args.indicators, n_locations=args.locations,
+                               n_days=args.mon_days, gap_density=args.mon_gaps,
+                               col_date=COL_DATE, col_value=COL_VALUE,
+                               col_variable=COL_VARIABLE, col_location=COL_LOCATION)
+    day = mon.day_numbers(df[COL_DATE])
+    df = df.assign(year=mon.calendar_codes(day, 'isoyear'), week=mon.calendar_codes(day, 'week'),
+                   dayofweek=mon.calendar_codes(day, 'dayofweek'))
+    week_cols = ['year', 'week', COL_VARIABLE, COL_LOCATION]
+    indicators = crosscorr.daily_matrix(df, COL_VALUE, COL_DATE, [COL_VARIABLE, COL_LOCATION])
+    benchmarks = {
+        'calendar_codes': lambda: [mon.calendar_codes(mon.day_numbers(df[COL_DATE]), f)
+                                   for f in ('isoyear', 'week', 'dayofweek')],
+        'fullweek_flags': lambda: mon.count_finite_per_group(df, COL_VALUE, week_cols) == 7,
+        'weekly_normalization[mean]': lambda: mon.normalize_per_group(
+            df, COL_VALUE, ['year', 'week', COL_VARIABLE], method='mean'),
+        'weekly_normalization[median,log]': lambda: mon.normalize_per_group(
+            df, COL_VALUE, ['year', 'week', COL_VARIABLE], method='median', log=True),
+        'rolling_baseline[7,trailing]': lambda: mon.rolling_per_series(
+            df, COL_VALUE, COL_DATE, [COL_VARIABLE, COL_LOCATION], 7, exclude_current=True),
+        'rolling_baseline[4,weekday]': lambda: mon.rolling_per_series(
+            df, COL_VALUE, COL_DATE, [COL_VARIABLE, COL_LOCATION], 4, stride=7),
+        'attach_metadata': lambda: mon.MetaIndex(meta, [COL_VARIABLE, COL_LOCATION]).attach(df, ['topic']),
+        'agg_cube': lambda: mon.AggCube(df, COL_VALUE, ['year', 'week', 'dayofweek', COL_VARIABLE, COL_LOCATION])
+        .rollup(['dayofweek', COL_VARIABLE]),
+        'lagged_correlation[43 lags]': lambda: crosscorr.lagged_correlation(
+            indicators, indicators.iloc[:, :4], lags=range(-14, 29)),
+    }
+    return len(df), benchmarks
+
+
+def run(args):
+    """
+    Runs all benchmarks matching args.only.
+    Returns:
+        The results as json serializable dict
+    """
+    results = []
+    for suite, make in [('cases', case_benchmarks), ('monitoring', monitoring_benchmarks)]:
+        rows, benchmarks = make(args)
+        for name, fkt in benchmarks.items():
+            full_name = f'{suite}.{name}'
+            if args.only and not any(s in full_name for s in args.only):
+                continue
+            res = measure(fkt, args.repeat)
+            res.update(name=full_name, rows=rows, rows_per_s=rows / res['best_s'])
+            results.append(res)
+            print(f'{full_name:<48} {rows:>9} rows {res["best_s"]:>9.4f}s '
+                  f'{res["rows_per_s"]:>12,.0f} rows/s {res["peak_bytes"] / 1024 ** 2:>9.1f} MB',
+                  file=sys.stderr)
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'params': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+            'versions': {'python': platform.python_version(),
+                         'numpy': np.__version__,
+                         'pandas': pd.__version__,
+                         'platform': platform.platform()},
+            'results': results}
+
+
+def compare(new, old):
+    """
+    Compares two runs of the suite.
+    Returns:
+        Data frame with the times of both runs per benchmark, slowest ratio first
+    """
+    cols = ['name', 'best_s', 'peak_bytes']
+    return (pd.DataFrame(old['results'])[cols]
+            .merge(pd.DataFrame(new['results'])[cols], on='name', suffixes=('_old', '_new'))
+            .assign(time_ratio=lambda d: d['best_s_new'] / d['best_s_old'],
+                    memory_ratio=lambda d: d['peak_bytes_new'] / d['peak_bytes_old'])
+            .sort_values('time_ratio', ascending=False)
+            .set_index('name'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--regions', type=int, default=260)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--vars', type=int, default=7)
+    parser.add_argument('--gaps', type=float, default=0.5)
+    parser.add_argument('--indicators', type=int, default=40)
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--mon-days', type=int, default=365)
+    parser.add_argument('--mon-gaps', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help='only run benchmarks containing one of these strings')
+    parser.add_argument('--out', help='json file for the results (default: print to stdout)')
+    parser.add_argument('--compare', help='json file of a previous run to compare to')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)).to_string(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Synthetic data generators shaped like the datasets used in the notebooks.
+"""
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import helpers.mobility as mob
+
+
+def make_cases(n_regions=26, n_days=120, n_vars=7, gap_density=0.5,
+               seed=0, col_date='date', col_canton='abbreviation_canton_and_fl'):
+    """
+    Generates an openZH-like table of cumulative case numbers.
+    Input:
+        n_regions: number of cantons/regions
+        n_days: number of days covered
+        n_vars: number of value columns (named ncumul_0, ncumul_1, ...)
+        gap_density: fraction of (date, region) rows that are not reported
+        seed: random seed
+    Returns:
+        A data frame with one row per reported (date, region)
+    """
+    rng = np.random.default_rng(seed)
+    regions = [f'R{i:04d}' for i in range(n_regions)]
+    dates = pd.date_range('2020-02-25', periods=n_days, freq='D')
+    df = pd.DataFrame({col_date: np.repeat(dates, n_regions),
+                       col_canton: np.tile(regions, n_days)})
+    for i in range(n_vars):
+        counts = rng.poisson(5, size=(n_days, n_regions)).cumsum(axis=0)
+        values = counts.ravel().astype(float)
+        # Not every variable is reported on every day
+        values[rng.random(len(values)) < gap_density / 2] = np.nan
+        df[f'ncumul_{i}'] = values
+    df = df.loc[rng.random(len(df)) >= gap_density, :].reset_index(drop=True)
+    df[col_canton] = pd.Categorical(df[col_canton], categories=regions)
+    return df
+
+
+def make_monitoring(n_variables=40, n_locations=4, n_days=365, gap_density=0.1,
+                    n_topics=5, seed=0, col_date='date', col_value='value',
+                    col_variable='variable_short', col_location='location',
+                    col_topic='topic'):
+    """
+    Generates statistikZH covid19monitoring-like indicator tables,
+    parsed as in the monitoring notebook (dates and categoricals).
+    Input:
+        n_variables: number of indicators
+        n_locations: number of locations every indicator is measured at
+        n_days: number of days covered
+        gap_density: fraction of (date, indicator, location) rows that are not reported
+        n_topics: number of topics the indicators are assigned to
+        seed: random seed
+    Returns:
+        (observations with one row per reported (date, indicator, location),
+         metadata with one row per (indicator, location))
+    """
+    rng = np.random.default_rng(seed)
+    variables = [f'var_{i:03d}' for i in range(n_variables)]
+    locations = [f'loc_{i:02d}' for i in range(n_locations)]
+    dates = pd.date_range('2019-12-20', periods=n_days, freq='D')
+    n_series = n_variables * n_locations
+    # Log normal levels with a weekly pattern per indicator
+    level = rng.normal(3, 1, size=n_series)
+    weekly = rng.normal(0, 0.3, size=(7, n_series))
+    noise = rng.normal(0, 0.2, size=(n_days, n_series))
+    values = np.exp(level + weekly[dates.dayofweek] + noise)
+    df = pd.DataFrame({col_variable: np.tile(np.repeat(variables, n_locations), n_days),
+                       col_value: values.ravel(),
+                       col_date: np.repeat(dates, n_series),
+                       col_location: np.tile(locations, n_variables * n_days)})
+    df = df.loc[rng.random(len(df)) >= gap_density, :].reset_index(drop=True)
+    df[col_variable] = pd.Categorical(df[col_variable], categories=variables)
+    df[col_location] = pd.Categorical(df[col_location], categories=locations)
+
+    meta = pd.DataFrame({col_variable: np.repeat(variables, n_locations),
+                         col_location: np.tile(locations, n_variables),
+                         col_topic: np.repeat([f'topic_{i % n_topics}' for i in range(n_variables)],
+                                              n_locations)})
+    for c in meta.columns:
+        meta[c] = pd.Categorical(meta[c])
+    return df, meta
+
+
+def make_mobility(n_countries=150, n_regions=20, n_days=365, n_categories=6,
+                  gap_density=0.1, seed=0):
+    """
+    Generates a table like the scraped Google mobility reports,
+    parsed as in helpers.mobility.read_reports (dates and categoricals).
+    Input:
+        n_countries: number of countries
+        n_regions: number of regions per country, besides the country wide values
+        n_days: number of days covered
+        n_categories: number of place categories
+        gap_density: fraction of rows that are not reported
+        seed: random seed
+    Returns:
+        Data frame with one row per reported (country, region, category, date),
+        shuffled. Country wide values have a missing region.
+    """
+    rng = np.random.default_rng(seed)
+    countries = [f'C{i:03d}' for i in range(n_countries)]
+    regions = [f'R{i:03d}' for i in range(n_regions)]
+    categories = [f'cat_{i}' for i in range(n_categories)]
+    dates = pd.date_range('2020-02-15', periods=n_days, freq='D')
+    n_series = n_countries * (n_regions + 1) * n_categories
+    region_codes = np.tile(np.repeat(np.arange(-1, n_regions), n_categories), n_countries)
+    df = pd.DataFrame({
+        mob.COL_COUNTRY: pd.Categorical.from_codes(
+            np.repeat(np.arange(n_countries), (n_regions + 1) * n_categories * n_days), countries),
+        mob.COL_REGION: pd.Categorical.from_codes(np.repeat(region_codes, n_days), regions),
+        mob.COL_CATEGORY: pd.Categorical.from_codes(
+            np.repeat(np.tile(np.arange(n_categories), n_countries * (n_regions + 1)), n_days),
+            categories),
+        mob.COL_DATE: np.tile(dates, n_series),
+        mob.COL_VALUE: rng.normal(0, 20, size=n_series * n_days).round()})
+    df = df.loc[rng.random(len(df)) >= gap_density, :]
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def write_reports(fol, n_countries=50, n_provinces=4, n_days=120, seed=0):
+    """
+    Writes daily reports like the ones of Johns Hopkins CSSE, one csv per day,
+    in the three column layouts used over time (see helpers.jhu.COLUMNS).
+    Input:
+        fol: folder to write the reports to, created if missing
+        n_countries: number of countries
+        n_provinces: number of provinces per country, the first country has none
+        n_days: number of days covered, from 2020-01-22 on
+        seed: random seed
+    Returns:
+        List of the written files
+    """
+    rng = np.random.default_rng(seed)
+    fol = pathlib.Path(fol)
+    fol.mkdir(parents=True, exist_ok=True)
+    countries = np.repeat([f'Country {i:03d}' for i in range(n_countries)], n_provinces)
+    provinces = np.tile([f'Province {i}' for i in range(n_provinces)], n_countries).astype(object)
+    provinces[:n_provinces] = np.nan
+    confirmed = rng.poisson(10, size=(n_days, len(countries))).cumsum(axis=0)
+    deaths = confirmed // 20
+    recovered = confirmed // 2
+    files = []
+    for i, date in enumerate(pd.date_range('2020-01-22', periods=n_days, freq='D')):
+        if date < pd.Timestamp('2020-03-01'):
+            df = pd.DataFrame({'Province/State': provinces, 'Country/Region': countries,
+                               'Last Update': str(date), 'Confirmed': confirmed[i],
+                               'Deaths': deaths[i], 'Recovered': recovered[i]})
+        elif date < pd.Timestamp('2020-03-22'):
+            df = pd.DataFrame({'Province/State': provinces, 'Country/Region': countries,
+                               'Last Update': str(date), 'Confirmed': confirmed[i],
+                               'Deaths': deaths[i], 'Recovered': recovered[i],
+                               'Latitude': 0.0, 'Longitude': 0.0})
+        else:
+            df = pd.DataFrame({'FIPS': '', 'Admin2': '', 'Province_State': provinces,
+                               'Country_Region': countries, 'Last_Update': str(date),
+                               'Lat': 0.0, 'Long_': 0.0, 'Confirmed': confirmed[i],
+                               'Deaths': deaths[i], 'Recovered': recovered[i],
+                               'Active': confirmed[i] - deaths[i] - recovered[i],
+                               'Combined_Key': ''})
+        fn = fol / date.strftime('%m-%d-%Y.csv')
+        # The first reports start with a byte order mark
+        df.to_csv(fn, index=False, encoding='utf-8-sig' if i < 10 else 'utf-8')
+        files.append(fn)
+    return files
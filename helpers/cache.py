@@ -0,0 +1,188 @@
+"""
+Persistent on-disk cache for parsed data frames.
+
+Entries are keyed by the hash of the source files plus the parameters
+and the source code used to compute them and stored as one parquet file
+per frame.
+"""
+import hashlib
+import inspect
+import json
+import pathlib
+import shutil
+import time
+import uuid
+
+import pandas as pd
+
+# Bump to invalidate all existing cache entries
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def hash_files(paths, chunk_size=2 ** 20):
+    """
+    Hashes the content of files, independent of their order.
+    Input:
+        paths: iterable of file paths
+    Returns:
+        Hex digest of the combined hash
+    """
+    h = hashlib.sha256()
+    for path in sorted(str(p) for p in paths):
+        h.update(path.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_code(objs):
+    """
+    Hashes the source code of functions, classes or modules,
+    so entries are invalidated when the code computing them changes.
+    Input:
+        objs: iterable of functions, classes or modules
+    Returns:
+        Hex digest of the combined hash
+    """
+    h = hashlib.sha256()
+    for obj in objs:
+        try:
+            source = inspect.getsource(obj)
+        except (OSError, TypeError):
+            source = ''
+        name = getattr(obj, '__qualname__', getattr(obj, '__name__', ''))
+        h.update(f'{getattr(obj, "__module__", "")}.{name}:{source}'.encode())
+    return h.hexdigest()
+
+
+def make_key(paths, params=None, code=()):
+    """
+    Creates a cache key from the source files and the parameters
+    and code used to transform them.
+    Input:
+        paths: iterable of source file paths
+        params: dict with json serializable parameters
+        code: functions or modules transforming the files, see hash_code
+    Returns:
+        The cache key
+    """
+    h = hashlib.sha256()
+    h.update(hash_files(paths).encode())
+    h.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+    h.update(hash_code(code).encode())
+    h.update(str(CACHE_VERSION).encode())
+    return h.hexdigest()[:32]
+
+
+def _entry_size(entry):
+    entry = pathlib.Path(entry)
+    if entry.is_dir():
+        return sum(f.stat().st_size for f in entry.iterdir())
+    return entry.stat().st_size
+
+
+def evict(fol_cache, max_bytes=DEFAULT_MAX_BYTES, keep=()):
+    """
+    Deletes the least recently used entries until the cache
+    is smaller than max_bytes.
+    Entries are the files or folders in the cache folder,
+    their modification time marks when they were last used.
+    Input:
+        fol_cache: the cache folder
+        max_bytes: maximum total size of the cache
+        keep: keys that should never be evicted
+    Returns:
+        List of evicted keys
+    """
+    fol_cache = pathlib.Path(fol_cache)
+    if not fol_cache.exists():
+        return []
+    entries = [(e.stat().st_mtime, e, _entry_size(e))
+               for e in fol_cache.iterdir()
+               if not e.name.startswith('.')]
+    total = sum(size for _, _, size in entries)
+    evicted = []
+    for _, entry, size in sorted(entries, key=lambda x: x[0]):
+        if total <= max_bytes:
+            break
+        if entry.name in keep:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink()
+        total -= size
+        evicted.append(entry.name)
+    return evicted
+
+
+def load_frames(fol_cache, key):
+    """
+    Loads the frames stored under key.
+    Returns:
+        dict name -> data frame or None if the key is not in the cache
+    """
+    fol_entry = pathlib.Path(fol_cache) / key
+    if not fol_entry.is_dir():
+        return None
+    frames = {f.stem: pd.read_parquet(f) for f in sorted(fol_entry.glob('*.parquet'))}
+    # Mark as recently used
+    fol_entry.touch()
+    return frames
+
+
+def store_frames(fol_cache, key, frames):
+    """
+    Stores the frames under key. The entry is written to a temporary
+    folder first so readers never see incomplete entries.
+    Input:
+        fol_cache: the cache folder
+        key: the cache key
+        frames: dict name -> data frame
+    """
+    fol_cache = pathlib.Path(fol_cache)
+    fol_tmp = fol_cache / f'.tmp-{uuid.uuid4().hex}'
+    fol_tmp.mkdir(parents=True)
+    try:
+        for name, df in frames.items():
+            df.to_parquet(fol_tmp / f'{name}.parquet', engine='pyarrow')
+        fol_tmp.rename(fol_cache / key)
+    except OSError:
+        # Another process stored the same entry in the meantime
+        if not (fol_cache / key).is_dir():
+            raise
+    finally:
+        shutil.rmtree(fol_tmp, ignore_errors=True)
+
+
+def cached_frames(fkt, paths, params=None, code=(), fol_cache='.cache/frames',
+                  max_bytes=DEFAULT_MAX_BYTES, verbose=True):
+    """
+    Returns the frames computed by fkt, from the cache if possible.
+    Input:
+        fkt: function without arguments returning a dict name -> data frame
+        paths: source files fkt reads, used for the cache key
+        params: dict of parameters influencing fkt, used for the cache key
+        code: functions or modules fkt calls, their source code is part of
+              the cache key (the source of fkt itself always is)
+        fol_cache: the cache folder
+        max_bytes: maximum size of the cache, older entries get evicted
+        verbose: print cache hits/misses
+    Returns:
+        dict name -> data frame
+    """
+    t0 = time.perf_counter()
+    key = make_key(paths, params, code=(fkt,) + tuple(code))
+    frames = load_frames(fol_cache, key)
+    if frames is not None:
+        if verbose:
+            print(f'Cache hit {key}: loaded in {time.perf_counter() - t0:.2f}s')
+        return frames
+    frames = fkt()
+    store_frames(fol_cache, key, frames)
+    evict(fol_cache, max_bytes=max_bytes, keep=(key,))
+    if verbose:
+        print(f'Cache miss {key}: computed in {time.perf_counter() - t0:.2f}s')
+    return frames
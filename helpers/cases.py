@@ -0,0 +1,256 @@
+"""
+Loading and preprocessing of the openZH Swiss case data
+(https://github.com/openZH/covid_19), shared by the notebooks and
+the batch scripts.
+"""
+import glob
+
+import pandas as pd
+
+import helpers.cache as cache
+import helpers.cubestore as cubestore
+import helpers.ingest as ingest
+import helpers.library as lib
+import helpers.pcaxis as pcaxis
+import helpers.trace as trace
+
+
+class C:
+    """
+    Helper class to keep input configuration.
+    """
+    glob_cases = "data/covid/covid_19/COVID19_Fallzahlen_CH_total_v2.csv"
+    fol_cache = '.cache/cases'
+    fol_store = '.cache/cases_cube'
+    interpolation = 'linear'
+    # BFS cantonal population scenarios, see data/monitoring/varia/README
+    fn_population = 'data/monitoring/varia/px-x-0104020000_101.px'
+    fol_cache_population = '.cache/population'
+
+
+class V:
+    """
+    Helper class to keep metadata related variables.
+    """
+    # User columns
+    COL_VARIABLES = 'variables'
+    COL_VALUE = 'value'
+
+    # Data columns: from the data description from https://github.com/openZH/covid_19
+    COL_DATE = 'date'
+    COL_CANTON = 'abbreviation_canton_and_fl'
+
+    COL_CUM_CONFIRMED = 'ncumul_conf'
+    COL_CUM_DECEASED = 'ncumul_deceased'  # number of deaths
+    COL_CUM_TESTED = 'ncumul_tested'
+
+    COL_CUR_HOSP = 'current_hosp'
+    COL_CUR_ICU = 'current_icu'
+    COL_CUR_VENT = 'current_vent'
+
+    COL_CUM_RELEASED = 'ncumul_released'
+    COL_CUM_CURED = 'TotalCured'
+
+    vars_labels = {COL_CUM_CONFIRMED: 'Total confirmed cases',
+                   COL_CUR_HOSP: 'Current hospitalized cases',
+                   COL_CUM_DECEASED: 'Total deceased cases',
+                   COL_CUR_ICU: 'Current intensive care cases',
+                   COL_CUR_VENT: 'Current ventilator cases',
+                   COL_CUM_RELEASED: 'Total released from hospital',
+                   # COL_CUM_CURED: 'Total cured cases',
+                   COL_CUM_TESTED: 'Total tested cases'
+                   }
+    vars_all = vars_labels.keys()
+
+    # Types used when reading the data
+    schema_cases = {COL_DATE: 'date',
+                    COL_CANTON: 'category',
+                    **{c: 'float32' for c in vars_labels}}
+
+    # Cumulative variables, see derived_metrics
+    vars_cumulative = [COL_CUM_CONFIRMED,
+                       COL_CUM_DECEASED,
+                       COL_CUM_TESTED,
+                       COL_CUM_RELEASED]
+
+    # Population, see load_population
+    COL_YEAR = 'year'
+    COL_POPULATION = 'population'
+    # Dimensions of the BFS population scenario file
+    PX_CANTON = 'Kanton'
+    PX_YEAR = 'Jahr'
+    # Canton names of the BFS (first name of multilingual names)
+    cantons_bfs = {'Zürich': 'ZH', 'Bern': 'BE', 'Luzern': 'LU', 'Uri': 'UR', 'Schwyz': 'SZ',
+                   'Obwalden': 'OW', 'Nidwalden': 'NW', 'Glarus': 'GL', 'Zug': 'ZG',
+                   'Fribourg': 'FR', 'Solothurn': 'SO', 'Basel-Stadt': 'BS',
+                   'Basel-Landschaft': 'BL', 'Schaffhausen': 'SH',
+                   'Appenzell Ausserrhoden': 'AR', 'Appenzell Innerrhoden': 'AI',
+                   'St. Gallen': 'SG', 'Graubünden': 'GR', 'Aargau': 'AG', 'Thurgau': 'TG',
+                   'Ticino': 'TI', 'Vaud': 'VD', 'Valais': 'VS', 'Neuchâtel': 'NE',
+                   'Genève': 'GE', 'Jura': 'JU'}
+
+    # My main variables of interest
+    vars_main = [COL_CUM_CONFIRMED,
+                 COL_CUM_DECEASED,
+                 COL_CUR_HOSP]
+
+
+def read_cases(glob_cases=C.glob_cases, verbose=True, schema=V.schema_cases):
+    """
+    Reads the case data in parallel, parsing the metadata into the right classes
+    (schema, see ingest.read_csvs).
+    """
+    with trace.stage('load') as st:
+        dat_total, read_times = ingest.read_csvs(glob.glob(glob_cases), schema,
+                                                 dayfirst=True, return_timings=True)
+        st.set_rows_out(dat_total)
+    if verbose:
+        print(read_times.sort_values('total_s', ascending=False).head())
+    return dat_total
+
+
+def daily_cases(dat_total, interpolation=C.interpolation):
+    """
+    Interpolates the case data to get daily values.
+    """
+    with trace.stage('interpolate', dat_total) as st:
+        dat_daily = lib.transform_daily_per_canton(dat_total, V.vars_all, col_canton=V.COL_CANTON,
+                                                   col_date=V.COL_DATE, interpolation=interpolation,
+                                                   engine='numpy')
+        st.set_rows_out(dat_daily)
+    return dat_daily
+
+
+def load_cases(glob_cases=C.glob_cases, interpolation=C.interpolation, verbose=True):
+    """
+    Reads the case data, parses the metadata into the right classes
+    and interpolates the data to get daily values.
+    Returns:
+        dict with the raw data ('dat_total') and the daily data ('dat_daily')
+    """
+    dat_total = read_cases(glob_cases, verbose=verbose)
+    return {'dat_total': dat_total, 'dat_daily': daily_cases(dat_total, interpolation)}
+
+
+def load_cases_cached(glob_cases=C.glob_cases, interpolation=C.interpolation,
+                      fol_cache=C.fol_cache, verbose=True):
+    """
+    Same as load_cases, but cached on disk keyed by the content of the source files.
+    """
+    return cache.cached_frames(lambda: load_cases(glob_cases, interpolation, verbose=verbose),
+                               glob.glob(glob_cases),
+                               params={'vars': list(V.vars_all), 'interpolation': interpolation,
+                                       'schema': V.schema_cases},
+                               code=(read_cases, daily_cases, ingest, lib),
+                               fol_cache=fol_cache, verbose=verbose)
+
+
+def rolling_mean(dat_daily, window=7, **kwargs):
+    """
+    Rolling means of all variables per canton, see lib.rolling_array for the options.
+    """
+    return lib.rolling_daily_per_canton(dat_daily, V.vars_all, col_date=V.COL_DATE,
+                                        col_canton=V.COL_CANTON, window=window, **kwargs)
+
+
+def derived_metrics(dat_daily, window=7, negative='backfill'):
+    """
+    Daily new counts, sums over the last days, growth rates and doubling times
+    of the cumulative variables, see lib.derive_cumulative.
+    """
+    with trace.stage('derive', dat_daily) as st:
+        dat_derived = lib.derive_cumulative(dat_daily, V.vars_cumulative, col_date=V.COL_DATE,
+                                            col_canton=V.COL_CANTON, window=window, negative=negative)
+        st.set_rows_out(dat_derived)
+    return dat_derived
+
+
+def read_population(fn_population=C.fn_population):
+    """
+    Reads the population per canton and year from the BFS scenario file.
+    The file is streamed and summed on the fly: of every other dimension
+    (nationality, sex, age, ...) only the total is used if there is one,
+    else all values are summed.
+    Returns:
+        Data frame with canton abbreviation, year and population
+    """
+    meta = pcaxis.read_meta(fn_population)
+    select = {}
+    for v in meta['variables']:
+        totals = [x for x in meta['values'][v] if 'Total' in x]
+        if v not in (V.PX_CANTON, V.PX_YEAR) and totals:
+            select[v] = totals
+    with trace.stage('read population') as st:
+        df = pcaxis.aggregate(fn_population, by=[V.PX_CANTON, V.PX_YEAR], select=select)
+        st.set_rows_out(df)
+    canton = df[V.PX_CANTON].astype(str).str.split(' / ').str[0].map(V.cantons_bfs)
+    return (pd.DataFrame({V.COL_CANTON: canton,
+                          V.COL_YEAR: df[V.PX_YEAR].astype(str).astype(int),
+                          V.COL_POPULATION: df['value']})
+            .dropna(subset=[V.COL_CANTON])
+            .reset_index(drop=True))
+
+
+def load_population(fn_population=C.fn_population, fol_cache=C.fol_cache_population, verbose=True):
+    """
+    Same as read_population, but cached on disk keyed by the content of the file.
+    """
+    return cache.cached_frames(lambda: {'population': read_population(fn_population)},
+                               [fn_population],
+                               params={'cantons': V.cantons_bfs, 'dims': [V.PX_CANTON, V.PX_YEAR]},
+                               code=(read_population, pcaxis),
+                               fol_cache=fol_cache, verbose=verbose)['population']
+
+
+def per_100k(dat_daily, population):
+    """
+    All variables of the daily data per 100'000 inhabitants of the canton,
+    see lib.per_capita.
+    """
+    with trace.stage('per 100k', dat_daily) as st:
+        dat_norm = lib.per_capita(dat_daily, V.vars_all, col_date=V.COL_DATE, col_canton=V.COL_CANTON,
+                                  population=population, col_year=V.COL_YEAR,
+                                  col_population=V.COL_POPULATION, per=100000)
+        st.set_rows_out(dat_norm)
+    return dat_norm
+
+
+def store_daily(dat_daily, fol_store=C.fol_store):
+    """
+    Writes the daily data to a memory mapped cube store, so other processes
+    can share it without recomputing it, see open_daily.
+    """
+    return cubestore.CubeStore.from_daily(fol_store, dat_daily, list(V.vars_all),
+                                          col_date=V.COL_DATE, col_canton=V.COL_CANTON)
+
+
+def open_daily(fol_store=C.fol_store, mode='r'):
+    """
+    Opens the daily data written by store_daily, see cubestore.CubeStore.
+    """
+    return cubestore.CubeStore(fol_store, mode=mode)
+
+
+def long_view(dat_daily):
+    """
+    Long format view of the daily data, see lib.LongView
+    """
+    with trace.stage('melt', dat_daily) as st:
+        dat_long = lib.LongView(dat_daily, id_vars=[V.COL_DATE, V.COL_CANTON], value_vars=V.vars_all,
+                                var_name=V.COL_VARIABLES, value_name=V.COL_VALUE, labels=V.vars_labels,
+                                first=V.vars_main)
+        st.set_rows_out(dat_long.long)
+    return dat_long
+
+
+def order_cantons(dat_daily, col=V.COL_CUM_DECEASED):
+    """
+    Categorical dtype with the cantons sorted by the mean of a variable, highest first.
+    """
+    cord = (dat_daily
+            .groupby(V.COL_CANTON)
+            [col].mean()
+            .sort_values(ascending=False)
+            .index
+            )
+    return pd.CategoricalDtype(cord.astype(str), ordered=True)
@@ -0,0 +1,178 @@
+"""
+Lagged cross-correlations between many daily series, e.g. whether changes of
+the monitoring indicators lead changes of the case numbers.
+
+The series are aligned as (day x series) arrays. For all lags at once, the
+second array is stacked as shifted copies, so every pairwise-complete
+statistic (counts, sums, sums of squares and products) is one matrix product.
+Missing days are left out pair by pair, as in pandas' corr.
+Blocks of the first series are computed in parallel.
+"""
+import concurrent.futures
+import functools
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import helpers.trace as trace
+
+COL_X = 'x'
+COL_Y = 'y'
+COL_LAG = 'lag'
+COL_CORR = 'corr'
+COL_N = 'n'
+
+
+def daily_matrix(df, col_value, col_date, series_cols, sep='/'):
+    """
+    Pivots long data to one column per series and one row per day,
+    missing days are added as missing values.
+    Input:
+        df: long data frame, e.g. the monitoring data
+        col_value: the values
+        col_date: the dates
+        series_cols: columns identifying a series, e.g. (variable, location)
+        sep: separator of the series labels
+    Returns:
+        Data frame with a daily DatetimeIndex and one column per series
+    """
+    series_cols = list(series_cols)
+    labels = df[series_cols[0]].astype(str)
+    for c in series_cols[1:]:
+        labels = labels + sep + df[c].astype(str)
+    mat = (pd.DataFrame({col_date: df[col_date].to_numpy(), 'series': labels.to_numpy(),
+                         col_value: df[col_value].to_numpy()})
+           .pivot_table(index=col_date, columns='series', values=col_value, aggfunc='mean'))
+    mat.columns.name = None
+    return mat.reindex(pd.date_range(mat.index.min(), mat.index.max(), freq='D'))
+
+
+def _centered(arr):
+    """
+    Subtracts the column means, non finite values (e.g. log of 0) become missing.
+    Centering does not change the correlations, but keeps the sums of squares small.
+    """
+    arr = np.where(np.isfinite(arr), arr, np.nan)
+    with warnings.catch_warnings():
+        # all missing series stay missing
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return arr - np.nanmean(arr, axis=0)
+
+
+def _shifted(y, lags):
+    """
+    Stacks y[t + lag] for all lags, missing where t + lag is out of range
+    (all missing for lags as long as the series).
+    Returns:
+        Array (day x series * lags), the lags varying fastest
+    """
+    ndays = y.shape[0]
+    out = np.full((ndays, y.shape[1], len(lags)), np.nan)
+    for i, lag in enumerate(lags):
+        if abs(lag) >= ndays:
+            continue
+        if lag >= 0:
+            out[:ndays - lag, :, i] = y[lag:]
+        else:
+            out[-lag:, :, i] = y[:ndays + lag]
+    return out.reshape(ndays, -1)
+
+
+def _corr_block(x, y_lagged, min_periods):
+    """
+    Pairwise-complete Pearson correlation of every column of x with
+    every column of y_lagged, see the module documentation.
+    Returns:
+        (correlations, counts), both (x series x y_lagged columns)
+    """
+    mx = np.isfinite(x)
+    my = np.isfinite(y_lagged)
+    x0 = np.where(mx, x, 0)
+    y0 = np.where(my, y_lagged, 0)
+    mx, my = mx.astype(float), my.astype(float)
+    n = mx.T @ my
+    sx = x0.T @ my
+    sy = mx.T @ y0
+    sxx = (x0 ** 2).T @ my
+    syy = mx.T @ (y0 ** 2)
+    sxy = x0.T @ y0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * sxy - sx * sy
+        var_x = n * sxx - sx ** 2
+        var_y = n * syy - sy ** 2
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[(n < max(min_periods, 2)) | (var_x <= 0) | (var_y <= 0)] = np.nan
+    return np.clip(corr, -1, 1), n.astype(np.int64)
+
+
+def lagged_correlation(x, y, lags=range(-14, 29), min_periods=10, n_jobs=None,
+                       executor='thread', block_size=64):
+    """
+    Correlation of every series of x with every series of y at every lag:
+    corr(x[t], y[t + lag]), i.e. positive lags mean that x leads y.
+    Input:
+        x, y: data frames with a daily DatetimeIndex and one column per series
+              (see daily_matrix), they are aligned on their dates
+        lags: lags in days
+        min_periods: minimal number of days with both values, else the correlation is missing
+        n_jobs: number of workers (default: number of cpus)
+        executor: 'thread' or 'process'. numpy releases the GIL in the matrix products,
+                  so threads avoid copying the arrays and are usually enough.
+        block_size: number of series of x per worker task
+    Returns:
+        Data frame with the x series, y series, lag, correlation and number of days used
+    """
+    lags = np.asarray(list(lags), dtype=int)
+    dates = x.index.union(y.index)
+    dates = pd.date_range(dates.min(), dates.max(), freq='D')
+    xa = _centered(x.reindex(dates).to_numpy(dtype=float))
+    ya = _centered(y.reindex(dates).to_numpy(dtype=float))
+    with trace.stage('shift', ya) as st:
+        y_lagged = _shifted(ya, lags)
+        st.set_rows_out(y_lagged)
+
+    blocks = [slice(i, min(i + block_size, xa.shape[1])) for i in range(0, xa.shape[1], block_size)]
+    fkt = functools.partial(_corr_block, y_lagged=y_lagged, min_periods=min_periods)
+    with trace.stage('correlate', xa):
+        if len(blocks) <= 1 or n_jobs == 1:
+            results = [fkt(xa[:, b]) for b in blocks]
+        else:
+            if executor == 'thread':
+                pool = concurrent.futures.ThreadPoolExecutor
+            elif executor == 'process':
+                pool = concurrent.futures.ProcessPoolExecutor
+            else:
+                raise ValueError(f'Unknown executor: {executor}')
+            with pool(max_workers=n_jobs or os.cpu_count()) as ex:
+                results = list(ex.map(fkt, [xa[:, b] for b in blocks]))
+    if results:
+        corr = np.concatenate([c for c, _ in results])
+        counts = np.concatenate([n for _, n in results])
+    else:
+        corr = counts = np.empty((0, y_lagged.shape[1]))
+
+    nx, ny, nlags = x.shape[1], y.shape[1], len(lags)
+    return pd.DataFrame({COL_X: pd.Categorical(np.repeat(x.columns.astype(str), ny * nlags),
+                                               categories=x.columns.astype(str)),
+                         COL_Y: pd.Categorical(np.tile(np.repeat(y.columns.astype(str), nlags), nx),
+                                               categories=y.columns.astype(str)),
+                         COL_LAG: np.tile(lags, nx * ny),
+                         COL_CORR: corr.reshape(-1),
+                         COL_N: counts.reshape(-1).astype(np.int64)})
+
+
+def best_lags(df_corr):
+    """
+    The lag with the strongest (absolute) correlation per pair of series.
+    Input:
+        df_corr: output of lagged_correlation
+    Returns:
+        Data frame with one row per pair, strongest first
+    """
+    df = df_corr.dropna(subset=[COL_CORR])
+    idx = df[COL_CORR].abs().groupby([df[COL_X], df[COL_Y]], observed=True).idxmax()
+    return (df.loc[idx.to_numpy(), :]
+            .sort_values(COL_CORR, key=np.abs, ascending=False)
+            .reset_index(drop=True))
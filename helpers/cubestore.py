@@ -0,0 +1,267 @@
+"""
+Memory mapped on-disk store of daily data as a dense (day x canton x variable) cube.
+
+The values are one raw binary file with the days as first axis, so new days
+are appended at the end of the file in place. The axis labels and the name
+of the values file are kept in a json sidecar file. Every process opening
+the store maps the same file, slices only read the pages they need.
+
+A new store writes its values to a new file and then replaces the sidecar,
+so readers see either the old or the new values with their labels.
+"""
+import json
+import os
+import pathlib
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Values file of stores whose sidecar does not name one
+FN_VALUES = 'values.bin'
+FN_LABELS = 'labels.json'
+
+
+def _write_labels(fol, labels):
+    """
+    Replaces the sidecar file atomically, so readers never see a partial file.
+    """
+    fn_tmp = pathlib.Path(fol) / f'.tmp-{uuid.uuid4().hex}.json'
+    with open(fn_tmp, 'w') as f:
+        json.dump(labels, f, indent=1)
+    os.replace(fn_tmp, pathlib.Path(fol) / FN_LABELS)
+
+
+def _values_file(fol):
+    """
+    Values file named in the sidecar of the store in fol, None if there is no store.
+    """
+    try:
+        with open(pathlib.Path(fol) / FN_LABELS) as f:
+            return pathlib.Path(fol) / json.load(f).get('values', FN_VALUES)
+    except FileNotFoundError:
+        return None
+
+
+def daily_to_cube(df_daily, value_cols, col_date, col_canton, dtype='float64'):
+    """
+    Reshapes daily data (see lib.transform_daily_per_canton) into a cube.
+    Input:
+        df_daily: data frame ordered by date, with all cantons for every date
+        value_cols: the variables
+        col_date, col_canton: the date and canton columns
+        dtype: dtype of the cube
+    Returns:
+        (cube (day x canton x variable), first date, cantons)
+    """
+    dates = pd.DatetimeIndex(df_daily[col_date])
+    ncantons = int(np.searchsorted(dates, dates[0], side='right'))
+    if len(dates) % ncantons != 0:
+        raise ValueError('Daily data needs all cantons for every date')
+    cube = (df_daily[list(value_cols)].to_numpy(dtype=dtype)
+            .reshape(-1, ncantons, len(value_cols)))
+    return cube, dates[0], [str(c) for c in df_daily[col_canton].iloc[:ncantons]]
+
+
+class CubeStore:
+    """
+    Memory mapped (day x canton x variable) cube with labeled axes.
+    """
+
+    def __init__(self, fol, mode='r'):
+        """
+        Opens an existing store, see create.
+        Input:
+            fol: folder of the store
+            mode: 'r' to read, 'r+' to also update the store
+        """
+        if mode not in ('r', 'r+'):
+            raise ValueError(f'Unsupported mode: {mode}')
+        self.fol = pathlib.Path(fol)
+        self.mode = mode
+        self.refresh()
+
+    @classmethod
+    def create(cls, fol, cube, start, cantons, variables, col_date='date',
+               col_canton='canton'):
+        """
+        Writes a new store, replacing an existing one. The files are
+        replaced atomically, never truncated, as they may be mapped.
+        Input:
+            fol: folder of the store
+            cube: array (day x canton x variable)
+            start: date of the first day
+            cantons, variables: labels of the axes
+            col_date, col_canton: column names used by frame
+        Returns:
+            The store, opened for updates
+        """
+        cube = np.asarray(cube)
+        if cube.shape[1:] != (len(cantons), len(variables)):
+            raise ValueError(f'Cube of shape {cube.shape} does not match '
+                             f'{len(cantons)} cantons and {len(variables)} variables')
+        fol = pathlib.Path(fol)
+        fol.mkdir(parents=True, exist_ok=True)
+        fn_old = _values_file(fol)
+        # The values go to a new file, named in the sidecar written last:
+        # readers see the old labels and values until the sidecar is replaced,
+        # processes mapping the old file keep their (old) values until they refresh
+        fn_values = f'values-{uuid.uuid4().hex}.bin'
+        try:
+            with open(fol / fn_values, 'wb') as f:
+                f.write(np.ascontiguousarray(cube).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            _write_labels(fol, {'start': pd.Timestamp(start).isoformat(),
+                                'ndays': cube.shape[0],
+                                'cantons': [str(c) for c in cantons],
+                                'variables': [str(v) for v in variables],
+                                'dtype': cube.dtype.str,
+                                'values': fn_values,
+                                'col_date': col_date,
+                                'col_canton': col_canton})
+        except BaseException:
+            (fol / fn_values).unlink(missing_ok=True)
+            raise
+        if fn_old is not None:
+            fn_old.unlink(missing_ok=True)
+        return cls(fol, mode='r+')
+
+    @classmethod
+    def from_daily(cls, fol, df_daily, value_cols, col_date, col_canton, dtype='float64'):
+        """
+        Writes daily data (see lib.transform_daily_per_canton) to a new store.
+        """
+        cube, start, cantons = daily_to_cube(df_daily, value_cols, col_date, col_canton, dtype=dtype)
+        return cls.create(fol, cube, start, cantons, list(value_cols),
+                          col_date=col_date, col_canton=col_canton)
+
+    def refresh(self):
+        """
+        Reopens the store, e.g. to see days appended by another process.
+        """
+        while True:
+            with open(self.fol / FN_LABELS) as f:
+                self.labels = json.load(f)
+            self.start = pd.Timestamp(self.labels['start'])
+            self.cantons = pd.Index(self.labels['cantons'])
+            self.variables = pd.Index(self.labels['variables'])
+            self.dtype = np.dtype(self.labels['dtype'])
+            self.fn_values = self.fol / self.labels.get('values', FN_VALUES)
+            shape = (self.labels['ndays'], len(self.cantons), len(self.variables))
+            if shape[0] == 0:
+                self.values = np.empty(shape, dtype=self.dtype)
+                return
+            try:
+                size = self.fn_values.stat().st_size
+            except FileNotFoundError:
+                if self.fn_values != _values_file(self.fol):
+                    # Replaced by a new store after reading the labels
+                    continue
+                raise
+            # Appended days are written before the labels, so the file may be longer
+            if size < np.prod(shape) * self.dtype.itemsize:
+                raise ValueError(f'{self.fn_values} has {size} bytes, too few for '
+                                 f'{shape} values of type {self.dtype}')
+            self.values = np.memmap(self.fn_values, dtype=self.dtype, mode=self.mode, shape=shape)
+            return
+
+    @property
+    def dates(self):
+        return pd.date_range(self.start, periods=self.values.shape[0], freq='D')
+
+    def _positions(self, labels, axis_labels, name):
+        if labels is None:
+            return slice(None)
+        if isinstance(labels, str):
+            labels = [labels]
+        pos = axis_labels.get_indexer(labels)
+        if (pos < 0).any():
+            raise KeyError(f'Unknown {name}: {list(np.asarray(labels)[pos < 0])}')
+        # A slice keeps the result a view of the memory map
+        if len(pos) > 0 and (np.diff(pos) == 1).all():
+            return slice(pos[0], pos[-1] + 1)
+        return pos
+
+    def _days(self, start, end):
+        one_day = pd.Timedelta(days=1)
+        i0 = 0 if start is None else max((pd.Timestamp(start) - self.start) // one_day, 0)
+        i1 = self.values.shape[0] if end is None else (pd.Timestamp(end) - self.start) // one_day + 1
+        return slice(i0, max(i1, i0))
+
+    def sel(self, cantons=None, variables=None, start=None, end=None):
+        """
+        Slice of the cube, only the selected values are read from disk.
+        Input:
+            cantons, variables: labels to select (default: all)
+            start, end: first and last date to select, inclusive (default: all)
+        Returns:
+            Array (day x canton x variable), a view of the memory map if
+            the selected cantons and variables are contiguous
+        """
+        days = self._days(start, end)
+        rows = self._positions(cantons, self.cantons, 'cantons')
+        cols = self._positions(variables, self.variables, 'variables')
+        values = self.values[days]
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return values[:, rows, :][:, :, cols]
+        return values[:, rows[:, None], cols[None, :]]
+
+    def frame(self, cantons=None, variables=None, start=None, end=None):
+        """
+        Slice of the cube in the format of lib.transform_daily_per_canton:
+        one row per date and canton, one column per variable.
+        """
+        days = self._days(start, end)
+        sel_cantons = self.cantons[self._positions(cantons, self.cantons, 'cantons')]
+        sel_variables = self.variables[self._positions(variables, self.variables, 'variables')]
+        values = self.sel(cantons, variables, start, end)
+        dates = self.dates[days]
+        df = pd.DataFrame(values.reshape(-1, len(sel_variables)), columns=sel_variables)
+        df.insert(0, self.labels['col_canton'],
+                  pd.Categorical(np.tile(sel_cantons, len(dates)), categories=sel_cantons))
+        df.insert(0, self.labels['col_date'], np.repeat(dates, len(sel_cantons)))
+        return df
+
+    def write(self, cube, start):
+        """
+        Writes days to the store in place: existing days are overwritten,
+        days after the last day are appended to the file.
+        Input:
+            cube: array (day x canton x variable) with the cantons and
+                  variables of the store
+            start: date of the first day of cube, the days need to follow
+                   the days of the store without gap
+        """
+        if self.mode != 'r+':
+            raise ValueError('Store is opened read only')
+        cube = np.ascontiguousarray(cube, dtype=self.dtype)
+        if cube.shape[1:] != self.values.shape[1:]:
+            raise ValueError(f'Cube of shape {cube.shape} does not match the store {self.values.shape}')
+        ndays = self.values.shape[0]
+        offset = (pd.Timestamp(start) - self.start) // pd.Timedelta(days=1)
+        if offset < 0 or offset > ndays:
+            raise ValueError(f'Days need to start between {self.start} and the day after the last day')
+        n_overlap = min(ndays - offset, cube.shape[0])
+        if n_overlap > 0:
+            self.values[offset:offset + n_overlap] = cube[:n_overlap]
+            self.values.flush()
+        if cube.shape[0] > n_overlap:
+            with open(self.fn_values, 'ab') as f:
+                f.write(cube[n_overlap:].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            # Readers only see the new days once the sidecar is updated
+            _write_labels(self.fol, dict(self.labels, ndays=offset + cube.shape[0]))
+        self.refresh()
+
+    def write_daily(self, df_daily):
+        """
+        Writes daily data (e.g. the result of lib.append_daily_per_canton)
+        to the store in place, see write.
+        """
+        cube, start, cantons = daily_to_cube(df_daily, self.variables, self.labels['col_date'],
+                                             self.labels['col_canton'], dtype=self.dtype)
+        if list(cantons) != list(self.cantons):
+            raise ValueError('Cantons differ from the store, create a new store')
+        self.write(cube, start)
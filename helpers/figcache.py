@@ -0,0 +1,139 @@
+"""
+Content addressed cache for rendered figures.
+
+A figure is identified by a key describing the plot (e.g. the figure
+function, its source code and arguments) plus the hash of the exact data
+the ggplot consumes (its data and the data of all layers). Unchanged
+figures are then copied from the cache instead of being drawn again.
+"""
+import hashlib
+import inspect
+import os
+import pathlib
+import shutil
+import uuid
+
+import pandas as pd
+
+import helpers.cache as cache
+
+DEFAULT_FOL_CACHE = '.cache/figures'
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+def hash_frame(df, h=None):
+    """
+    Hashes the content of a data frame including column names,
+    dtypes (e.g. category order) and index.
+    Input:
+        df: the data frame
+        h: optional hashlib object to update
+    Returns:
+        The hashlib object
+    """
+    h = h or hashlib.sha256()
+    h.update(repr(list(df.columns)).encode())
+    h.update(repr(list(df.dtypes)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h
+
+
+def hash_plot_data(p, h=None):
+    """
+    Hashes all data a ggplot consumes: its data and the data of its layers.
+    """
+    h = h or hashlib.sha256()
+    for df in [p.data] + [getattr(layer.geom, 'data', None) for layer in p.layers]:
+        if isinstance(df, pd.DataFrame):
+            hash_frame(df, h)
+        else:
+            # No own data (None) or a function of the plot data
+            h.update(repr(df).encode() if df is None else
+                     f'{df.__module__}.{df.__qualname__}'.encode())
+    return h
+
+
+def spec_key(fkt, kwargs):
+    """
+    Describes a figure function call: its name, source code and arguments.
+    """
+    try:
+        source = inspect.getsource(fkt)
+    except (OSError, TypeError):
+        source = ''
+    return repr((fkt.__module__, fkt.__qualname__, source, sorted(kwargs.items())))
+
+
+def figure_key(p, key, fmt='png', dpi=100):
+    """
+    Cache key of a figure.
+    Input:
+        p: the ggplot
+        key: string describing the plot, e.g. from spec_key.
+             Needs to change if the plot definition changes.
+        fmt, dpi: the output format
+    Returns:
+        The cache key
+    """
+    h = hashlib.sha256()
+    h.update(repr((key, fmt, dpi)).encode())
+    return hash_plot_data(p, h).hexdigest()[:32]
+
+
+def _cached_file(p, key, fmt, dpi, fol_cache, max_bytes):
+    """
+    Returns the cached image of a figure, rendering it on a cache miss.
+    Returns:
+        (cache file, True if it was a cache hit)
+    """
+    fol_cache = pathlib.Path(fol_cache)
+    fn_cache = fol_cache / f'{figure_key(p, key, fmt=fmt, dpi=dpi)}.{fmt}'
+    if fn_cache.exists():
+        # Mark as recently used
+        os.utime(fn_cache)
+        return fn_cache, True
+    fol_cache.mkdir(parents=True, exist_ok=True)
+    fn_tmp = fol_cache / f'.tmp-{uuid.uuid4().hex}.{fmt}'
+    p.save(fn_tmp, dpi=dpi, verbose=False, limitsize=False)
+    os.replace(fn_tmp, fn_cache)
+    cache.evict(fol_cache, max_bytes=max_bytes, keep=(fn_cache.name,))
+    return fn_cache, False
+
+
+def save_cached(p, fn_out, key, dpi=100, fol_cache=DEFAULT_FOL_CACHE,
+                max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Saves a ggplot, reusing a previously rendered image if neither
+    the plot key nor the data changed.
+    Input:
+        p: the ggplot
+        fn_out: the output file, the suffix defines the format
+        key: string describing the plot, see figure_key
+        dpi: resolution for raster formats
+        fol_cache: the cache folder
+        max_bytes: maximum size of the cache, least recently used
+                   figures are evicted
+    Returns:
+        True if the figure was taken from the cache
+    """
+    fmt = pathlib.Path(fn_out).suffix.lstrip('.')
+    fn_cache, is_hit = _cached_file(p, key, fmt, dpi, fol_cache, max_bytes)
+    shutil.copyfile(fn_cache, fn_out)
+    return is_hit
+
+
+def show(p, key, fmt='png', dpi=100, fol_cache=DEFAULT_FOL_CACHE,
+         max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Displays a ggplot in the notebook, using the cached image
+    if neither the plot key nor the data changed.
+    Input:
+        see save_cached
+    Returns:
+        An IPython image
+    """
+    from IPython import display
+    fn_cache, _ = _cached_file(p, key, fmt, dpi, fol_cache, max_bytes)
+    if fmt == 'svg':
+        return display.SVG(filename=str(fn_cache))
+    return display.Image(filename=str(fn_cache))
@@ -0,0 +1,286 @@
+"""
+The ggplot pipelines of the Swiss case overview and of the monitoring topics.
+
+Every figure function takes the data dict (see cases.load_cases, plus
+'dat_long' from cases.long_view) as first argument and returns a ggplot,
+so figures can be shown in the notebook or rendered in batch (see render).
+Maps (canton_map) are drawn with matplotlib from the cached canton
+geometries, see geometry.
+
+The plotting stack is only imported when a figure is built, so the figure
+specs and pipelines can be set up by processes that never draw.
+"""
+import glob
+
+import pandas as pd
+
+import helpers.cases as cases
+import helpers.geometry as geometry
+import helpers.ingest as ingest
+from helpers.cases import C, V
+import helpers.library as lib
+import helpers.pipeline as pipeline
+import helpers.render as render
+import helpers.zhmonitoring as zhm
+from helpers.render import FigureSpec
+
+# Scales for the per canton plots
+SCALES = ('log10', 'linear', 'free_y')
+
+
+def _plotting():
+    """
+    Imports the plotting stack on first use.
+    Returns:
+        (plotnine, colorcet)
+    """
+    import colorcet  # colormaps
+    import plotnine as gg  # a great ggplot clone
+    return gg, colorcet
+
+
+def cases_stacked(data, cur_vars, ct=None, rev=False, facet='grid', figure_size=(3, 10)):
+    """
+    Cases over time, stacked by canton, one panel per variable.
+    Input:
+        data: dict with 'dat_long'
+        cur_vars: variables to plot
+        ct: optional categorical dtype to order the cantons
+        rev: revert the canton order
+        facet: 'grid' to stack the panels, 'wrap' to wrap them
+        figure_size: the figure size
+    """
+    gg, colorcet = _plotting()
+    if ct is None:
+        pdat = data['dat_long'].view(cur_vars)
+        guide = 'legend'
+    else:
+        pdat = data['dat_long'].view(cur_vars, V.COL_CANTON, ct, rev=rev)
+        guide = gg.guide_legend(reverse=True)
+    if facet == 'grid':
+        facets = gg.facet_grid(f'{V.COL_VARIABLES}~.', scales='free_y')
+        theme = gg.theme(axis_text_x=gg.element_text(angle=90, hjust=1),
+                         figure_size=figure_size)
+    else:
+        facets = gg.facet_wrap(f'{V.COL_VARIABLES}', scales='free_y')
+        theme = gg.theme(axis_text_x=gg.element_text(angle=90, hjust=1),
+                         figure_size=figure_size,
+                         subplots_adjust={'wspace': 0.4})
+    return (pdat
+            >>
+            gg.ggplot(gg.aes(x=f'{V.COL_DATE}', y=V.COL_VALUE, fill=V.COL_CANTON))
+            + facets
+            + gg.geom_bar(stat='identity')
+            + gg.scale_fill_manual(colorcet.glasbey, name='Cantons', guide=guide)
+            + gg.scale_x_datetime(date_breaks='1 week')
+            + gg.xlab('Date')
+            + gg.ylab('Cases')
+            + gg.ggtitle('Covid-19 in Switzerland')
+            + gg.theme_minimal()
+            + theme
+            )
+
+
+def cases_per_canton(data, cur_vars, ct=None, rev=False, scale='log10', categories=None):
+    """
+    Cases over time, one panel per canton and one line per variable.
+    Input:
+        data: dict with 'dat_long'
+        cur_vars: variables to plot
+        ct: optional categorical dtype to order the cantons
+        rev: revert the canton order
+        scale: 'log10', 'linear' or 'free_y' (linear with individual scaling)
+        categories: variables to assign colors to, see lib.LongView.view
+    """
+    if scale not in SCALES:
+        raise ValueError(f'Unknown scale: {scale}')
+    gg, colorcet = _plotting()
+    if ct is None:
+        pdat = data['dat_long'].view(cur_vars, categories=categories)
+    else:
+        pdat = data['dat_long'].view(cur_vars, V.COL_CANTON, ct, rev=rev, categories=categories)
+    g = (pdat
+         >>
+         gg.ggplot(gg.aes(x=f'{V.COL_DATE}',
+                          y=V.COL_VALUE,
+                          color=V.COL_VARIABLES))
+         + gg.facet_wrap(f'{V.COL_CANTON}', scales='free_y' if scale == 'free_y' else 'fixed')
+         + gg.geom_line(stat='identity')
+         + gg.scale_color_manual(colorcet.glasbey)
+         + gg.scale_x_datetime(date_breaks='1 week')
+         + gg.xlab('Date')
+         + gg.ylab('Cases')
+         + gg.ggtitle('Cases per canton')
+         + gg.theme_minimal()
+         )
+    if scale == 'log10':
+        g += gg.scale_y_log10()
+    if scale == 'free_y':
+        g += gg.theme(axis_text_x=gg.element_text(angle=90, hjust=1),
+                      figure_size=(10, 10),
+                      subplots_adjust={'wspace': 0.4})
+    else:
+        g += gg.theme(axis_text_x=gg.element_text(angle=90, hjust=1),
+                      figure_size=(10, 10))
+    return g
+
+
+def variable_per_canton(data, var, ct=None, rev=False):
+    """
+    A single variable over time per canton, with the original
+    data points overlaid on the interpolated daily values.
+    Input:
+        data: dict with 'dat_daily' and 'dat_total'
+        var: the variable to plot
+        ct: optional categorical dtype to order the cantons
+        rev: revert the canton order
+    """
+    gg, colorcet = _plotting()
+    dat_daily, dat_total = data['dat_daily'], data['dat_total']
+    if ct is not None:
+        dat_daily = dat_daily.assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON], ct, rev=rev)})
+        dat_total = dat_total.assign(**{V.COL_CANTON: lambda x: lib.order_cat(x[V.COL_CANTON], ct, rev=rev)})
+    return (dat_daily
+            >>
+            gg.ggplot(gg.aes(x=f'{V.COL_DATE}'))
+            + gg.facet_wrap(f'{V.COL_CANTON}')
+            + gg.scale_fill_manual(colorcet.glasbey)
+            + gg.scale_x_datetime(date_breaks='1 week')
+            + gg.scale_y_log10()
+            + gg.xlab('Date')
+            + gg.theme_minimal()
+            + gg.theme(axis_text_x=gg.element_text(angle=90, hjust=1))
+            + gg.geom_line(gg.aes(y=var), color='grey')
+            + gg.geom_point(gg.aes(y=var), data=dat_total, color='black')
+            + gg.ylab(V.vars_labels[var])
+            + gg.ggtitle(V.vars_labels[var])
+            )
+
+
+def canton_map(dat_daily, var, date, geom=None, tolerance=None, cmap='viridis',
+               vmin=None, vmax=None, title=None, **kwargs):
+    """
+    Map of the cantons colored by a variable of the daily data on one date.
+    Other dates can be drawn into the same map by only updating the colors,
+    see geometry.choropleth.
+    Input:
+        dat_daily: daily data, e.g. from cases.per_100k
+        var: the variable to map
+        date: the date
+        geom: canton geometry (default: geometry.Geometry.load())
+        tolerance: simplification of the borders, see geometry.Geometry.tolerance
+        cmap, vmin, vmax: colormap and its range (default: range on the date)
+        title: figure title (default: label of the variable and the date)
+        kwargs: passed to geometry.choropleth
+    Returns:
+        (matplotlib figure, PathCollection of the cantons)
+    """
+    import matplotlib.pyplot as plt
+    if geom is None:
+        geom = geometry.Geometry.load(verbose=False)
+    values = (dat_daily.loc[dat_daily[V.COL_DATE] == pd.Timestamp(date), [V.COL_CANTON, var]]
+              .assign(**{V.COL_CANTON: lambda d: d[V.COL_CANTON].astype(str)})
+              .set_index(V.COL_CANTON)[var])
+    vmin = values.min() if vmin is None else vmin
+    vmax = values.max() if vmax is None else vmax
+    fig, ax = plt.subplots(figsize=(8, 5.5))
+    collection = geometry.choropleth(geom, values, tolerance=tolerance, ax=ax, cmap=cmap,
+                                     vmin=vmin, vmax=vmax, **kwargs)
+    fig.colorbar(plt.cm.ScalarMappable(norm=plt.Normalize(vmin, vmax), cmap=cmap), ax=ax, shrink=0.7)
+    ax.set_title(title or f'{V.vars_labels.get(var, var)}, {pd.Timestamp(date):%d.%m.%Y}')
+    return fig, collection
+
+
+def report_specs(orderings):
+    """
+    Specs for all figures of the Swiss case overview report:
+    every variable, canton ordering and scale.
+    Input:
+        orderings: dict name -> categorical dtype for the cantons
+                   (None for alphabetical)
+    Returns:
+        List of FigureSpec, see render.render_figures
+    """
+    var_sets = {'main': list(V.vars_main), 'all': list(V.vars_all)}
+    specs = []
+    for order, ct in orderings.items():
+        for var_set, cur_vars in var_sets.items():
+            specs.append(FigureSpec(f'stacked_{var_set}_{order}', cases_stacked,
+                                    dict(cur_vars=cur_vars, ct=ct, rev=True,
+                                         facet='grid' if var_set == 'main' else 'wrap',
+                                         figure_size=(3, 10) if var_set == 'main' else (10, 10))))
+            for scale in SCALES:
+                specs.append(FigureSpec(f'per_canton_{var_set}_{scale}_{order}', cases_per_canton,
+                                        dict(cur_vars=cur_vars, ct=ct, scale=scale)))
+        for var in V.vars_all:
+            specs.append(FigureSpec(f'variable_{var}_{order}', variable_per_canton,
+                                    dict(var=var, ct=ct)))
+    return specs
+
+
+def report_data(dat_total, dat_daily, dat_long):
+    """
+    The data dict the figure functions take.
+    """
+    return {'dat_total': dat_total, 'dat_daily': dat_daily, 'dat_long': dat_long}
+
+
+def report_pipeline(glob_cases=C.glob_cases, interpolation=C.interpolation,
+                    fmt='png', dpi=100, **kwargs):
+    """
+    The Swiss case overview as cached pipeline: loading and parsing,
+    interpolation, canton ordering, long view and one node per figure
+    (the rendered image, see render.figure_image).
+    Input:
+        glob_cases, interpolation: see cases.load_cases
+        fmt, dpi: format of the figures
+        kwargs: passed to pipeline.Pipeline, e.g. fol_cache or n_jobs
+    Returns:
+        The pipeline.Pipeline, the figure nodes are named fig_<figure name>
+    """
+    pipe = pipeline.Pipeline(**kwargs)
+    # The helper modules the nodes call are part of their keys
+    pipe.add('dat_total', cases.read_cases,
+             params=dict(glob_cases=glob_cases, verbose=False, schema=V.schema_cases),
+             sources=glob.glob(glob_cases), code=[ingest, cases])
+    pipe.add('dat_daily', cases.daily_cases, deps=['dat_total'], params=dict(interpolation=interpolation),
+             code=[lib])
+    pipe.add('cat_cantons_deceased', cases.order_cantons, deps=['dat_daily'])
+    pipe.add('dat_long', cases.long_view, deps=['dat_daily'], code=[lib])
+    # Only combines the outputs above, not worth storing again
+    pipe.add('data', report_data, deps=['dat_total', 'dat_daily', 'dat_long'], cache=False)
+    for order, dep in [('alphabetical', []), ('deceased', ['cat_cantons_deceased'])]:
+        for spec in report_specs({order: None}):
+            pipe.add(f'fig_{spec.name}', render.figure_image, deps=['data'] + dep,
+                     params=dict(fkt=spec.fkt, kwargs=spec.kwargs, fmt=fmt, dpi=dpi),
+                     code=[_plotting, lib])
+    return pipe
+
+
+def topic_plot(pdat, topic):
+    """
+    Normalized monitoring indicators of one topic, one panel per indicator.
+    Input:
+        pdat: the data of the weekly plots, see zhm.plot_data
+        topic: the topic to plot
+    """
+    gg, _ = _plotting()
+    V, C = zhm.V, zhm.C
+    pdat = pdat.loc[pdat[V.COL_TOPIC] == topic, :]
+    return (pdat
+            >>
+            gg.ggplot(gg.aes(x=V.COL_DATE, y=V.COL_VALUE_NORM, color=V.COL_DAYOFWEEK, shape=V.COL_ISWEEKDAY))
+            + gg.facet_grid(f'{V.COL_LABEL}~.', scales='free')
+            + gg.geom_vline(linetype='-', color='b', xintercept=C.days_intervention,
+                            alpha=0.7)
+            + gg.geom_line(gg.aes(group=[V.COL_WEEK]))
+            + gg.geom_point(size=1.5)
+            + gg.scale_color_cmap_d('Dark2')
+            + gg.theme_minimal()
+            + gg.theme(axis_text_x=gg.element_text(angle=90, hjust=1),
+                       figure_size=(8, 2 * pdat[V.COL_LABEL].nunique()),
+                       strip_text_y=gg.element_text(angle=0, ha='left'))
+            + gg.scale_x_date(breaks=pd.date_range(C.day_start, pdat[V.COL_DATE].max(), freq='W-MON'))
+            + gg.scale_y_log10()
+            + gg.ggtitle(f'{topic}\nnormalized by calendar week average')
+            )
@@ -0,0 +1,322 @@
+"""
+Canton geometries for choropleth maps, from the GeoJSON of
+https://github.com/ZHB/switzerland-geojson.
+
+The GeoJSON is parsed once and every ring is simplified (Douglas-Peucker)
+at a few tolerances. The simplified rings are stored as flat coordinate
+arrays with ring offsets in one binary (.npz) file, keyed by the content of
+the GeoJSON and the tolerances. Maps build one path per canton from the
+cached arrays; drawing another date only sets the face colors.
+"""
+import json
+import os
+import pathlib
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import helpers.cache as cache
+from helpers.cases import V
+
+FN_CANTONS = 'data/maps/switzerland-geojson/cantons/cantons.geojson'
+FOL_CACHE = '.cache/geometry'
+# Tolerances in degrees, about 50 m, 200 m and 1 km
+TOLERANCES = (0.0005, 0.002, 0.01)
+# Bump if the simplification changes, the cached files are then rebuilt
+GEOMETRY_VERSION = 1
+
+# Properties that may hold the canton abbreviation or name
+_PROPS_ABBREVIATION = ('abbreviation', 'abbr', 'kuerzel', 'KUERZEL')
+_PROPS_NAME = ('name', 'NAME', 'kantonsname', 'KANTONSNAME')
+
+
+def canton_key(properties):
+    """
+    Canton abbreviation of a GeoJSON feature, from an abbreviation or
+    (German, first of multilingual) name property. None if unknown.
+    """
+    for p in _PROPS_ABBREVIATION:
+        if properties.get(p) in V.cantons_bfs.values():
+            return properties[p]
+    for p in _PROPS_NAME:
+        if properties.get(p) is not None:
+            return V.cantons_bfs.get(str(properties[p]).split(' / ')[0])
+    return None
+
+
+def _polygons(geometry):
+    """
+    The polygons of a GeoJSON geometry, each a list of rings (outer ring first).
+    """
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'GeometryCollection':
+        return [p for g in geometry['geometries'] for p in _polygons(g)]
+    return []
+
+
+def signed_area(ring):
+    """
+    Area of a closed ring (shoelace formula), positive if counterclockwise.
+    """
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def simplify(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a line or closed ring.
+    Input:
+        ring: array (points x 2)
+        tolerance: maximal distance of removed points to the simplified line
+    Returns:
+        The kept points, including the first and last point
+    """
+    n = len(ring)
+    if n <= 4:
+        return ring
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 < 2:
+            continue
+        seg = ring[i1] - ring[i0]
+        pts = ring[i0 + 1:i1] - ring[i0]
+        # Distance to the segment (not the line), closed rings start with a zero length segment
+        length2 = seg @ seg
+        t = np.clip(pts @ seg / length2, 0, 1) if length2 > 0 else np.zeros(len(pts))
+        dist = np.hypot(pts[:, 0] - t * seg[0], pts[:, 1] - t * seg[1])
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            mid = i0 + 1 + k
+            keep[mid] = True
+            stack += [(i0, mid), (mid, i1)]
+    return ring[keep]
+
+
+def _level(features, tolerance):
+    """
+    Simplifies all rings with one tolerance. Rings that collapse
+    are dropped, except the largest ring of every feature.
+    Outer rings are oriented counterclockwise, holes clockwise.
+    Returns:
+        (coordinates (points x 2), ring offsets (rings + 1), feature of every ring)
+    """
+    coords, offsets, ring_features = [], [0], []
+    for i, polygons in enumerate(features):
+        rings = []
+        for polygon in polygons:
+            for j, ring in enumerate(polygon):
+                simple = simplify(ring, tolerance) if tolerance > 0 else ring
+                area = signed_area(simple)
+                # Outer rings (j == 0) counterclockwise, holes clockwise
+                if (area < 0) == (j == 0):
+                    simple = simple[::-1]
+                rings.append((abs(signed_area(ring)), len(simple) >= 4, simple))
+        largest = max(range(len(rings)), key=lambda r: rings[r][0]) if rings else None
+        for r, (_, is_valid, simple) in enumerate(rings):
+            if is_valid or r == largest:
+                coords.append(simple)
+                offsets.append(offsets[-1] + len(simple))
+                ring_features.append(i)
+    coords = np.concatenate(coords) if coords else np.empty((0, 2))
+    return (coords.astype(np.float32), np.asarray(offsets, dtype=np.int64),
+            np.asarray(ring_features, dtype=np.int32))
+
+
+class Geometry:
+    """
+    Simplified rings of the features of a GeoJSON at several tolerances,
+    see the module documentation.
+    """
+
+    def __init__(self, keys, levels):
+        """
+        Input:
+            keys: the key (e.g. canton abbreviation) of every feature
+            levels: dict tolerance -> (coordinates, ring offsets, feature of every ring)
+        """
+        self.keys = pd.Index(keys)
+        self.levels = dict(sorted(levels.items()))
+        self._paths = {}
+
+    @classmethod
+    def from_geojson(cls, fn, tolerances=TOLERANCES, fkt_key=canton_key):
+        """
+        Parses a GeoJSON and simplifies its (multi)polygons.
+        Features without key (see fkt_key) are skipped, features
+        with the same key are merged.
+        """
+        with open(fn, encoding='utf-8') as f:
+            geojson = json.load(f)
+        polygons = {}
+        for feature in geojson['features']:
+            key = fkt_key(feature.get('properties') or {})
+            if key is None:
+                continue
+            polygons.setdefault(key, []).extend(
+                [[np.asarray(ring, dtype=float)[:, :2] for ring in polygon]
+                 for polygon in _polygons(feature['geometry'])])
+        keys = list(polygons)
+        return cls(keys, {t: _level([polygons[k] for k in keys], t) for t in tolerances})
+
+    def save(self, fn):
+        """
+        Writes the geometry to one uncompressed .npz file.
+        """
+        arrays = {'keys': np.asarray(self.keys, dtype=str),
+                  'tolerances': np.asarray(list(self.levels), dtype=float)}
+        for i, (coords, offsets, ring_features) in enumerate(self.levels.values()):
+            arrays.update({f'coords_{i}': coords, f'offsets_{i}': offsets,
+                           f'features_{i}': ring_features})
+        with open(fn, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def read(cls, fn):
+        """
+        Reads a geometry written by save.
+        """
+        with np.load(fn) as arrays:
+            levels = {float(t): (arrays[f'coords_{i}'], arrays[f'offsets_{i}'], arrays[f'features_{i}'])
+                      for i, t in enumerate(arrays['tolerances'])}
+            return cls(arrays['keys'].tolist(), levels)
+
+    @classmethod
+    def load(cls, fn=FN_CANTONS, tolerances=TOLERANCES, fol_cache=FOL_CACHE,
+             max_bytes=cache.DEFAULT_MAX_BYTES, verbose=True):
+        """
+        Loads the geometry from the cache, or parses and simplifies
+        the GeoJSON if it changed.
+        """
+        t0 = time.perf_counter()
+        fol_cache = pathlib.Path(fol_cache)
+        key = cache.make_key([fn], params={'tolerances': list(tolerances), 'version': GEOMETRY_VERSION,
+                                           'cantons': V.cantons_bfs},
+                             code=(canton_key, simplify, _level, cls.from_geojson))
+        fn_cache = fol_cache / f'{key}.npz'
+        if fn_cache.exists():
+            geom = cls.read(fn_cache)
+            # Mark as recently used
+            os.utime(fn_cache)
+            if verbose:
+                print(f'Cache hit {key}: loaded in {time.perf_counter() - t0:.2f}s')
+            return geom
+        geom = cls.from_geojson(fn, tolerances)
+        fol_cache.mkdir(parents=True, exist_ok=True)
+        fn_tmp = fol_cache / f'.tmp-{uuid.uuid4().hex}.npz'
+        geom.save(fn_tmp)
+        os.replace(fn_tmp, fn_cache)
+        cache.evict(fol_cache, max_bytes=max_bytes, keep=(fn_cache.name,))
+        if verbose:
+            print(f'Cache miss {key}: computed in {time.perf_counter() - t0:.2f}s')
+        return geom
+
+    def tolerance(self, tolerance=None):
+        """
+        The stored tolerance to use: the coarsest one not above the
+        requested tolerance (default and fallback: the finest).
+        """
+        stored = list(self.levels)
+        if tolerance is None:
+            return stored[0]
+        return max([t for t in stored if t <= tolerance], default=stored[0])
+
+    def rings(self, tolerance=None):
+        """
+        Rings of every feature.
+        Returns:
+            list with a list of (points x 2) arrays per feature
+        """
+        coords, offsets, ring_features = self.levels[self.tolerance(tolerance)]
+        rings = [[] for _ in self.keys]
+        for i, f in enumerate(ring_features):
+            rings[f].append(coords[offsets[i]:offsets[i + 1]])
+        return rings
+
+    def bounds(self, tolerance=None):
+        """
+        (xmin, ymin, xmax, ymax) of all features.
+        """
+        coords = self.levels[self.tolerance(tolerance)][0]
+        return tuple(coords.min(axis=0)) + tuple(coords.max(axis=0))
+
+    def paths(self, tolerance=None):
+        """
+        One matplotlib path per feature (holes included), built once per tolerance.
+        """
+        tolerance = self.tolerance(tolerance)
+        if tolerance not in self._paths:
+            from matplotlib.path import Path
+            coords, offsets, ring_features = self.levels[tolerance]
+            codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+            codes[offsets[:-1]] = Path.MOVETO
+            codes[offsets[1:] - 1] = Path.CLOSEPOLY
+            starts = np.searchsorted(ring_features, np.arange(len(self.keys)), side='left')
+            stops = np.searchsorted(ring_features, np.arange(len(self.keys)), side='right')
+            self._paths[tolerance] = [Path(coords[offsets[a]:offsets[b]], codes[offsets[a]:offsets[b]])
+                                      for a, b in zip(starts, stops)]
+        return self._paths[tolerance]
+
+
+def face_colors(geom, values, cmap='viridis', vmin=None, vmax=None, missing_color='lightgrey'):
+    """
+    Colors of the features for values.
+    Input:
+        geom: a Geometry
+        values: series indexed by the feature keys
+        cmap: matplotlib colormap (name)
+        vmin, vmax: range of the colormap (default: range of the values)
+        missing_color: color of features without value
+    Returns:
+        Array (features x 4) with RGBA colors
+    """
+    import matplotlib
+    import matplotlib.colors as mcolors
+    vals = pd.Series(values).reindex(geom.keys).to_numpy(dtype=float)
+    norm = mcolors.Normalize(vmin=np.nanmin(vals) if vmin is None else vmin,
+                             vmax=np.nanmax(vals) if vmax is None else vmax)
+    colors = matplotlib.colormaps[cmap](norm(vals)) if isinstance(cmap, str) else cmap(norm(vals))
+    colors[np.isnan(vals)] = mcolors.to_rgba(missing_color)
+    return colors
+
+
+def choropleth(geom, values, tolerance=None, ax=None, cmap='viridis', vmin=None, vmax=None,
+               missing_color='lightgrey', edgecolor='white', linewidth=0.5):
+    """
+    Draws the features colored by values.
+    For animations, draw once and update the colors per frame with
+    collection.set_facecolor(face_colors(geom, values, ...)).
+    Input:
+        geom: a Geometry
+        values: series indexed by the feature keys
+        tolerance: simplification, see Geometry.tolerance
+        ax: matplotlib axes (default: new figure)
+        cmap, vmin, vmax, missing_color: see face_colors
+        edgecolor, linewidth: style of the borders
+    Returns:
+        The PathCollection of the features
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import PathCollection
+    if ax is None:
+        _, ax = plt.subplots(figsize=(8, 5.5))
+    collection = PathCollection(geom.paths(tolerance),
+                                facecolors=face_colors(geom, values, cmap, vmin, vmax, missing_color),
+                                edgecolors=edgecolor, linewidths=linewidth)
+    # Paths are in data coordinates
+    collection.set_transform(ax.transData)
+    ax.add_collection(collection)
+    xmin, ymin, xmax, ymax = geom.bounds(tolerance)
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+    # Degrees of longitude are shorter than of latitude at Swiss latitudes
+    ax.set_aspect(1 / np.cos(np.deg2rad((ymin + ymax) / 2)))
+    ax.set_axis_off()
+    return collection
@@ -0,0 +1,247 @@
+"""
+Loading of the worldwide daily reports of Johns Hopkins CSSE
+(https://github.com/CSSEGISandData/COVID-19).
+
+There is one csv per day, whose columns changed several times. The reports
+are normalized to one schema and parsed in parallel. The parsed rows and a
+manifest of the files they came from are kept on disk, so later loads only
+parse files that were added or changed.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+import helpers.trace as trace
+
+FOL_REPORTS = 'data/covid/COVID-19/csse_covid_19_data/csse_covid_19_daily_reports'
+FOL_CACHE = '.cache/jhu'
+FN_MANIFEST = 'manifest.json'
+FN_ROWS = 'rows.parquet'
+# Bump if the normalization changes, the cached rows are then discarded
+MANIFEST_VERSION = 1
+
+COL_DATE = 'date'
+COL_REGION = 'region'
+COL_COUNTRY = 'country'
+COL_PROVINCE = 'province'
+COL_ADMIN2 = 'admin2'
+COL_FILE = 'file'
+VARIABLES = ['confirmed', 'deaths', 'recovered', 'active']
+COLS_KEY = [COL_COUNTRY, COL_PROVINCE, COL_ADMIN2]
+
+# Column names of all report versions -> normalized names.
+# Other columns (coordinates, rates, keys) are not read.
+COLUMNS = {'Province/State': COL_PROVINCE,
+           'Province_State': COL_PROVINCE,
+           'Country/Region': COL_COUNTRY,
+           'Country_Region': COL_COUNTRY,
+           'Admin2': COL_ADMIN2,
+           'Confirmed': 'confirmed',
+           'Deaths': 'deaths',
+           'Recovered': 'recovered',
+           'Active': 'active'}
+
+# Country names that changed between reports
+COUNTRY_ALIASES = {'Mainland China': 'China',
+                   'South Korea': 'Korea, South',
+                   'Republic of Korea': 'Korea, South',
+                   'Iran (Islamic Republic of)': 'Iran',
+                   'Hong Kong SAR': 'Hong Kong',
+                   'Macao SAR': 'Macau',
+                   'Taiwan': 'Taiwan*',
+                   'Viet Nam': 'Vietnam',
+                   'Russian Federation': 'Russia',
+                   'Republic of Moldova': 'Moldova',
+                   'Czech Republic': 'Czechia',
+                   'UK': 'United Kingdom',
+                   'occupied Palestinian territory': 'West Bank and Gaza',
+                   'The Bahamas': 'Bahamas',
+                   'Bahamas, The': 'Bahamas',
+                   'The Gambia': 'Gambia',
+                   'Gambia, The': 'Gambia',
+                   'Ivory Coast': "Cote d'Ivoire",
+                   'Republic of Ireland': 'Ireland',
+                   'North Ireland': 'United Kingdom',
+                   ' Azerbaijan': 'Azerbaijan'}
+
+# Daily reports are named MM-DD-YYYY.csv
+_RE_REPORT = re.compile(r'^(\d{2})-(\d{2})-(\d{4})\.csv$')
+
+
+def report_files(fol_reports=FOL_REPORTS):
+    """
+    The daily report files, sorted by date.
+    """
+    files = [f for f in pathlib.Path(fol_reports).iterdir() if _RE_REPORT.match(f.name)]
+    return sorted(files, key=lambda f: report_date(f))
+
+
+def report_date(path):
+    """
+    Date of a daily report, from its file name.
+    """
+    month, day, year = _RE_REPORT.match(pathlib.Path(path).name).groups()
+    return pd.Timestamp(int(year), int(month), int(day))
+
+
+def read_report(path):
+    """
+    Reads a daily report and normalizes it.
+    Returns:
+        Data frame with date, country, province, admin2, the variables
+        (missing if not reported in this version) and the file name
+    """
+    # Older reports start with a byte order mark
+    df = pd.read_csv(path, encoding='utf-8-sig', usecols=lambda c: c.strip() in COLUMNS,
+                     dtype={c: str for c in COLUMNS if COLUMNS[c] in COLS_KEY})
+    df = df.rename(columns=lambda c: COLUMNS[c.strip()])
+    for c in COLS_KEY:
+        if c not in df.columns:
+            df[c] = ''
+        df[c] = df[c].fillna('').str.strip()
+    df[COL_COUNTRY] = df[COL_COUNTRY].replace(COUNTRY_ALIASES)
+    for c in VARIABLES:
+        df[c] = pd.to_numeric(df[c], errors='coerce') if c in df.columns else np.nan
+    df.insert(0, COL_DATE, report_date(path))
+    df[COL_FILE] = pathlib.Path(path).name
+    return df[[COL_DATE] + COLS_KEY + VARIABLES + [COL_FILE]].astype(_dtypes())
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _changed_files(files, manifest):
+    """
+    Files that are new or whose content changed since the manifest was written.
+    Unchanged size and modification time are trusted, else the content is hashed.
+    Returns:
+        (changed files, updated manifest entries of all files)
+    """
+    changed, entries = [], {}
+    for f in files:
+        st = f.stat()
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        old = manifest.get(f.name)
+        if old is not None and old['size'] == entry['size'] and old['mtime_ns'] == entry['mtime_ns']:
+            entries[f.name] = old
+            continue
+        entry['sha256'] = _file_hash(f)
+        if old is None or old.get('sha256') != entry['sha256']:
+            changed.append(f)
+        entries[f.name] = entry
+    return changed, entries
+
+
+def _dtypes():
+    """
+    Column types of the normalized reports. Text columns are str, as they are read
+    back from parquet (object before pandas 3, str dtype from pandas 3 on).
+    """
+    dtypes = {COL_DATE: 'datetime64[ns]'}
+    dtypes.update({c: str for c in COLS_KEY})
+    dtypes.update({c: float for c in VARIABLES})
+    dtypes[COL_FILE] = str
+    return dtypes
+
+
+def _empty_reports():
+    """
+    Normalized report without rows.
+    """
+    return pd.DataFrame({c: pd.Series(dtype=t) for c, t in _dtypes().items()})
+
+
+def read_reports(files, n_jobs=None):
+    """
+    Reads daily reports in parallel threads (pandas releases the GIL while parsing).
+    Returns:
+        The concatenated normalized reports
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as ex:
+        frames = list(ex.map(read_report, files))
+    if len(frames) == 0:
+        return _empty_reports()
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_reports(fol_reports=FOL_REPORTS, fol_cache=FOL_CACHE, n_jobs=None, verbose=True):
+    """
+    Loads all daily reports, only parsing files that were added
+    or changed since the last load.
+    Input:
+        fol_reports: folder with the daily reports
+        fol_cache: folder for the manifest and the parsed rows
+        n_jobs: number of threads parsing files
+        verbose: print how many files were parsed
+    Returns:
+        Data frame with the normalized rows of all reports, see read_report
+    """
+    t0 = time.perf_counter()
+    fol_cache = pathlib.Path(fol_cache)
+    files = report_files(fol_reports)
+    manifest, rows = {}, None
+    if (fol_cache / FN_MANIFEST).exists() and (fol_cache / FN_ROWS).exists():
+        with open(fol_cache / FN_MANIFEST) as f:
+            stored = json.load(f)
+        if stored.get('version') == MANIFEST_VERSION:
+            manifest = stored['files']
+            rows = pd.read_parquet(fol_cache / FN_ROWS)
+    changed, entries = _changed_files(files, manifest)
+    removed = set(manifest) - set(entries)
+    if rows is None:
+        rows = _empty_reports()
+    if not changed and not removed:
+        if verbose:
+            print(f'{len(files)} reports unchanged, loaded in {time.perf_counter() - t0:.2f}s')
+        return rows
+
+    with trace.stage('read reports') as st:
+        new_rows = read_reports(changed, n_jobs=n_jobs)
+        st.set_rows_out(new_rows)
+    # Replace the rows of changed and removed files
+    is_stale = rows[COL_FILE].isin({f.name for f in changed} | removed)
+    rows = (pd.concat([rows.loc[~is_stale, :], new_rows], ignore_index=True)
+            .sort_values([COL_DATE] + COLS_KEY, kind='stable')
+            .reset_index(drop=True))
+    fol_cache.mkdir(parents=True, exist_ok=True)
+    rows.to_parquet(fol_cache / FN_ROWS, engine='pyarrow')
+    # Written last: if anything failed before, the next load parses the files again
+    with open(fol_cache / FN_MANIFEST, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': entries}, f)
+    if verbose:
+        print(f'Parsed {len(changed)} of {len(files)} reports in {time.perf_counter() - t0:.2f}s')
+    return rows
+
+
+def to_regions(rows, level='country'):
+    """
+    Sums the reports per date and region, in the shape
+    lib.transform_daily_per_canton takes (with col_canton='region').
+    Input:
+        rows: normalized reports, see load_reports
+        level: 'country' or 'province' (country / province)
+    Returns:
+        Data frame with date, region (categorical) and the variables
+    """
+    if level == 'country':
+        region = rows[COL_COUNTRY]
+    elif level == 'province':
+        region = rows[COL_COUNTRY].where(rows[COL_PROVINCE] == '',
+                                         rows[COL_COUNTRY] + ' / ' + rows[COL_PROVINCE])
+    else:
+        raise ValueError(f'Unknown level: {level}')
+    df = (rows[VARIABLES]
+          .groupby([rows[COL_DATE].rename(COL_DATE), region.rename(COL_REGION)], sort=True)
+          .sum(min_count=1)
+          .reset_index())
+    df[COL_REGION] = df[COL_REGION].astype('category')
+    return df
@@ -1,8 +1,13 @@
+import numpy as np
 import pandas as pd
 
+# Interpolation methods that are equivalent to plain linear
+# interpolation on an equally spaced daily grid.
+INTERPOLATION_LINEAR = ('linear', 'time', 'index', 'values')
+
 
 def transform_daily_per_canton(df, value_cols, col_date, col_canton,
-                               interpolation='linear'):
+                               interpolation='linear', engine='pandas'):
     """
     Linearily interpolates variables to get daily data.
     Input:
@@ -12,9 +17,18 @@ def transform_daily_per_canton(df, value_cols, col_date, col_canton,
         col_canton: columns containing the canton/other grouping
         interpolation: how to interpolate. See help pd.DataFrame.interpolate(method=
                        set to 'None' for simple padding of values
+        engine: 'pandas' reshapes via unstack/stack,
+                'numpy' fills one dense (date x canton x variable) array.
+                Both give the same result, 'numpy' is much faster on
+                large data but only supports linear interpolation.
     Returns:
         Interpolated data with daily values
     """
+    if engine == 'numpy':
+        return _transform_daily_numpy(df, value_cols, col_date, col_canton,
+                                      interpolation=interpolation)
+    elif engine != 'pandas':
+        raise ValueError(f'Unknown engine: {engine}')
     df = (df
               .set_index([col_date, col_canton])
               .loc[:, value_cols]
@@ -40,7 +54,7 @@ def transform_daily_per_canton(df, value_cols, col_date, col_canton,
     df = (df
           # Pad missing values with previous day's number
           # If interpolation was used, this will pad the tail
-          .fillna(method='pad')
+          .ffill()
 
           # Now there are only missing values at the start
           # of the series, so set them to zero
@@ -53,9 +67,437 @@ def transform_daily_per_canton(df, value_cols, col_date, col_canton,
           .stack(level=[0, 1]).unstack(-2)
           .reset_index()
           )
+    # Older pandas sorted the variables when stacking, newer keep their order
+    return df.loc[:, [col_date, col_canton] + sorted(value_cols)]
+
+
+def _fill_previous_index(valid):
+    """
+    For every position along the first axis, returns the index of the
+    last valid position at or before it (-1 if there is none).
+    """
+    idx = np.arange(valid.shape[0]).reshape((-1,) + (1,) * (valid.ndim - 1))
+    return np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+
+
+def _fill_next_index(valid):
+    """
+    For every position along the first axis, returns the index of the
+    next valid position at or after it (len if there is none).
+    """
+    n = valid.shape[0]
+    idx = np.arange(n).reshape((-1,) + (1,) * (valid.ndim - 1))
+    return np.minimum.accumulate(np.where(valid, idx, n)[::-1], axis=0)[::-1]
+
+
+def fill_daily_array(arr, interpolation='linear'):
+    """
+    Fills missing values along the first (time) axis of an array, the
+    same way transform_daily_per_canton does:
+    linear interpolation between observed values, padding of the tail
+    and zeros before the first observation.
+    Input:
+        arr: float array with time as first axis, NaN for missing values
+        interpolation: 'linear' or None for simple padding
+    Returns:
+        A filled copy of the array
+    """
+    arr = np.array(arr, dtype=float)
+    shape = arr.shape
+    arr = arr.reshape(shape[0], -1)
+    if interpolation is not None:
+        if interpolation not in INTERPOLATION_LINEAR:
+            raise ValueError(f'Interpolation not supported: {interpolation}')
+        valid = ~np.isnan(arr)
+        prev = _fill_previous_index(valid)
+        nxt = _fill_next_index(valid)
+        # Work on flat indices, that is much cheaper than tuples of indices
+        ncols = arr.shape[1]
+        flat = np.flatnonzero(~valid & (prev >= 0) & (nxt < shape[0]))
+        t, col = np.divmod(flat, ncols)
+        p, n = prev.ravel()[flat], nxt.ravel()[flat]
+        values = arr.ravel()
+        y0 = values[p * ncols + col]
+        y1 = values[n * ncols + col]
+        # Same formula as np.interp, which pandas uses for 'linear'
+        slope = (y1 - y0) / (n - p)
+        values[flat] = slope * (t - p) + y0
+    prev = _fill_previous_index(~np.isnan(arr))
+    arr = np.take_along_axis(arr, np.maximum(prev, 0), axis=0)
+    arr[prev < 0] = 0
+    return arr.reshape(shape)
+
+
+def _day_offsets(dates, day_start):
+    """
+    Returns the number of days since day_start for every date and a mask
+    of the dates that fall exactly on a day (i.e. are part of a daily index).
+    """
+    dates = pd.DatetimeIndex(dates)
+    days = (dates - day_start) // pd.Timedelta(days=1)
+    is_daily = np.asarray(dates == day_start + days * pd.Timedelta(days=1))
+    return np.asarray(days), is_daily
+
+
+def _transform_daily_numpy(df, value_cols, col_date, col_canton,
+                           interpolation='linear'):
+    """
+    Numpy engine for transform_daily_per_canton.
+    Scatters the observations into a dense (date x canton x variable)
+    array, fills it and builds the tidy output frame in one go.
+    """
+    value_cols = sorted(value_cols)
+    ncodes, cantons = pd.factorize(df[col_canton], sort=True)
+    dates = pd.DatetimeIndex(df[col_date])
+    days, is_daily = _day_offsets(dates, dates.min().normalize())
+    is_daily &= ncodes >= 0
+    days = days[is_daily]
+    ncodes = ncodes[is_daily]
+    date_index = pd.DatetimeIndex(
+        pd.date_range(dates.min(), dates.max(), freq='D'), name=col_date)
+    ndays, ncantons = len(date_index), len(cantons)
+
+    flat = days * ncantons + ncodes
+    if len(np.unique(flat)) != len(flat):
+        raise ValueError('Index contains duplicate entries, cannot reshape')
+    values = df.loc[is_daily, value_cols]
+    cube = np.full((ndays * ncantons, len(value_cols)), np.nan)
+    cube[flat, :] = values.to_numpy(dtype=float, na_value=np.nan)
+    # Integer columns only survive if there was nothing to fill
+    has_gaps = np.isnan(cube).any(axis=0)
+    dtype = np.result_type(*[
+        np.dtype(float) if gaps and d.kind in 'iub' else d
+        for gaps, d in zip(has_gaps, values.dtypes)])
+
+    cube = fill_daily_array(cube.reshape(ndays, ncantons, -1),
+                            interpolation=interpolation)
+    out = pd.DataFrame(cube.reshape(ndays * ncantons, -1).astype(dtype, copy=False),
+                       columns=pd.Index(value_cols))
+    out.insert(0, col_canton, cantons.take(np.tile(np.arange(ncantons), ndays)))
+    out.insert(0, col_date, date_index.repeat(ncantons))
+    return out
+
+
+def _trailing_sum(x, window):
+    """
+    Sum over the trailing window along the first axis
+    (partial windows at the start) from running sums.
+    """
+    csum = np.cumsum(x, axis=0)
+    out = csum.copy()
+    out[window:] -= csum[:-window]
+    return out
+
+
+def rolling_array(arr, window, center=False, stride=1, min_periods=1,
+                  exclude_current=False):
+    """
+    NaN aware rolling mean along the first (time) axis of an array,
+    computed for all series (other axes) at once from running sums,
+    so the cost is linear in the length of the series for any window.
+    Input:
+        arr: float array with time as first axis, NaN for missing values
+        window: number of values in the window
+        center: center the window on the current value (as pandas' rolling(center=True)),
+                else the window is trailing (ends at the current value)
+        stride: distance between the values of a window. E.g. for daily data
+                stride=7 gives a window over the same weekday of the last weeks.
+        min_periods: minimum number of non missing values in a window,
+                     else the mean is NaN
+        exclude_current: shift a trailing window so it ends at the value
+                         before the current one (e.g. a baseline of the previous days)
+    Returns:
+        (rolling mean, number of non missing values in the window)
+    """
+    arr = np.asarray(arr, dtype=float)
+    if center and exclude_current:
+        raise ValueError('A centered window can not exclude the current value')
+    # The window ends at t + shift
+    if center:
+        shift = (window - 1) // 2 * stride
+    elif exclude_current:
+        shift = -stride
+    else:
+        shift = 0
+    nt = arr.shape[0]
+    # Pad so every window end is inside the array
+    # and the length is a multiple of the stride
+    pad_start = max(-shift, 0)
+    pad_end = max(shift, 0)
+    pad_end += -(nt + pad_start + pad_end) % stride
+    padded = np.pad(arr, [(pad_start, pad_end)] + [(0, 0)] * (arr.ndim - 1),
+                    constant_values=np.nan)
+    valid = ~np.isnan(padded)
+    values = np.where(valid, padded, 0)
+    # Values with the same offset modulo stride are windowed together
+    shape_strided = (-1, stride) + padded.shape[1:]
+    sums = _trailing_sum(values.reshape(shape_strided), window).reshape(padded.shape)
+    counts = _trailing_sum(valid.reshape(shape_strided).astype(np.int64), window).reshape(padded.shape)
+    start = pad_start + shift
+    sums, counts = sums[start:start + nt], counts[start:start + nt]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts >= max(min_periods, 1), sums / counts, np.nan)
+    return mean, counts
+
+
+def rolling_daily_per_canton(df_daily, value_cols, col_date, col_canton, window,
+                             **kwargs):
+    """
+    Rolling means of the output of transform_daily_per_canton,
+    for all cantons and variables at once.
+    Input:
+        df_daily: output of transform_daily_per_canton
+        value_cols: columns to compute rolling means for
+        col_date, col_canton: as for transform_daily_per_canton
+        window, kwargs: see rolling_array
+    Returns:
+        Data frame with date, canton and the rolling means of the value_cols
+    """
+    value_cols = list(value_cols)
+    dates = pd.DatetimeIndex(df_daily[col_date])
+    # Daily data is ordered by date, with all cantons for every date
+    ncantons = int(np.searchsorted(dates, dates[0], side='right'))
+    cube = (df_daily[value_cols].to_numpy(dtype=float)
+            .reshape(-1, ncantons, len(value_cols)))
+    mean, _ = rolling_array(cube, window, **kwargs)
+    out = pd.DataFrame(mean.reshape(-1, len(value_cols)), columns=value_cols,
+                       index=df_daily.index)
+    out.insert(0, col_canton, df_daily[col_canton])
+    out.insert(0, col_date, df_daily[col_date])
+    return out
+
+
+# How derive_cumulative treats decreasing cumulative counts (reporting corrections)
+NEGATIVE_MODES = ('keep', 'zero', 'backfill')
+
+
+def derive_cumulative(df_daily, value_cols, col_date, col_canton, window=7,
+                      negative='backfill'):
+    """
+    Derives daily new counts, sums over a window, growth rates and doubling
+    times from cumulative variables of the output of transform_daily_per_canton,
+    for all cantons and variables at once.
+    Input:
+        df_daily: output of transform_daily_per_canton
+        value_cols: cumulative columns
+        col_date, col_canton: as for transform_daily_per_canton
+        window: number of days of the sums and of the growth rate
+        negative: how decreasing cumulative counts (corrections) are treated:
+            'keep': negative new counts are kept
+            'zero': negative new counts are set to 0
+            'backfill': the correction is applied to the earlier days, i.e. the
+                        cumulative counts are replaced by the minimum of all
+                        later counts. New counts are never negative and
+                        still add up to the last cumulative count.
+    Returns:
+        Data frame with date, canton and per variable:
+            <var>_new: new counts per day
+            <var>_sum<window>d: new counts in the last `window` days
+            <var>_growth: daily exponential growth rate of the new counts,
+                          comparing the last `window` days to the `window` days before
+            <var>_doubling: days the cumulative count took to double at the
+                            growth of the last `window` days (missing if not growing)
+    """
+    if negative not in NEGATIVE_MODES:
+        raise ValueError(f'Unknown negative mode: {negative}')
+    value_cols = list(value_cols)
+    dates = pd.DatetimeIndex(df_daily[col_date])
+    # Daily data is ordered by date, with all cantons for every date
+    ncantons = int(np.searchsorted(dates, dates[0], side='right'))
+    cum = (df_daily[value_cols].to_numpy(dtype=float)
+           .reshape(-1, ncantons, len(value_cols)))
+    if negative == 'backfill':
+        # Running minimum from the end, ignoring missing values
+        cum = np.where(np.isnan(cum), np.nan, np.fmin.accumulate(cum[::-1], axis=0)[::-1])
+    new = np.full_like(cum, np.nan)
+    new[1:] = np.diff(cum, axis=0)
+    if negative == 'zero':
+        new = np.where(new < 0, 0, new)
+    mean, counts = rolling_array(new, window, min_periods=window)
+    sums = mean * window
+    sums_before = np.full_like(sums, np.nan)
+    sums_before[window:] = sums[:-window]
+    cum_before = np.full_like(cum, np.nan)
+    cum_before[window:] = cum[:-window]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.log(sums / sums_before) / window
+        growth_cum = np.log(cum / cum_before) / window
+        doubling = np.where(growth_cum > 0, np.log(2) / growth_cum, np.nan)
+    growth[~np.isfinite(growth)] = np.nan
+
+    derived = {f'{c}_{suffix}': values[:, :, i].reshape(-1)
+               for i, c in enumerate(value_cols)
+               for suffix, values in [('new', new), (f'sum{window}d', sums),
+                                      ('growth', growth), ('doubling', doubling)]}
+    return pd.concat([df_daily[[col_date, col_canton]],
+                      pd.DataFrame(derived, index=df_daily.index)], axis=1)
+
+
+def per_capita(df, value_cols, col_date, col_canton, population, col_year='year',
+               col_population='population', per=100000):
+    """
+    Normalizes variables by the population of the canton in the year of the date.
+    The population of every row is looked up once and all variables are
+    divided in one broadcast.
+    Input:
+        df: data frame with dates and cantons, e.g. from transform_daily_per_canton
+        value_cols: columns to normalize
+        col_date, col_canton: the date and canton columns
+        population: data frame with canton (col_canton), year and population.
+                    Dates outside of its years take the closest year.
+        col_year, col_population: the year and population columns of population
+        per: number of inhabitants the values are normalized to
+    Returns:
+        Copy of df with the normalized value_cols, missing for cantons without population
+    """
+    value_cols = list(value_cols)
+    pop = population.pivot(index=col_canton, columns=col_year, values=col_population)
+    years = pop.columns.to_numpy()
+    # Population table with an extra row of missing values for unknown cantons
+    table = np.vstack([pop.to_numpy(dtype=float), np.full((1, len(years)), np.nan)])
+    cantons = pd.Index(pop.index.astype(str))
+    col = df[col_canton]
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # -1 (unknown or missing) takes the appended row
+        rows = np.append(cantons.get_indexer(col.cat.categories.astype(str)), -1)[col.cat.codes]
+    else:
+        rows = cantons.get_indexer(col.astype(str))
+    year_pos = np.searchsorted(years, df[col_date].dt.year.to_numpy(), side='right') - 1
+    inhabitants = table[rows, np.clip(year_pos, 0, len(years) - 1)]
+    df = df.copy()
+    df[value_cols] = df[value_cols].to_numpy(dtype=float) / inhabitants[:, None] * per
     return df
 
 
+def last_observed_per_canton(df, value_cols, col_date, col_canton):
+    """
+    Finds the date of the last real (non missing) observation
+    of every variable in every canton.
+    This is the state needed by append_daily_per_canton.
+    Input:
+        df: a data frame with the raw (non daily) data
+        value_cols: columns containing the values of interest
+        col_date: column name containing the dates
+        col_canton: columns containing the canton/other grouping
+    Returns:
+        Data frame with cantons as index and value_cols as columns
+        containing the last observation dates (NaT if never observed)
+    """
+    dates = pd.DatetimeIndex(df[col_date])
+    return (pd.DataFrame({c: dates.where(df[c].notna()) for c in value_cols},
+                         index=df.index)
+            .groupby(df[col_canton], observed=True)
+            .max()
+            .sort_index())
+
+
+def append_daily_per_canton(df_daily, df_new, last_observed, value_cols,
+                            col_date, col_canton, interpolation='linear'):
+    """
+    Incrementally updates the output of transform_daily_per_canton with
+    newly reported raw rows.
+    Only the tail of every series, starting at its last real observation,
+    is recomputed. The result is the same as rerunning
+    transform_daily_per_canton on all raw data.
+
+    New observations need to be later than the last observation of their
+    canton/variable, rows that just repeat already known values are ignored.
+    Corrections of older values and new cantons require a full recompute.
+    Input:
+        df_daily: previous output of transform_daily_per_canton
+        df_new: data frame with the new raw rows
+        last_observed: output of last_observed_per_canton for
+                       the raw data that df_daily was computed from
+        value_cols, col_date, col_canton, interpolation:
+            as for transform_daily_per_canton
+    Returns:
+        (updated daily data, updated last_observed)
+    """
+    value_cols = sorted(value_cols)
+    one_day = pd.Timedelta(days=1)
+    old_dates = pd.DatetimeIndex(df_daily[col_date])
+    old_start = old_dates[0]
+    # Daily data is ordered by date, with all cantons for every date
+    ncantons = int(np.searchsorted(old_dates, old_start, side='right'))
+    old_ndays = len(old_dates) // ncantons
+    cantons = df_daily[col_canton].iloc[:ncantons]
+
+    ncodes = pd.Index(cantons).get_indexer(df_new[col_canton])
+    if (ncodes < 0).any():
+        raise ValueError('New cantons found, a full recompute is required: '
+                         f'{set(df_new.loc[ncodes < 0, col_canton])}')
+    new_days, is_daily = _day_offsets(df_new[col_date], old_start)
+    new_days, ncodes = new_days[is_daily], ncodes[is_daily]
+    if (new_days < 0).any():
+        raise ValueError('New rows start before the daily data, '
+                         'a full recompute is required')
+    if len(np.unique(new_days * ncantons + ncodes)) != len(new_days):
+        raise ValueError('Index contains duplicate entries, cannot reshape')
+    new_values = df_new.loc[is_daily, value_cols].to_numpy(dtype=float, na_value=np.nan)
+
+    last_obs = last_observed.reindex(index=pd.Index(cantons), columns=value_cols)
+    last_days = np.full(last_obs.shape, -1)
+    is_observed = last_obs.notna().to_numpy()
+    last_days[is_observed] = ((last_obs.to_numpy(dtype='datetime64[ns]')[is_observed]
+                               - old_start.to_datetime64()) // one_day.to_timedelta64())
+
+    # (row, canton, variable) of every new observation
+    obs_t, obs_v = np.nonzero(np.isfinite(new_values))
+    obs_r = ncodes[obs_t]
+    # Rows that repeat known values are ignored,
+    # anything else at or before the last observation is a correction.
+    is_old = new_days[obs_t] <= last_days[obs_r, obs_v]
+    if is_old.any():
+        known = df_daily[value_cols].to_numpy(dtype=float)[
+            new_days[obs_t[is_old]] * ncantons + obs_r[is_old], obs_v[is_old]]
+        if (new_values[obs_t[is_old], obs_v[is_old]] != known).any():
+            raise ValueError('New rows correct values at or before the last '
+                             'observation, a full recompute is required')
+        obs_t, obs_v, obs_r = obs_t[~is_old], obs_v[~is_old], obs_r[~is_old]
+    obs_days = new_days[obs_t]
+    ndays = max(old_ndays, int(new_days.max(initial=-1)) + 1)
+    if len(obs_t) == 0 and ndays == old_ndays:
+        return df_daily, last_observed
+
+    # Series with new observations are recomputed starting at their last
+    # observation, never observed series starting at their first new one.
+    has_new = np.zeros(last_days.shape, dtype=bool)
+    has_new[obs_r, obs_v] = True
+    first_new = np.full(last_days.shape, old_ndays - 1)
+    np.minimum.at(first_new, (obs_r, obs_v), obs_days)
+    window_start = int(np.where(last_days >= 0, last_days, first_new)[has_new]
+                       .min(initial=old_ndays - 1))
+    nwindow = ndays - window_start
+
+    cube = np.full((nwindow, ncantons, len(value_cols)), np.nan)
+    cube[:old_ndays - window_start] = (df_daily[value_cols]
+                                       .iloc[window_start * ncantons:]
+                                       .to_numpy(dtype=float)
+                                       .reshape(old_ndays - window_start, ncantons, -1))
+    days = np.arange(window_start, ndays).reshape(-1, 1, 1)
+    cube[(days > last_days) & has_new] = np.nan
+    cube[obs_days - window_start, obs_r, obs_v] = new_values[obs_t, obs_v]
+
+    dtype = np.result_type(*df_daily[value_cols].dtypes)
+    if dtype.kind in 'iub' and np.isnan(cube).any():
+        dtype = np.dtype(float)
+    cube = fill_daily_array(cube, interpolation=interpolation)
+    tail = pd.DataFrame(cube.reshape(nwindow * ncantons, -1).astype(dtype, copy=False),
+                        columns=pd.Index(value_cols))
+    tail.insert(0, col_canton, cantons.take(np.tile(np.arange(ncantons), nwindow))
+                .reset_index(drop=True))
+    tail.insert(0, col_date, pd.date_range(old_start + window_start * one_day,
+                                           periods=nwindow, freq='D').repeat(ncantons))
+    out = pd.concat([df_daily.iloc[:window_start * ncantons], tail[df_daily.columns]],
+                    ignore_index=True)
+
+    last_days_new = last_days.copy()
+    np.maximum.at(last_days_new, (obs_r, obs_v), obs_days)
+    last_obs_new = pd.DataFrame(old_start + last_days_new.astype('timedelta64[D]'),
+                                index=last_obs.index, columns=last_obs.columns)
+    return out, last_obs.where(~has_new, last_obs_new)
+
+
 def order_cat(col, ct, rev=False):
     """
     Small helper to convert column to categorical
@@ -63,6 +505,117 @@ def order_cat(col, ct, rev=False):
     """
     col = col.astype(ct)
     if rev:
-        col.cat.set_categories(new_categories=ct.categories[::-1],
-                               ordered=True, inplace=True)
-    return col
\ No newline at end of file
+        col = col.cat.set_categories(new_categories=ct.categories[::-1], ordered=True)
+    return col
+
+
+def _ordered_dtype(ct, rev=False):
+    """
+    The categorical dtype order_cat converts to.
+    """
+    if rev:
+        return pd.CategoricalDtype(ct.categories[::-1], ordered=True)
+    return ct
+
+
+class LongView:
+    """
+    Long format version of a wide data frame that is melted only once.
+
+    Views for subsets of variables and category orderings are cached.
+    Views of variables stored next to each other share the value and id
+    arrays of the melted frame, other subsets are copied. Categorical
+    columns are rebuilt from the shared codes by a lookup.
+    """
+
+    def __init__(self, df, id_vars, value_vars, var_name='variables',
+                 value_name='value', labels=None, first=()):
+        """
+        Input:
+            df: a wide data frame
+            id_vars, value_vars, var_name, value_name: as for pd.DataFrame.melt
+            labels: optional dict to rename variables in the views
+            first: variables stored first, so views of them (and of all
+                   variables) share memory with the melted frame
+        """
+        self.value_vars = list(value_vars)
+        self.var_name = var_name
+        self.value_name = value_name
+        self.labels = labels or {}
+        self.nrows = len(df)
+        # Order of the blocks in the melted frame
+        first = list(first)
+        self.stored_vars = first + [v for v in self.value_vars if v not in first]
+        self.long = df.melt(id_vars=id_vars, value_vars=self.stored_vars,
+                            var_name=var_name, value_name=value_name)
+        # melt stacks one block of rows per variable
+        self.long[var_name] = pd.Categorical.from_codes(
+            np.repeat(np.arange(len(self.stored_vars)), self.nrows),
+            categories=self.stored_vars)
+        for c in id_vars:
+            # Strings are object columns on older pandas, str columns on newer ones
+            dtype = self.long[c].dtype
+            if not isinstance(dtype, pd.CategoricalDtype) and (
+                    pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+                self.long[c] = pd.Categorical(self.long[c])
+        self._views = {}
+
+    def __getstate__(self):
+        # The views are cheap to recreate, do not pickle them
+        return {**self.__dict__, '_views': {}}
+
+    def _rows(self, value_vars):
+        """
+        Rows of the long frame for the variables, a slice (in the stored
+        order of the variables) if they are stored contiguously.
+        """
+        idx = [self.stored_vars.index(v) for v in value_vars]
+        if sorted(idx) == list(range(min(idx), min(idx) + len(idx))):
+            return slice(min(idx) * self.nrows, (max(idx) + 1) * self.nrows)
+        return np.concatenate([np.arange(i * self.nrows, (i + 1) * self.nrows)
+                               for i in idx])
+
+    def view(self, value_vars=None, col_cat=None, ct=None, rev=False, categories=None):
+        """
+        Returns the long frame for a subset of variables, the same as
+        melting the wide frame and converting the variable column to a
+        categorical ordered as value_vars. The blocks of rows of the
+        variables may be in the stored order instead of value_vars.
+        Input:
+            value_vars: variables to include, in the order of the categories
+            col_cat: optional column to reorder with ct, see order_cat
+            ct: categorical dtype for col_cat
+            rev: revert the order of ct
+            categories: variables used as categories of the variable column,
+                        including value_vars (default: value_vars). E.g. all
+                        variables, so plots of subsets keep their colors.
+        Returns:
+            The long data frame. It shares memory with the cache,
+            so copy it before modifying it in place.
+        """
+        value_vars = list(self.value_vars if value_vars is None else value_vars)
+        categories = value_vars if categories is None else list(categories)
+        key = (tuple(value_vars), col_cat,
+               None if ct is None else (tuple(ct.categories), ct.ordered), rev, tuple(categories))
+        if key not in self._views:
+            rows = self._rows(value_vars)
+            if isinstance(rows, slice):
+                sub = self.long.iloc[rows]
+            else:
+                sub = self.long.take(rows)
+            cols = {c: sub[c].array for c in sub.columns}
+
+            codes_var = np.full(len(self.stored_vars), -1, dtype=np.int16)
+            codes_var[[self.stored_vars.index(v) for v in value_vars]] = [
+                categories.index(v) for v in value_vars]
+            cols[self.var_name] = pd.Categorical.from_codes(
+                codes_var[cols[self.var_name].codes],
+                categories=[self.labels.get(v, v) for v in categories])
+            if col_cat is not None:
+                dtype = _ordered_dtype(ct, rev=rev)
+                cat = cols[col_cat]
+                codes_cat = dtype.categories.get_indexer(cat.categories)
+                cols[col_cat] = pd.Categorical.from_codes(
+                    np.append(codes_cat, -1)[cat.codes], dtype=dtype)
+            self._views[key] = pd.DataFrame(cols, index=sub.index, copy=False)
+        return self._views[key]
@@ -0,0 +1,216 @@
+"""
+Loading of the worldwide Google mobility reports, as scraped by
+https://github.com/philshem/scrape_covid19_mobility_reports.
+
+The reports are one long table (country, region, category, date, value).
+It is stored sorted by (country, region, category, date) as parquet, next to
+a small table with the row range of every series. Slices by country/region
+and date range only look up these ranges and take the rows they cover,
+instead of filtering the whole worldwide table.
+"""
+import glob
+
+import numpy as np
+import pandas as pd
+
+import helpers.cache as cache
+import helpers.ingest as ingest
+import helpers.trace as trace
+
+FOL_MOBILITY = 'data/monitoring/scrape_covid19_mobility_reports'
+GLOB_REPORTS = f'{FOL_MOBILITY}/data/processed/*.csv'
+FOL_CACHE = '.cache/mobility'
+# Bump if the preprocessing changes, the cached tables are then rebuilt
+STORE_VERSION = 1
+
+COL_COUNTRY = 'country'
+COL_REGION = 'region'
+COL_CATEGORY = 'category'
+COL_DATE = 'date'
+COL_VALUE = 'value'
+COLS_SERIES = [COL_COUNTRY, COL_REGION, COL_CATEGORY]
+COLS_INDEX = COLS_SERIES + [COL_DATE]
+# Row range of the series in the sorted table
+COL_START = 'start'
+COL_STOP = 'stop'
+
+SCHEMA = {COL_COUNTRY: ingest.TYPE_CATEGORY,
+          COL_REGION: ingest.TYPE_CATEGORY,
+          COL_CATEGORY: ingest.TYPE_CATEGORY,
+          COL_DATE: ingest.TYPE_DATE,
+          COL_VALUE: 'float64'}
+
+# Region of the country wide values
+REGION_TOTAL = 'Total'
+
+# Region names of the Swiss reports -> canton abbreviations as in the case data
+CANTONS = {'Aargau': 'AG', 'Appenzell Ausserrhoden': 'AR', 'Appenzell Innerrhoden': 'AI',
+           'Basel-Landschaft': 'BL', 'Basel-Stadt': 'BS', 'Bern': 'BE', 'Fribourg': 'FR',
+           'Geneva': 'GE', 'Glarus': 'GL', 'Graubünden': 'GR', 'Grisons': 'GR', 'Jura': 'JU',
+           'Lucerne': 'LU', 'Neuchâtel': 'NE', 'Nidwalden': 'NW', 'Obwalden': 'OW',
+           'Schaffhausen': 'SH', 'Schwyz': 'SZ', 'Solothurn': 'SO', 'St. Gallen': 'SG',
+           'Thurgau': 'TG', 'Ticino': 'TI', 'Uri': 'UR', 'Valais': 'VS', 'Vaud': 'VD',
+           'Zug': 'ZG', 'Zurich': 'ZH'}
+COUNTRY_CH = 'Switzerland'
+# Liechtenstein is part of the Swiss case data
+COUNTRY_FL = 'Liechtenstein'
+
+
+def prepare_reports(df):
+    """
+    Sorts the raw reports by (country, region, category, date) and indexes the series.
+    Country wide values get the region REGION_TOTAL, values reported
+    several times keep the last report.
+    Returns:
+        dict with the sorted rows ('rows') and the row range of every series ('series')
+    """
+    df = df.copy(deep=False)
+    if REGION_TOTAL not in df[COL_REGION].cat.categories:
+        df[COL_REGION] = df[COL_REGION].cat.add_categories([REGION_TOTAL])
+    df[COL_REGION] = df[COL_REGION].fillna(REGION_TOTAL)
+    for c in COLS_SERIES:
+        df[c] = df[c].cat.remove_unused_categories()
+    df = (df.dropna(subset=[COL_COUNTRY, COL_CATEGORY, COL_DATE])
+          .drop_duplicates(COLS_INDEX, keep='last')
+          .sort_values(COLS_INDEX, kind='stable')
+          .reset_index(drop=True))
+    # The rows of a series are contiguous: it starts where any key changes
+    codes = np.stack([df[c].cat.codes.to_numpy() for c in COLS_SERIES], axis=1)
+    is_start = np.ones(len(df), dtype=bool)
+    is_start[1:] = (codes[1:] != codes[:-1]).any(axis=1)
+    starts = np.flatnonzero(is_start)
+    series = df.loc[starts, COLS_SERIES].reset_index(drop=True)
+    series[COL_START] = starts
+    series[COL_STOP] = np.append(starts[1:], len(df))
+    return {'rows': df, 'series': series}
+
+
+def read_reports(glob_reports=GLOB_REPORTS):
+    """
+    Reads the scraped report tables.
+    """
+    paths = glob.glob(glob_reports)
+    with trace.stage('read mobility') as st:
+        df = ingest.read_csvs(paths, SCHEMA, usecols=list(SCHEMA))
+        st.set_rows_out(df)
+    return df
+
+
+class MobilityStore:
+    """
+    Mobility reports sorted by (country, region, category, date)
+    with the row range of every series, see the module documentation.
+    """
+
+    def __init__(self, rows, series):
+        """
+        Input:
+            rows, series: the tables from prepare_reports
+        """
+        self.rows = rows
+        self.series = series
+        self._dates = rows[COL_DATE].to_numpy()
+
+    @classmethod
+    def from_reports(cls, df):
+        """
+        Creates the store from the raw reports, see read_reports.
+        """
+        return cls(**prepare_reports(df))
+
+    @classmethod
+    def load(cls, glob_reports=GLOB_REPORTS, fol_cache=FOL_CACHE, verbose=True):
+        """
+        Loads the store from the parquet cache, or reads
+        and prepares the reports if their files changed.
+        """
+        frames = cache.cached_frames(lambda: prepare_reports(read_reports(glob_reports)),
+                                     glob.glob(glob_reports),
+                                     params={'version': STORE_VERSION, 'schema': SCHEMA},
+                                     code=(prepare_reports, read_reports, ingest),
+                                     fol_cache=fol_cache, verbose=verbose)
+        return cls(frames['rows'], frames['series'])
+
+    @property
+    def countries(self):
+        return self.series[COL_COUNTRY].unique().tolist()
+
+    @property
+    def categories(self):
+        return self.series[COL_CATEGORY].unique().tolist()
+
+    def regions(self, country):
+        """
+        The regions of a country, including REGION_TOTAL if reported.
+        """
+        return self.series.loc[self.series[COL_COUNTRY] == country, COL_REGION].unique().tolist()
+
+    def _select_series(self, countries, regions, categories):
+        is_sel = np.ones(len(self.series), dtype=bool)
+        for c, labels in zip(COLS_SERIES, (countries, regions, categories)):
+            if labels is not None:
+                labels = [labels] if isinstance(labels, str) else labels
+                is_sel &= self.series[c].isin(labels).to_numpy()
+        return self.series.loc[is_sel, :]
+
+    def positions(self, countries=None, regions=None, categories=None, start=None, end=None):
+        """
+        Rows of the selected series and dates.
+        Only the (few) series are filtered, the dates are found
+        by binary search within the row range of every series.
+        Input:
+            countries, regions, categories: labels to select (default: all)
+            start, end: first and last date to select, inclusive (default: all)
+        Returns:
+            Array with the row positions, ordered as the store
+        """
+        series = self._select_series(countries, regions, categories)
+        # Copies, the columns' arrays may be read-only (copy-on-write)
+        starts = np.array(series[COL_START])
+        stops = np.array(series[COL_STOP])
+        if start is not None or end is not None:
+            lo = np.datetime64(pd.Timestamp(start)) if start is not None else None
+            hi = np.datetime64(pd.Timestamp(end)) if end is not None else None
+            for i, (i0, i1) in enumerate(zip(starts.tolist(), stops.tolist())):
+                dates = self._dates[i0:i1]
+                if lo is not None:
+                    starts[i] = i0 + np.searchsorted(dates, lo, side='left')
+                if hi is not None:
+                    stops[i] = i0 + np.searchsorted(dates, hi, side='right')
+        lengths = np.maximum(stops - starts, 0)
+        # Concatenated ranges: offsets of the range starts, plus a running count within each range
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def sel(self, countries=None, regions=None, categories=None, start=None, end=None):
+        """
+        Slice of the reports, see positions for the arguments.
+        Returns:
+            Data frame with the selected rows, sorted by (country, region, category, date)
+        """
+        pos = self.positions(countries, regions, categories, start, end)
+        return self.rows.take(pos).reset_index(drop=True)
+
+    def swiss_cantons(self, categories=None, start=None, end=None,
+                      col_date='date', col_canton='abbreviation_canton_and_fl'):
+        """
+        Mobility of the Swiss cantons and Liechtenstein in the format of
+        lib.transform_daily_per_canton, to join with the daily case data.
+        Input:
+            categories, start, end: see positions
+            col_date, col_canton: the date and canton columns of the case data
+        Returns:
+            Data frame with one row per date and canton, one column per category
+        """
+        df = pd.concat([self.sel(COUNTRY_CH, list(CANTONS), categories, start, end),
+                        self.sel(COUNTRY_FL, REGION_TOTAL, categories, start, end)],
+                       ignore_index=True)
+        canton = df[COL_REGION].astype(str).map(CANTONS).where(df[COL_COUNTRY] == COUNTRY_CH, 'FL')
+        df = (df.assign(**{col_canton: canton})
+              .pivot_table(index=[COL_DATE, col_canton], columns=COL_CATEGORY, values=COL_VALUE,
+                           observed=True)
+              .reset_index()
+              .rename(columns={COL_DATE: col_date}))
+        df.columns.name = None
+        df[col_canton] = df[col_canton].astype('category')
+        return df
@@ -0,0 +1,440 @@
+"""
+Processing stages for the statistikZH covid19monitoring data
+(https://github.com/statistikZH/covid19monitoring).
+"""
+import numpy as np
+import pandas as pd
+
+import helpers.library as lib
+
+
+def group_codes(df, group_cols):
+    """
+    Integer code of the group of every row, -1 for rows with missing keys.
+    Input:
+        df: a data frame
+        group_cols: columns defining the groups
+    Returns:
+        (codes, number of groups)
+    """
+    grouped = df.groupby(group_cols, observed=True, sort=False)
+    return grouped.ngroup().fillna(-1).to_numpy(np.int64), grouped.ngroups
+
+
+def count_finite_per_group(df, col_value, group_cols):
+    """
+    Counts the finite values of every group in one grouped pass.
+    E.g. grouped by (year, week, variable, location) this gives the number
+    of days with measurements in a week.
+    Input:
+        df: a data frame
+        col_value: column with the values
+        group_cols: columns defining the groups
+    Returns:
+        Array with the count of the row's group for every row
+        (0 for rows with missing group keys)
+    """
+    codes, ngroups = group_codes(df, group_cols)
+    is_grouped = codes >= 0
+    counts = np.bincount(codes[is_grouped],
+                         weights=np.isfinite(df[col_value].to_numpy(dtype=float))[is_grouped],
+                         minlength=ngroups).astype(np.int64)
+    return np.where(is_grouped, counts[codes], 0)
+
+
+# Statistics that can be used as reference by normalize_per_group
+NORM_METHODS = ('mean', 'median')
+
+
+def normalize_per_group(df, col_value, group_cols, method='mean', col_mask=None, log=False):
+    """
+    Normalizes values by a reference statistic of their group, using
+    grouped transforms (no Python call per group).
+    E.g. grouped by (year, week, variable) this normalizes by the week average.
+    Input:
+        df: a data frame
+        col_value: column with the values
+        group_cols: columns defining the groups
+        method: reference statistic, 'mean' or 'median'
+        col_mask: optional boolean column. Only rows where it is True
+                  are used to compute the reference (e.g. only weekdays),
+                  all rows get normalized.
+        log: if True the log10 values get normalized by subtracting the
+             reference of the log10 values, else values are divided by
+             the reference.
+    Returns:
+        Series with the normalized values
+    """
+    if method not in NORM_METHODS:
+        raise ValueError(f'Unknown method: {method}')
+    values = df[col_value]
+    if log:
+        values = np.log10(values)
+    ref = values if col_mask is None else values.where(df[col_mask].astype(bool))
+    ref = (ref
+           .groupby([df[c] for c in group_cols], observed=True, sort=False)
+           .transform(method))
+    if log:
+        return values - ref
+    return values / ref
+
+
+def key_codes(df, key_cols, key_categories):
+    """
+    Combines the key columns into one integer code per row.
+    Categorical columns are mapped through their (few) categories, so
+    this costs about an array take per key column.
+    Input:
+        df: a data frame
+        key_cols: the key columns
+        key_categories: list with an Index of the possible values per key column
+    Returns:
+        Array with the code of every row, -1 if any key is missing or unknown
+    """
+    codes = np.zeros(len(df), dtype=np.int64)
+    is_valid = np.ones(len(df), dtype=bool)
+    for c, cats in zip(key_cols, key_categories):
+        col = df[c]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # -1 codes (missing values) take the appended -1
+            codes_c = np.append(cats.get_indexer(col.cat.categories), -1)[col.cat.codes]
+        else:
+            codes_c = cats.get_indexer(col)
+        is_valid &= codes_c >= 0
+        codes = codes * len(cats) + codes_c
+    return np.where(is_valid, codes, -1)
+
+
+class MetaIndex:
+    """
+    Metadata table indexed by key columns, e.g. (variable, location).
+
+    Metadata columns are attached to observations through a code lookup
+    instead of a merge: finding the metadata row costs about an array take
+    per key column and the observations are not copied.
+    The index can be reused for all consumers of the metadata.
+    """
+
+    def __init__(self, df_meta, key_cols):
+        """
+        Input:
+            df_meta: data frame with one row per key
+            key_cols: columns identifying a metadata row
+        """
+        self.meta = df_meta.reset_index(drop=True)
+        self.key_cols = list(key_cols)
+        self.key_categories = [pd.Index(self.meta[c].unique()).dropna() for c in self.key_cols]
+        meta_codes = key_codes(self.meta, self.key_cols, self.key_categories)
+        if (meta_codes < 0).any() or len(np.unique(meta_codes)) != len(meta_codes):
+            raise ValueError(f'Keys {self.key_cols} are not unique in the metadata')
+        # Unknown keys (-1) look up the last entry, which stays -1
+        self.table = np.full(np.prod([len(c) for c in self.key_categories]) + 1, -1)
+        self.table[meta_codes] = np.arange(len(self.meta))
+        self._labels = {}
+
+    def rows(self, df):
+        """
+        Metadata row of every observation, -1 if its key is not in the metadata.
+        """
+        return self.table[key_codes(df, self.key_cols, self.key_categories)]
+
+    def attach(self, df, cols, how='inner'):
+        """
+        Adds metadata columns to the observations,
+        the same as df.merge(df_meta[key_cols + cols], how=how).
+        Input:
+            df: data frame with the observations
+            cols: metadata columns to add
+            how: 'inner' drops observations without metadata,
+                 'left' keeps them with missing values
+        Returns:
+            Data frame sharing the existing columns with df
+        """
+        if how not in ('inner', 'left'):
+            raise ValueError(f'Unsupported join: {how}')
+        rows = self.rows(df)
+        if how == 'inner' and (rows < 0).any():
+            df, rows = df.loc[rows >= 0, :], rows[rows >= 0]
+        df = df.copy(deep=False)
+        for c in cols:
+            df[c] = self.meta[c].array.take(rows, allow_fill=True)
+        return df
+
+    def labels(self, df, fkt_label):
+        """
+        Creates a label for every observation from its metadata.
+        The labels are formatted once per metadata row and attached
+        as a categorical through the code lookup, so the cost scales with
+        the number of metadata rows instead of the number of observations.
+        Input:
+            df: data frame with the observations
+            fkt_label: function formatting a metadata row (as for df.apply(axis=1))
+        Returns:
+            Categorical with the label for every row of df (missing if the
+            key is not in the metadata). Only labels that occur are categories,
+            sorted alphabetically.
+        """
+        if fkt_label not in self._labels:
+            self._labels[fkt_label] = np.unique(
+                self.meta.apply(fkt_label, axis=1).to_numpy(dtype=str), return_inverse=True)
+        labels, label_codes = self._labels[fkt_label]
+        rows = self.rows(df)
+        return (pd.Categorical.from_codes(np.where(rows >= 0, label_codes[rows], -1),
+                                          categories=labels)
+                .remove_unused_categories())
+
+
+def lookup_labels(df, df_meta, key_cols, fkt_label):
+    """
+    Creates a label for every row of df from its metadata, see MetaIndex.labels.
+    Input:
+        df: data frame with the observations
+        df_meta: data frame with one row per key
+        key_cols: columns identifying a metadata row, e.g. (variable, location)
+        fkt_label: function formatting a metadata row (as for df.apply(axis=1))
+    Returns:
+        Categorical with the label for every row of df
+    """
+    return MetaIndex(df_meta, key_cols).labels(df, fkt_label)
+
+
+def rolling_per_series(df, col_value, col_date, series_cols, window, **kwargs):
+    """
+    Daily rolling means for every series (e.g. variable and location) at once.
+    The observations are scattered into one dense (day x series) array, so
+    missing days count as missing values and windows are in days, not rows.
+    Input:
+        df: a data frame with one row per (date, series)
+        col_value: column with the values
+        col_date: column with the dates
+        series_cols: columns defining the series
+        window, kwargs: see lib.rolling_array, e.g. stride=7 for windows
+                        over the same weekday of the last weeks
+    Returns:
+        (rolling mean, number of non missing values in the window),
+        aligned to the rows of df
+    """
+    codes, nseries = group_codes(df, series_cols)
+    dates = pd.DatetimeIndex(df[col_date])
+    days = np.asarray((dates - dates.min().normalize()) // pd.Timedelta(days=1))
+    is_valid = (codes >= 0) & (days >= 0)
+    cube = np.full((days[is_valid].max(initial=-1) + 1, nseries), np.nan)
+    flat = days[is_valid] * nseries + codes[is_valid]
+    if len(np.unique(flat)) != len(flat):
+        raise ValueError('Series contain more than one value per day')
+    cube.reshape(-1)[flat] = df[col_value].to_numpy(dtype=float)[is_valid]
+    mean, counts = lib.rolling_array(cube, window, **kwargs)
+    out_mean = np.full(len(df), np.nan)
+    out_counts = np.zeros(len(df), dtype=np.int64)
+    out_mean[is_valid] = mean.reshape(-1)[flat]
+    out_counts[is_valid] = counts.reshape(-1)[flat]
+    return (pd.Series(out_mean, index=df.index, name=col_value),
+            pd.Series(out_counts, index=df.index, name='count'))
+
+
+class AggCube:
+    """
+    Sufficient statistics (count, sum, sum of squares, min, max) of the
+    values per cell of some key columns, e.g.
+    (year, week, dayofweek, variable, location, topic).
+
+    Roll-ups to any subset of the keys (mean, std, coefficient of variation)
+    are derived from the cells without going back to the observations,
+    and new observations are added to the cells incrementally.
+    """
+    # How the statistics of cells are combined
+    STATS = {'count': 'sum', 'sum': 'sum', 'sumsq': 'sum', 'min': 'min', 'max': 'max'}
+
+    def __init__(self, df, col_value, key_cols, col_date=None):
+        """
+        Input:
+            df: data frame with the observations
+            col_value: column with the values, missing values are not counted
+            key_cols: columns defining the cells
+            col_date: optional date column. If given, the last date of every cell
+                      is kept (column 'date_last') and add only counts
+                      observations after it, so days delivered twice are not
+                      counted twice.
+        """
+        self.col_value = col_value
+        self.key_cols = list(key_cols)
+        self.col_date = col_date
+        self._combine = dict(self.STATS)
+        if col_date is not None:
+            self._combine['date_last'] = 'max'
+        self.cells = self._aggregate(df)
+
+    def _aggregate(self, df):
+        """
+        Statistics of the observations per cell, in one grouped pass.
+        """
+        values = df[self.col_value].astype(float)
+        cols = {'count': values.notna().astype(np.int64),
+                'sum': values,
+                'sumsq': values ** 2,
+                'min': values,
+                'max': values}
+        if self.col_date is not None:
+            cols['date_last'] = df[self.col_date]
+        return (pd.DataFrame(cols, index=df.index)
+                .groupby([df[c] for c in self.key_cols], observed=True)
+                .agg(self._combine))
+
+    def add(self, df):
+        """
+        Adds new observations to the cells.
+        Input:
+            df: data frame with the same columns as the initial observations
+        Returns:
+            self
+        """
+        if self.col_date is not None:
+            rows = self.cells.index.get_indexer(pd.MultiIndex.from_frame(df[self.key_cols]))
+            date_last = self.cells['date_last'].to_numpy()
+            is_new = (rows < 0) | (df[self.col_date].to_numpy() > date_last[rows])
+            df = df.loc[is_new, :]
+        self.cells = (pd.concat([self.cells, self._aggregate(df)])
+                      .groupby(level=self.key_cols, observed=True)
+                      .agg(self._combine))
+        return self
+
+    def rollup(self, by, mask=None):
+        """
+        Statistics of the values grouped by a subset of the keys.
+        Input:
+            by: key columns to keep
+            mask: optional boolean array selecting the cells to use,
+                  e.g. only complete weeks
+        Returns:
+            Data frame indexed by the `by` columns with count, mean,
+            std (as pd.Series.std), min, max and cv (std / abs(mean))
+        """
+        cells = self.cells if mask is None else self.cells.loc[np.asarray(mask), :]
+        stats = (cells[list(self.STATS)]
+                 .groupby(level=list(by), observed=True)
+                 .agg(self.STATS))
+        count = stats['count']
+        mean = stats['sum'] / count
+        var = (stats['sumsq'] - stats['sum'] * mean) / (count - 1)
+        # Rounding errors can make the variance of constant values negative
+        std = np.sqrt(var.clip(lower=0)).where(count > 1)
+        return pd.DataFrame({'count': count,
+                             'mean': mean,
+                             'std': std,
+                             'min': stats['min'],
+                             'max': stats['max'],
+                             'cv': std / np.abs(mean)})
+
+
+# Calendar features that can be derived from day numbers, see calendar_codes
+CALENDAR_FIELDS = ('year', 'month', 'week', 'isoyear', 'dayofweek')
+
+
+def day_numbers(dates):
+    """
+    Days since 1970-01-01 as int32, the compact representation of dates.
+    Input:
+        dates: datetime like values without missing values
+    Returns:
+        int32 array
+    """
+    dates = pd.DatetimeIndex(dates)
+    if dates.hasnans:
+        raise ValueError('Dates contain missing values')
+    return dates.values.astype('datetime64[D]').astype(np.int64).astype(np.int32)
+
+
+def calendar_codes(days, field):
+    """
+    Derives a calendar feature from day numbers using integer arithmetic only.
+    Input:
+        days: day numbers, see day_numbers
+        field: one of CALENDAR_FIELDS:
+            'year': calendar year (int16)
+            'month': month, 1-12 (uint8)
+            'week': ISO week, 1-53 (uint8). Weeks start on Monday, the days
+                    around new year can belong to a week of the previous
+                    or next year, see 'isoyear'.
+            'isoyear': year of the ISO week (int16)
+            'dayofweek': day of the week, Monday=0 to Sunday=6 (uint8)
+    Returns:
+        Array with the smallest sufficient integer type
+    """
+    days = np.asarray(days, dtype=np.int64)
+    # 1970-01-01 was a Thursday
+    dayofweek = (days + 3) % 7
+    if field == 'dayofweek':
+        return dayofweek.astype(np.uint8)
+    if field == 'year':
+        return (days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int16)
+    if field == 'month':
+        return (days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12 + 1).astype(np.uint8)
+    if field in ('week', 'isoyear'):
+        # The ISO week belongs to the year of its Thursday
+        thursday = days - dayofweek + 3
+        isoyear = thursday.astype('datetime64[D]').astype('datetime64[Y]')
+        if field == 'isoyear':
+            return (isoyear.astype(np.int64) + 1970).astype(np.int16)
+        return ((thursday - isoyear.astype('datetime64[D]').astype(np.int64)) // 7 + 1).astype(np.uint8)
+    raise ValueError(f'Unknown calendar field: {field}')
+
+
+def add_calendar(df, col_day, fields):
+    """
+    Adds calendar columns derived from the day numbers on demand.
+    Input:
+        df: a data frame
+        col_day: column with the day numbers, see day_numbers
+        fields: dict column name -> calendar field, see calendar_codes
+    Returns:
+        Data frame sharing the existing columns with df
+    """
+    df = df.copy(deep=False)
+    for c, field in fields.items():
+        df[c] = calendar_codes(df[col_day], field)
+    return df
+
+
+def compact(df, value_cols=(), value_dtype='float32', drop_cols=()):
+    """
+    Compact copy of the observations, e.g. to keep long histories in
+    the memory of workers. Calendar features should be dropped and
+    derived on demand from an int32 day number (see day_numbers, add_calendar).
+    Input:
+        df: a data frame
+        value_cols: value columns to store as value_dtype
+        value_dtype: dtype of the values. float32 keeps about 7 significant
+                     digits, check that this is enough for the data.
+        drop_cols: columns to drop
+    Returns:
+        The compact data frame: values as value_dtype, other 64 bit integer
+        columns (e.g. counts) downcast to the smallest integer type,
+        text columns as categoricals
+    """
+    df = df.drop(columns=list(drop_cols))
+    for c in df.columns:
+        col = df[c]
+        if c in value_cols:
+            df[c] = col.astype(value_dtype)
+        elif pd.api.types.is_bool_dtype(col.dtype):
+            continue
+        elif pd.api.types.is_integer_dtype(col.dtype) and col.dtype.itemsize == 8:
+            df[c] = pd.to_numeric(col, downcast='unsigned' if (col >= 0).all() else 'integer')
+        elif pd.api.types.is_object_dtype(col.dtype):
+            df[c] = col.astype('category')
+    return df
+
+
+def memory_report(frames):
+    """
+    Memory used per column, including the content of text columns.
+    Input:
+        frames: dict name -> data frame
+    Returns:
+        Data frame with the bytes per column (rows) and frame (columns),
+        with the total in the last row
+    """
+    report = pd.DataFrame({name: df.memory_usage(index=True, deep=True)
+                           for name, df in frames.items()})
+    report.loc['total', :] = report.sum()
+    return report
@@ -0,0 +1,184 @@
+"""
+Streaming reader of PC-Axis (.px) files, as published e.g. by the BFS.
+
+A .px file has a header of keywords (KEY="value"; or KEY("variable")="a","b";)
+describing the dimensions of a cube, followed by DATA= with all values of the
+cube as text, the last dimension varying fastest. The header is parsed
+completely, the data is read in chunks and aggregated on the fly, so the
+whole cube is never held in memory.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# Markers of missing values in the data section
+_RE_MISSING = re.compile(r'"[^"]*"')
+_RE_KEYWORD = re.compile(r'^\s*([A-Z0-9-]+)(\[[^\]]*\])?(\("([^"]*)"\))?\s*=(.*)$', re.S)
+_RE_ITEM = re.compile(r'"([^"]*)"|(,)')
+
+
+def _split_statements(text):
+    """
+    Splits header text into statements ending with ';' outside of quotes.
+    """
+    statements, start, in_quote = [], 0, False
+    for i, ch in enumerate(text):
+        if ch == '"':
+            in_quote = not in_quote
+        elif ch == ';' and not in_quote:
+            statements.append(text[start:i])
+            start = i + 1
+    return statements
+
+
+def _parse_value(value):
+    """
+    Values of a keyword: a list of the quoted strings separated by commas,
+    strings only separated by whitespace are one (continued) string.
+    Unquoted values are returned as they are.
+    """
+    if '"' not in value:
+        return value.strip()
+    items, current = [], ''
+    for m in _RE_ITEM.finditer(value):
+        if m.group(2):
+            items.append(current)
+            current = ''
+        else:
+            current += m.group(1)
+    items.append(current)
+    return items
+
+
+def _read_header(f):
+    """
+    Reads the binary file up to and including DATA=.
+    Returns:
+        (header text as bytes, rest of the line after DATA=)
+    """
+    lines = []
+    for line in f:
+        pos = line.find(b'DATA=')
+        if pos >= 0 and line[:pos].strip() == b'':
+            return b''.join(lines), line[pos + len(b'DATA='):]
+        lines.append(line)
+    raise ValueError('No DATA keyword found')
+
+
+def read_meta(path):
+    """
+    Reads the header of a .px file.
+    Returns:
+        dict with:
+            'variables': list of the dimensions, in the order of the data
+            'values': dict dimension -> list of its values
+            'codes': dict dimension -> list of its codes (if given)
+            'keywords': dict of all other keywords (of the default language)
+            'encoding': the encoding of the file
+    """
+    with open(path, 'rb') as f:
+        header, _ = _read_header(f)
+    return _parse_header(header)
+
+
+def _parse_header(header):
+    m = re.search(rb'CODEPAGE\s*=\s*"([^"]+)"', header)
+    encoding = m.group(1).decode('ascii') if m else 'iso-8859-1'
+    meta = {'keywords': {}, 'values': {}, 'codes': {}, 'encoding': encoding}
+    for statement in _split_statements(header.decode(encoding)):
+        m = _RE_KEYWORD.match(statement)
+        # Keywords of other languages are skipped
+        if m is None or m.group(2):
+            continue
+        key, param, value = m.group(1), m.group(4), _parse_value(m.group(5))
+        if key == 'VALUES':
+            meta['values'][param] = value
+        elif key == 'CODES':
+            meta['codes'][param] = value
+        elif param is None:
+            meta['keywords'][key] = value
+    variables = []
+    for key in ('STUB', 'HEADING'):
+        value = meta['keywords'].get(key, [])
+        variables += [value] if isinstance(value, str) else value
+    meta['variables'] = variables
+    return meta
+
+
+def iter_data(path, chunk_size=2 ** 22):
+    """
+    Reads the values of a .px file in chunks.
+    Input:
+        path: the .px file
+        chunk_size: number of bytes read at once
+    Yields:
+        (position of the first value of the chunk in the cube, float array of the values)
+    """
+    with open(path, 'rb') as f:
+        header, rest = _read_header(f)
+        meta = _parse_header(header)
+        pos = 0
+        done = False
+        while not done:
+            chunk = f.read(chunk_size)
+            text = rest + chunk
+            end = text.find(b';')
+            if end >= 0:
+                text, done = text[:end], True
+            elif not chunk:
+                done = True
+            if not done:
+                # Keep the last, possibly incomplete, value for the next chunk
+                cut = max(text.rfind(b' '), text.rfind(b'\n'), text.rfind(b'\t'))
+                text, rest = text[:cut + 1], text[cut + 1:]
+            tokens = _RE_MISSING.sub(' nan ', text.decode(meta['encoding'])).split()
+            values = np.array(tokens, dtype=np.float64)
+            if len(values):
+                yield pos, values
+            pos += len(values)
+
+
+def aggregate(path, by, select=None, chunk_size=2 ** 22):
+    """
+    Sums the values of a .px file over all dimensions that are not in `by`,
+    reading the data in chunks.
+    Input:
+        path: the .px file
+        by: dimensions to keep
+        select: dict dimension -> values to include (default: all values),
+                e.g. to only sum the totals of a dimension
+        chunk_size: see iter_data
+    Returns:
+        Data frame with one categorical column per dimension in `by` and
+        the summed 'value' (missing if all summed values were missing)
+    """
+    meta = read_meta(path)
+    variables = meta['variables']
+    shape = tuple(len(meta['values'][v]) for v in variables)
+    unknown = [v for v in list(by) + list(select or {}) if v not in variables]
+    if unknown:
+        raise KeyError(f'Unknown dimensions: {unknown}, the file has {variables}')
+    is_sel = []
+    for v in variables:
+        values = pd.Index(meta['values'][v])
+        if select and v in select:
+            is_sel.append(values.isin(select[v]))
+        else:
+            is_sel.append(np.ones(len(values), dtype=bool))
+    by_dims = [variables.index(v) for v in by]
+    by_shape = tuple(shape[d] for d in by_dims)
+    sums = np.zeros(int(np.prod(by_shape)))
+    counts = np.zeros(len(sums), dtype=np.int64)
+    for pos, values in iter_data(path, chunk_size=chunk_size):
+        idx = np.unravel_index(np.arange(pos, pos + len(values)), shape)
+        is_used = np.isfinite(values)
+        for d in range(len(variables)):
+            is_used &= is_sel[d][idx[d]]
+        target = np.ravel_multi_index(tuple(idx[d][is_used] for d in by_dims), by_shape)
+        sums += np.bincount(target, weights=values[is_used], minlength=len(sums))
+        counts += np.bincount(target, minlength=len(sums))
+    df = pd.DataFrame({v: pd.Categorical.from_codes(codes, categories=meta['values'][v])
+                       for v, codes in zip(by, np.unravel_index(np.arange(len(sums)), by_shape))})
+    df['value'] = np.where(counts > 0, sums, np.nan)
+    return df
@@ -0,0 +1,302 @@
+"""
+Declarative pipelines of cached stages.
+
+A pipeline is a dependency graph of named nodes. Every node is a function of
+the outputs of its dependencies. Its key hashes the function (including its
+source code), the source code of the helpers it calls, its parameters, its
+source files and the keys of its dependencies, so it is known before anything
+is computed. Outputs are pickled
+to disk under their key: running the pipeline again only recomputes nodes
+whose key changed, and loads the others only if they are needed.
+Nodes that do not depend on each other run in parallel, the outputs they take
+are sent to every worker only once.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import inspect
+import os
+import pathlib
+import pickle
+import time
+import uuid
+
+import pandas as pd
+
+import helpers.cache as cache
+import helpers.trace as trace
+
+# Bump to invalidate all stored outputs
+PIPELINE_VERSION = 1
+DEFAULT_FOL_CACHE = '.cache/pipeline'
+
+Node = collections.namedtuple('Node', ['name', 'fkt', 'deps', 'params', 'sources', 'code', 'cache'])
+
+# Outputs of the dependencies of the worker process, set once by _init_worker
+_shared = {}
+
+
+def describe(obj):
+    """
+    Deterministic description of a parameter for the node keys.
+    Functions are described by their name and source code,
+    data frames by the hash of their content.
+    """
+    if isinstance(obj, pd.DataFrame):
+        import helpers.figcache as figcache
+        return f'DataFrame:{figcache.hash_frame(obj).hexdigest()}'
+    if isinstance(obj, dict):
+        return '{' + ', '.join(f'{describe(k)}: {describe(v)}'
+                               for k, v in sorted(obj.items(), key=lambda x: repr(x[0]))) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ', '.join(describe(v) for v in obj) + ']'
+    if callable(obj) and hasattr(obj, '__qualname__'):
+        try:
+            source = inspect.getsource(obj)
+        except (OSError, TypeError):
+            source = ''
+        return f'{obj.__module__}.{obj.__qualname__}:{source}'
+    return repr(obj)
+
+
+def _init_worker(shared):
+    """
+    Keeps the outputs of the dependencies of the nodes a worker process
+    computes, so they are only sent once per worker, not once per node.
+    """
+    global _shared
+    _shared = shared
+
+
+def _run_node(fkt, args, params):
+    """
+    Computes a node, in a worker or the main process.
+    Returns:
+        (output, seconds)
+    """
+    t0 = time.perf_counter()
+    out = fkt(*args, **params)
+    return out, time.perf_counter() - t0
+
+
+def _run_shared(fkt, dep_keys, params):
+    """
+    Computes a node in a worker process, taking the outputs of
+    its dependencies from the shared outputs, see _init_worker.
+    """
+    return _run_node(fkt, [_shared[k] for k in dep_keys], params)
+
+
+class Pipeline:
+    """
+    Dependency graph of cached stages, see the module documentation.
+    """
+
+    def __init__(self, fol_cache=DEFAULT_FOL_CACHE, max_bytes=cache.DEFAULT_MAX_BYTES,
+                 n_jobs=None, executor='process', verbose=True):
+        """
+        Input:
+            fol_cache: folder to store the node outputs
+            max_bytes: maximum size of the stored outputs, least recently
+                       used outputs are evicted
+            n_jobs: number of workers computing nodes in parallel
+                    (default: number of cpus, 1 computes everything in this process)
+            executor: 'process' or 'thread'. Processes need node functions
+                      and outputs that can be pickled, threads must not be
+                      used for nodes drawing with matplotlib.
+            verbose: print what is computed and loaded
+        """
+        if executor not in ('process', 'thread'):
+            raise ValueError(f'Unknown executor: {executor}')
+        self.fol_cache = pathlib.Path(fol_cache)
+        self.max_bytes = max_bytes
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.executor = executor
+        self.verbose = verbose
+        self.nodes = {}
+        # Outputs of this session by key, so reruns do not even load them
+        self._outputs = {}
+        self._keys = {}
+
+    def add(self, name, fkt, deps=(), params=None, sources=(), code=(), cache=True):
+        """
+        Adds a node.
+        Input:
+            name: unique name of the node
+            fkt: function computing the output: fkt(*outputs of deps, **params)
+            deps: names of the nodes whose outputs fkt takes
+            params: dict with keyword arguments of fkt
+            sources: files fkt reads, their content is part of the key
+            code: functions or modules fkt calls, their source code is part
+                  of the key (see cache.hash_code)
+            cache: store the output on disk
+        Returns:
+            name, to be used in deps of other nodes
+        """
+        if name in self.nodes:
+            raise ValueError(f'Node {name} exists already')
+        for d in deps:
+            if d not in self.nodes:
+                raise ValueError(f'Unknown dependency of {name}: {d}')
+        self.nodes[name] = Node(name, fkt, tuple(deps), dict(params or {}), tuple(sources), tuple(code), cache)
+        self._keys = {}
+        return name
+
+    def add_value(self, name, value):
+        """
+        Adds a node with a given output, e.g. data of the notebook session.
+        Its key is the description of the value, see describe.
+        Returns:
+            name
+        """
+        return self.add(name, None, params={'value': value}, cache=False)
+
+    def key(self, name):
+        """
+        Key of a node: hash of its function and code, parameters, sources and the keys of its dependencies.
+        """
+        if name not in self._keys:
+            node = self.nodes[name]
+            h = hashlib.sha256()
+            h.update(repr(PIPELINE_VERSION).encode())
+            h.update(describe(node.fkt).encode())
+            h.update(cache.hash_code(node.code).encode())
+            h.update(describe(node.params).encode())
+            h.update(cache.hash_files(node.sources).encode())
+            for d in node.deps:
+                h.update(self.key(d).encode())
+            self._keys[name] = h.hexdigest()[:32]
+        return self._keys[name]
+
+    def _fn(self, key):
+        return self.fol_cache / f'{key}.pkl'
+
+    def _is_available(self, name):
+        key = self.key(name)
+        if self.nodes[name].fkt is None:
+            self._outputs.setdefault(key, self.nodes[name].params['value'])
+            return True
+        return key in self._outputs or (self.nodes[name].cache and self._fn(key).exists())
+
+    def _load(self, name):
+        key = self.key(name)
+        if key not in self._outputs:
+            fn = self._fn(key)
+            with open(fn, 'rb') as f:
+                self._outputs[key] = pickle.load(f)
+            # Mark as recently used
+            os.utime(fn)
+        return self._outputs[key]
+
+    def _store(self, name, out):
+        key = self.key(name)
+        self._outputs[key] = out
+        if not self.nodes[name].cache:
+            return
+        self.fol_cache.mkdir(parents=True, exist_ok=True)
+        fn_tmp = self.fol_cache / f'.tmp-{uuid.uuid4().hex}.pkl'
+        with open(fn_tmp, 'wb') as f:
+            pickle.dump(out, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fn_tmp, self._fn(key))
+        cache.evict(self.fol_cache, max_bytes=self.max_bytes, keep=(self._fn(key).name,))
+
+    def plan(self, targets=None):
+        """
+        Nodes needed for the targets.
+        Input:
+            targets: names of the nodes to get (default: all)
+        Returns:
+            (nodes to compute, nodes to load), in dependency order
+        """
+        targets = list(self.nodes) if targets is None else list(targets)
+        compute, load = [], []
+
+        def visit(name):
+            if name in compute or name in load:
+                return
+            if self._is_available(name):
+                load.append(name)
+                return
+            for d in self.nodes[name].deps:
+                visit(d)
+            compute.append(name)
+
+        for name in targets:
+            visit(name)
+        return compute, load
+
+    def run(self, targets=None):
+        """
+        Computes the invalidated nodes needed for the targets,
+        running independent nodes in parallel.
+        Input:
+            targets: names of the nodes to get (default: all)
+        Returns:
+            dict name -> output for the targets
+        """
+        targets = list(self.nodes) if targets is None else list(targets)
+        compute, load = self.plan(targets)
+        if self.verbose and compute:
+            print(f'Computing {len(compute)} nodes: {", ".join(compute)}')
+        # Only load outputs that are targets or inputs of computed nodes
+        needed = set(targets) | {d for name in compute for d in self.nodes[name].deps}
+        for name in load:
+            if name in needed:
+                with trace.stage(f'load {name}'):
+                    self._load(name)
+        if self.n_jobs == 1 or len(compute) <= 1:
+            for name in compute:
+                self._compute_inline(name)
+        else:
+            self._compute_parallel(compute)
+        return {name: self._outputs[self.key(name)] for name in targets}
+
+    def _args(self, name):
+        return [self._outputs[self.key(d)] for d in self.nodes[name].deps]
+
+    def _finish(self, name, out, seconds):
+        self._store(name, out)
+        if self.verbose:
+            print(f'{name}: {seconds:.2f}s')
+
+    def _compute_inline(self, name):
+        node = self.nodes[name]
+        with trace.stage(name):
+            out, seconds = _run_node(node.fkt, self._args(name), node.params)
+        self._finish(name, out, seconds)
+
+    def _compute_parallel(self, compute):
+        """
+        Computes the nodes in waves, each wave are the nodes whose dependencies
+        are available. In worker processes, the outputs the nodes of a wave take
+        are passed once to every worker when it starts (as in render.render_figures).
+        """
+        pending = list(compute)
+        with trace.stage(f'compute {len(compute)} nodes'):
+            while pending:
+                wave = [name for name in pending if not set(self.nodes[name].deps) & set(pending)]
+                pending = [name for name in pending if name not in wave]
+                if len(wave) == 1:
+                    self._compute_inline(wave[0])
+                    continue
+                n_workers = min(self.n_jobs, len(wave))
+                if self.executor == 'process':
+                    shared = {self.key(d): self._outputs[self.key(d)]
+                              for name in wave for d in self.nodes[name].deps}
+                    pool = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                                                  initargs=(shared,))
+                else:
+                    pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+                with pool as ex:
+                    running = {}
+                    for name in wave:
+                        node = self.nodes[name]
+                        if self.executor == 'process':
+                            future = ex.submit(_run_shared, node.fkt, [self.key(d) for d in node.deps],
+                                               node.params)
+                        else:
+                            future = ex.submit(_run_node, node.fkt, self._args(name), node.params)
+                        running[future] = name
+                    for future in concurrent.futures.as_completed(running):
+                        out, seconds = future.result()
+                        self._finish(running[future], out, seconds)
@@ -0,0 +1,126 @@
+"""
+Headless batch rendering of ggplot figures in a process pool.
+"""
+import collections
+import concurrent.futures
+import io
+import os
+import pathlib
+import time
+
+import pandas as pd
+
+import helpers.figcache as figcache
+import helpers.trace as trace
+
+# A figure to render: fkt(data, **kwargs) needs to return a ggplot.
+# fkt needs to be importable (a module level function) to be sent to
+# the worker processes.
+FigureSpec = collections.namedtuple('FigureSpec', ['name', 'fkt', 'kwargs'])
+
+# Data of the worker process, set once by _init_worker
+_data = None
+
+
+def _init_worker(data, backend):
+    """
+    Sets a headless matplotlib backend and keeps the data
+    so it is only sent once per worker, not per figure.
+    """
+    global _data
+    import matplotlib
+    matplotlib.use(backend)
+    _data = data
+
+
+def _render(spec, fol_out, formats, dpi, fol_cache):
+    """
+    Renders a single figure in the worker.
+    Returns:
+        dict with timings
+    """
+    import matplotlib.pyplot as plt
+    t0 = time.perf_counter()
+    p = spec.fkt(_data, **spec.kwargs)
+    t_build = time.perf_counter() - t0
+    fns = []
+    n_cached = 0
+    for fmt in formats:
+        fn = pathlib.Path(fol_out) / f'{spec.name}.{fmt}'
+        if fol_cache is None:
+            p.save(fn, dpi=dpi, verbose=False, limitsize=False)
+        else:
+            n_cached += figcache.save_cached(p, fn, figcache.spec_key(spec.fkt, spec.kwargs),
+                                             dpi=dpi, fol_cache=fol_cache)
+        fns.append(str(fn))
+    plt.close('all')
+    return {'name': spec.name,
+            'build_s': t_build,
+            'render_s': time.perf_counter() - t0 - t_build,
+            'total_s': time.perf_counter() - t0,
+            'cached': n_cached == len(formats),
+            'pid': os.getpid(),
+            'files': fns}
+
+
+def figure_image(data, ct=None, fkt=None, kwargs=None, fmt='png', dpi=100):
+    """
+    Renders a figure to an image in memory, e.g. as node of a pipeline.
+    Input:
+        data: the data passed to the figure function
+        ct: optional categorical dtype ordering the cantons, passed as `ct` to fkt
+        fkt, kwargs: the figure function and its arguments, see FigureSpec
+        fmt, dpi: the image format
+    Returns:
+        The image as bytes
+    """
+    import matplotlib.pyplot as plt
+    kwargs = dict(kwargs or {})
+    if ct is not None:
+        kwargs['ct'] = ct
+    buf = io.BytesIO()
+    fkt(data, **kwargs).save(buf, format=fmt, dpi=dpi, verbose=False, limitsize=False)
+    plt.close('all')
+    return buf.getvalue()
+
+
+def render_figures(specs, data, fol_out, formats=('png',), dpi=100,
+                   n_jobs=None, backend='Agg', fol_cache=None, verbose=True):
+    """
+    Renders figures in parallel, each worker process renders
+    complete figures with a headless backend.
+    Input:
+        specs: list of FigureSpec
+        data: the data passed to every figure function
+        fol_out: folder to save the figures to
+        formats: file formats to save, e.g. ('png', 'svg')
+        dpi: resolution for raster formats
+        n_jobs: number of worker processes (default: number of cpus)
+        backend: matplotlib backend used by the workers
+        fol_cache: optional figure cache folder, figures whose
+                   definition and data did not change are not redrawn
+        verbose: print progress
+    Returns:
+        Data frame with the render times per figure
+    """
+    names = [s.name for s in specs]
+    if len(set(names)) != len(names):
+        raise ValueError('Figure names need to be unique')
+    pathlib.Path(fol_out).mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    timings = []
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count(),
+                                                  initializer=_init_worker,
+                                                  initargs=(data, backend))
+    with trace.stage('render') as st, pool as ex:
+        futures = {ex.submit(_render, spec, fol_out, formats, dpi, fol_cache): spec for spec in specs}
+        for future in concurrent.futures.as_completed(futures):
+            timing = future.result()
+            timings.append(timing)
+            if verbose:
+                print(f'{len(timings)}/{len(specs)} {timing["name"]}: {timing["total_s"]:.2f}s'
+                      + (' (cached)' if timing['cached'] else ''))
+        st.set_rows_out(len(timings))
+    if verbose:
+        print(f'Rendered {len(specs)} figures in {time.perf_counter() - t0:.2f}s')
+    return pd.DataFrame(timings)
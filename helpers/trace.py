@@ -0,0 +1,243 @@
+"""
+Opt-in timing and memory instrumentation of pipeline stages.
+
+Stages are marked with the `stage` context manager or the `step` wrapper
+for .pipe chains. Nothing is recorded unless tracing is enabled (see
+`enable` and `run`), disabled stages cost about a function call.
+The records can be saved as a Chrome trace (json), which timeline viewers
+like chrome://tracing, https://ui.perfetto.dev or https://speedscope.app read.
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# The active tracer, None if tracing is disabled
+_tracer = None
+
+
+def _rows(obj):
+    """
+    Number of rows of data frames/series/arrays (or a given number),
+    None for other objects.
+    """
+    if isinstance(obj, int):
+        return obj
+    shape = getattr(obj, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+class _NullStage:
+    """
+    Stage used while tracing is disabled, does nothing.
+    """
+
+    def set_rows_out(self, obj):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    """
+    A running stage, use `stage` to create it.
+    """
+
+    def __init__(self, tracer, name, rows_in):
+        self.tracer = tracer
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def set_rows_out(self, obj):
+        """
+        Records the rows of the output of the stage
+        (a data frame/series/array or the number of rows).
+        """
+        self.rows_out = _rows(obj)
+
+    def __enter__(self):
+        self.tracer._enter(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._exit(self)
+        return False
+
+
+class Tracer:
+    """
+    Records wall time, cpu time, rows in/out and peak allocated memory of stages.
+    """
+
+    def __init__(self, memory=True):
+        """
+        Input:
+            memory: trace the allocations to get the peak memory per stage.
+                    Allocations are only traced within stages, as tracing
+                    slows down code allocating many small objects.
+        """
+        self.memory = memory
+        self.records = []
+        self.t0 = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, st):
+        stack = self._stack()
+        st.depth = len(stack)
+        if self.memory:
+            st.started_tracemalloc = not tracemalloc.is_tracing()
+            if st.started_tracemalloc:
+                tracemalloc.start()
+            st.mem_start = tracemalloc.get_traced_memory()[0]
+            st.mem_peak = st.mem_start
+            if stack:
+                # The peak since the last reset belongs to the parent
+                stack[-1].mem_peak = max(stack[-1].mem_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(st)
+        st.cpu_start = time.process_time()
+        st.wall_start = time.perf_counter()
+
+    def _exit(self, st):
+        wall_end = time.perf_counter()
+        cpu_end = time.process_time()
+        stack = self._stack()
+        stack.pop()
+        record = {'name': st.name,
+                  'start_s': st.wall_start - self.t0,
+                  'wall_s': wall_end - st.wall_start,
+                  'cpu_s': cpu_end - st.cpu_start,
+                  'rows_in': st.rows_in,
+                  'rows_out': st.rows_out,
+                  'depth': st.depth,
+                  'pid': os.getpid(),
+                  'tid': threading.get_ident()}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            st.mem_peak = max(st.mem_peak, peak)
+            record['peak_bytes'] = st.mem_peak - st.mem_start
+            record['delta_bytes'] = current - st.mem_start
+            if stack:
+                stack[-1].mem_peak = max(stack[-1].mem_peak, st.mem_peak)
+            tracemalloc.reset_peak()
+            if st.started_tracemalloc:
+                tracemalloc.stop()
+        self.records.append(record)
+
+    def summary(self):
+        """
+        Data frame with one row per recorded stage, in order of the start.
+        """
+        return pd.DataFrame(self.records).sort_values('start_s').reset_index(drop=True)
+
+    def save(self, fn):
+        """
+        Saves the records as Chrome trace json.
+        """
+        events = []
+        for r in self.records:
+            args = {k: v for k, v in r.items()
+                    if k not in ('name', 'start_s', 'wall_s', 'pid', 'tid') and v is not None}
+            events.append({'name': r['name'], 'ph': 'X', 'cat': 'stage',
+                           'ts': r['start_s'] * 1e6, 'dur': r['wall_s'] * 1e6,
+                           'pid': r['pid'], 'tid': r['tid'], 'args': args})
+        with open(fn, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def enable(memory=True):
+    """
+    Starts recording stages.
+    Returns:
+        The Tracer
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(memory=memory)
+    return _tracer
+
+
+def disable():
+    """
+    Stops recording stages.
+    Returns:
+        The Tracer that was active (None if tracing was disabled)
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def run(fn_trace=None, memory=True):
+    """
+    Records all stages within the block.
+    Input:
+        fn_trace: optional file to save the Chrome trace to
+        memory: see Tracer
+    Yields:
+        The Tracer
+    """
+    tracer = enable(memory=memory)
+    try:
+        yield tracer
+    finally:
+        disable()
+        if fn_trace is not None:
+            tracer.save(fn_trace)
+
+
+def stage(name, data=None):
+    """
+    Context manager recording a stage if tracing is enabled, e.g.:
+        with trace.stage('interpolate', df) as st:
+            ...
+            st.set_rows_out(df_daily)
+    Input:
+        name: name of the stage
+        data: optional input, its number of rows is recorded
+    """
+    if _tracer is None:
+        return _null_stage
+    return _Stage(_tracer, name, _rows(data))
+
+
+def step(name, fkt):
+    """
+    Wraps a function of a data frame for .pipe chains, recording
+    the rows of the first argument and of the result, e.g.:
+        df.pipe(trace.step('normalize', normalize))
+    If tracing is disabled, the function is returned as is.
+    """
+    if _tracer is None:
+        return fkt
+
+    @functools.wraps(fkt)
+    def wrapper(df, *args, **kwargs):
+        with stage(name, df) as st:
+            res = fkt(df, *args, **kwargs)
+            st.set_rows_out(res)
+        return res
+    return wrapper
@@ -0,0 +1,269 @@
+"""
+Loading and preparation of the statistikZH covid19monitoring data
+(https://github.com/statistikZH/covid19monitoring), shared by the
+monitoring notebook and batch jobs.
+
+There are no plotting imports here, so jobs that only compute the tables
+(e.g. the weekday variability) start without loading the plotting stack.
+The figures are in figures.
+"""
+import calendar
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import helpers.monitoring as mon
+import helpers.trace as trace
+
+
+class C:
+    """
+    Helper class to keep input configuration.
+    """
+    fol_zhmonitor = pathlib.Path('./data/monitoring/covid19monitoring/')
+    fn_zhmonitor_data = fol_zhmonitor / 'covid19socialmonitoring.csv'
+    fn_zhmonitor_meta = fol_zhmonitor / 'Metadata.csv'
+
+    day_start = pd.to_datetime('2020-01-06')
+    day_intervention_v1 = pd.to_datetime('2020-02-28')  # First ban of large events
+    day_intervention_v2 = pd.to_datetime('2020-03-13')  # School closures
+    day_intervention_v3 = pd.to_datetime('2020-03-16')  # Lock down
+
+    days_intervention = [day_intervention_v1, day_intervention_v2, day_intervention_v3]
+
+    # Set to a file name to record the timings and memory of the stages as Chrome trace
+    fn_trace = None
+
+
+class V:
+    """
+    Helper class to keep metadata related variables.
+    """
+    # Data columns:
+    COL_VARIABLES = 'variable_short'
+    COL_VALUE = 'value'
+    COL_DATE = 'date'
+    COL_LOCATION = 'location'
+
+    # Main data columns
+    cols_data = [COL_VARIABLES, COL_VALUE, COL_DATE, COL_LOCATION]
+
+    # User data columns
+    COL_DAY = 'day'  # days since 1970-01-01
+    COL_MONTH = 'month'
+    COL_YEAR = 'year'
+    COL_WEEK = 'week'
+    COL_ISWEEKDAY = 'is_weekday'
+    COL_DAYOFWEEK = 'dayofweek'
+    COL_NDAYSWEEK = 'ndays_week'  # number of days of that week the measurement is available
+    COL_HASFULLWEEK = 'fullweek'  # is the measurement available for all days of that week
+    COL_HASCLOSEFULLWEEK = 'almostfullweek'
+
+    COL_VALUE_LOG10 = 'value_log'
+    COL_VALUE_NORM = 'value_norm'
+    COL_BASE_TRAILING = 'baseline_trailing'  # mean of the previous 7 days
+    COL_BASE_CENTERED = 'baseline_centered'  # mean of the previous and next 3 days
+    COL_BASE_WEEKDAY = 'baseline_weekday'  # mean of the same weekday of the previous 4 weeks
+    COL_VALUE_NORM_ROLLING = 'value_norm_rolling'
+    COL_LABEL = 'label'  # facet label, see format_label
+    # Meta columns:
+    COL_TOPIC = 'topic'
+    COL_VAR_DESC = 'variable_long'
+    COL_LOCATION = 'location'
+    COL_UNIT = 'unit'
+    COL_SOURCE = 'source'
+    COL_UPDATE = 'update'
+    COL_PUBLIC = 'public'
+    COL_DESC_LINK = 'description'
+    COL_MODIFIED = 'last_modified'
+
+    # Categorical columns
+    cols_cat = [COL_VARIABLES, COL_VAR_DESC, COL_LOCATION,
+                COL_UNIT, COL_SOURCE, COL_UPDATE, COL_DESC_LINK]
+
+    cols_date = [COL_MODIFIED,
+                 COL_DATE]
+
+    COL_CANTON = 'abbreviation_canton_and_fl'
+
+
+def apply_to_cols(df, cols, fkt, inplace=True):
+    """
+    Applies fkt to the columns of df that are in cols.
+    """
+    if not inplace:
+        df = df.copy()
+    for c in set(cols).intersection(df.columns):
+        df[c] = fkt(df[c])
+    return df
+
+
+def read_monitoring(fn_data=C.fn_zhmonitor_data, fn_meta=C.fn_zhmonitor_meta):
+    """
+    Reads the indicators and their metadata,
+    converting the date and categorical columns.
+    Returns:
+        (indicator data with the columns V.cols_data, metadata)
+    """
+    with trace.stage('load') as st:
+        dat_zhmonitor = pd.read_csv(fn_data)
+        dat_zhmonitor_m = pd.read_csv(fn_meta)
+        st.set_rows_out(dat_zhmonitor)
+    # Delete redundant variables in data
+    dat_zhmonitor = dat_zhmonitor[V.cols_data].copy()
+    with trace.stage('parse dates', dat_zhmonitor):
+        for d in [dat_zhmonitor, dat_zhmonitor_m]:
+            apply_to_cols(d, V.cols_date, pd.to_datetime)
+    with trace.stage('categorize', dat_zhmonitor):
+        for d in [dat_zhmonitor, dat_zhmonitor_m]:
+            apply_to_cols(d, V.cols_cat, pd.Categorical)
+    return dat_zhmonitor, dat_zhmonitor_m
+
+
+def meta_index(dat_zhmonitor_m):
+    """
+    Index of the metadata by indicator, to attach it to the observations without merging.
+    """
+    return mon.MetaIndex(dat_zhmonitor_m, [V.COL_VARIABLES, V.COL_LOCATION])
+
+
+def add_calendar_features(dat_zhmonitor):
+    """
+    Adds the day number, the calendar features and the full week flags.
+    The calendar features are small integer codes derived from the day number,
+    weeks are ISO weeks, so they always go from Monday to Sunday.
+    Returns:
+        Data frame with the added columns
+    """
+    dat_zhmonitor = dat_zhmonitor.copy(deep=False)
+    day = mon.day_numbers(dat_zhmonitor[V.COL_DATE])
+    dat_zhmonitor[V.COL_DAY] = day
+    dat_zhmonitor[V.COL_DAYOFWEEK] = pd.Categorical.from_codes(mon.calendar_codes(day, 'dayofweek'),
+                                                               categories=list(calendar.day_abbr),
+                                                               ordered=True)
+    dat_zhmonitor[V.COL_MONTH] = pd.Categorical.from_codes(mon.calendar_codes(day, 'month'),
+                                                           categories=list(calendar.month_abbr))
+    dat_zhmonitor[V.COL_WEEK] = mon.calendar_codes(day, 'week')
+    dat_zhmonitor[V.COL_YEAR] = mon.calendar_codes(day, 'isoyear')
+    dat_zhmonitor[V.COL_ISWEEKDAY] = mon.calendar_codes(day, 'dayofweek') < 5
+
+    # Count the days with measurements per week once, all flags are derived from this count
+    with trace.stage('fullweek flags', dat_zhmonitor):
+        dat_zhmonitor[V.COL_NDAYSWEEK] = mon.count_finite_per_group(
+            dat_zhmonitor, V.COL_VALUE, [V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES, V.COL_LOCATION])
+    dat_zhmonitor[V.COL_HASFULLWEEK] = dat_zhmonitor[V.COL_NDAYSWEEK] == 7
+    dat_zhmonitor[V.COL_HASCLOSEFULLWEEK] = dat_zhmonitor[V.COL_NDAYSWEEK] >= 5
+    return dat_zhmonitor
+
+
+def aggregate(dat_zhmonitor, index):
+    """
+    Aggregates the observations into a cube of sufficient statistics
+    per (year, week, weekday, indicator, location, topic), see mon.AggCube.
+    Input:
+        dat_zhmonitor: data with the calendar features, see add_calendar_features
+        index: the metadata index, see meta_index
+    """
+    return mon.AggCube(dat_zhmonitor.pipe(index.attach, [V.COL_TOPIC]), V.COL_VALUE,
+                       [V.COL_YEAR, V.COL_WEEK, V.COL_DAYOFWEEK, V.COL_VARIABLES, V.COL_LOCATION, V.COL_TOPIC],
+                       col_date=V.COL_DATE)
+
+
+def weekday_variability(agg_cube, day_end=C.days_intervention[0]):
+    """
+    Variability of the indicators per day of week, over the full weeks before day_end.
+    Input:
+        agg_cube: the aggregated observations, see aggregate
+        day_end: only weeks ending before this day are used (default: before the first intervention)
+    Returns:
+        Data frame with the statistics per (day of week, indicator, topic, location), incl. the
+        coefficient of variation ('cv') and relative to its mean over the week ('cv_norm')
+    """
+    ndays_week = (agg_cube.cells
+                  .groupby(level=[V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES, V.COL_LOCATION], observed=True)
+                  ['count'].transform('sum'))
+    is_used = ((ndays_week == 7)  # only full weeks
+               & (agg_cube.cells['date_last'] < day_end))
+    return (agg_cube.rollup([V.COL_DAYOFWEEK, V.COL_VARIABLES, V.COL_TOPIC, V.COL_LOCATION], is_used)
+            .reset_index()
+            .assign(**{'cv_norm': lambda d: d['cv'] / (d.groupby([V.COL_VARIABLES, V.COL_LOCATION], observed=True)
+                                                       ['cv'].transform('mean'))})
+            )
+
+
+def normalize(dat_zhmonitor):
+    """
+    Adds the log10 values and the values normalized by their calendar week average.
+    """
+    with trace.stage('normalize', dat_zhmonitor):
+        return dat_zhmonitor.assign(**{
+            V.COL_VALUE_LOG10: lambda x: np.log10(x[V.COL_VALUE]),
+            # Alternatively normalize the log values by the weekday average only:
+            # V.COL_VALUE_NORM:
+            # lambda d: mon.normalize_per_group(d, V.COL_VALUE, [V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES],
+            #                                   col_mask=V.COL_ISWEEKDAY, log=True)
+            V.COL_VALUE_NORM:
+                lambda d: mon.normalize_per_group(d, V.COL_VALUE, [V.COL_YEAR, V.COL_WEEK, V.COL_VARIABLES],
+                                                  method='mean')})
+
+
+def rolling_baselines(dat_zhmonitor):
+    """
+    Adds rolling baselines per indicator and location: the mean of the previous 7 days,
+    the mean over the previous and next days and the mean of the same weekday over
+    the previous weeks. Missing days are ignored, the windows are in days (not rows).
+    """
+    series_cols = [V.COL_VARIABLES, V.COL_LOCATION]
+
+    def roll(d, window, **kwargs):
+        return mon.rolling_per_series(d, V.COL_VALUE, V.COL_DATE, series_cols, window, **kwargs)[0]
+
+    return dat_zhmonitor.assign(**{
+        V.COL_BASE_TRAILING: lambda d: roll(d, 7, exclude_current=True, min_periods=4),
+        V.COL_BASE_CENTERED: lambda d: roll(d, 7, center=True, min_periods=4),
+        V.COL_BASE_WEEKDAY: lambda d: roll(d, 4, stride=7, exclude_current=True, min_periods=2),
+        V.COL_VALUE_NORM_ROLLING: lambda d: d[V.COL_VALUE] / d[V.COL_BASE_CENTERED]
+    })
+
+
+def format_label(r):
+    """
+    Facet label of an indicator, computed once per metadata row
+    """
+    return f'{r[V.COL_VARIABLES]}\n{r[V.COL_VAR_DESC]}\n{r[V.COL_LOCATION]}\nin {r[V.COL_UNIT]}'
+
+
+def plot_data(dat_zhmonitor, index, day_start=C.day_start):
+    """
+    The normalized values of the (almost) full weeks since day_start, with
+    the metadata and facet labels attached, as used by the weekly plots.
+    Input:
+        dat_zhmonitor: normalized data, see normalize
+        index: the metadata index, see meta_index
+        day_start: first day to include
+    """
+    return (dat_zhmonitor
+            .query(f'{V.COL_HASCLOSEFULLWEEK} == True')
+            .pipe(lambda d: d.loc[d[V.COL_DATE] >= day_start, :])
+            .pipe(lambda d: d.loc[np.isfinite(d[V.COL_VALUE_NORM]), :])  # only finite
+            .pipe(index.attach, [V.COL_VAR_DESC, V.COL_UNIT, V.COL_TOPIC])
+            .assign(**{V.COL_LABEL: lambda x: index.labels(x, format_label)})
+            )
+
+
+def load_monitoring(fn_data=C.fn_zhmonitor_data, fn_meta=C.fn_zhmonitor_meta):
+    """
+    Reads and prepares the monitoring data as in the monitoring notebook.
+    Returns:
+        dict with the prepared data ('dat_zhmonitor'), the metadata ('dat_zhmonitor_m'),
+        the weekday variability ('tdat') and the data of the weekly plots ('pdat')
+    """
+    dat_zhmonitor, dat_zhmonitor_m = read_monitoring(fn_data, fn_meta)
+    index = meta_index(dat_zhmonitor_m)
+    dat_zhmonitor = add_calendar_features(dat_zhmonitor)
+    tdat = weekday_variability(aggregate(dat_zhmonitor, index))
+    dat_zhmonitor = normalize(dat_zhmonitor)
+    pdat = plot_data(dat_zhmonitor, index)
+    return {'dat_zhmonitor': rolling_baselines(dat_zhmonitor), 'dat_zhmonitor_m': dat_zhmonitor_m,
+            'tdat': tdat, 'pdat': pdat}
@@ -0,0 +1,53 @@
+"""
+Renders all figures of the Swiss case overview headless and in parallel.
+
+Usage (from the repository root):
+    python render_report.py --out figures --formats png svg --jobs 4
+    python render_report.py --trace trace.json  # timings of the stages, e.g. for https://ui.perfetto.dev
+"""
+import argparse
+
+# The plotting stack is only imported by the render workers,
+# which use a headless matplotlib backend (see render.render_figures)
+import helpers.cases as cases
+import helpers.figcache as figcache
+import helpers.figures as figures
+import helpers.render as render
+import helpers.trace as trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--out', default='figures', help='output folder')
+    parser.add_argument('--formats', nargs='+', default=['png'])
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of cpus)')
+    parser.add_argument('--cache', default=figcache.DEFAULT_FOL_CACHE,
+                        help='figure cache folder, unchanged figures are not redrawn')
+    parser.add_argument('--no-cache', action='store_true', help='redraw all figures')
+    parser.add_argument('--trace', default=None,
+                        help='save the timings and memory of the stages to this Chrome trace file')
+    args = parser.parse_args()
+
+    if args.trace:
+        trace.enable()
+    data = cases.load_cases_cached()
+    data['dat_long'] = cases.long_view(data['dat_daily'])
+    orderings = {'alphabetical': None,
+                 'deceased': cases.order_cantons(data['dat_daily'])}
+    timings = render.render_figures(figures.report_specs(orderings), data, args.out,
+                                    formats=args.formats, dpi=args.dpi, n_jobs=args.jobs,
+                                    fol_cache=None if args.no_cache else args.cache)
+    if args.trace:
+        tracer = trace.disable()
+        tracer.save(args.trace)
+        print(tracer.summary().to_string(index=False))
+    print(timings.sort_values('total_s', ascending=False)
+          [['name', 'build_s', 'render_s', 'total_s', 'cached']]
+          .head(10)
+          .to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()